@@ -0,0 +1,194 @@
+"""Structured store of the benchmark sweep results.
+
+Every measurement is a row keyed by (program, mesh size, halo, config, step)
+in a SQLite database, together with its timings and stream list; a second
+table tracks which cells of the sweep are done so that an interrupted sweep
+resumes where it stopped. SQLite serializes the writes of concurrent cells.
+
+The figure scripts read the store through ``load_performance`` and
+``load_streamlists``, which return the same nested dicts as the JSON files
+written by ``parsing_performance.py`` (and still accept those files), from
+the path ``results_path`` picks.
+"""
+import json
+import os
+import sqlite3
+import time
+from collections import namedtuple
+
+
+Cell = namedtuple("Cell", ["program", "mesh_size", "halo", "config"])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    program TEXT NOT NULL,
+    mesh_size INTEGER NOT NULL,
+    halo INTEGER NOT NULL,
+    config TEXT NOT NULL,
+    step TEXT NOT NULL,
+    performance REAL,
+    predicted REAL,
+    error TEXT,
+    streamlist TEXT,
+    timings TEXT,
+    recorded REAL,
+    PRIMARY KEY (program, mesh_size, halo, config, step)
+);
+CREATE TABLE IF NOT EXISTS cells (
+    program TEXT NOT NULL,
+    mesh_size INTEGER NOT NULL,
+    halo INTEGER NOT NULL,
+    config TEXT NOT NULL,
+    status TEXT NOT NULL,
+    started REAL,
+    finished REAL,
+    error TEXT,
+    PRIMARY KEY (program, mesh_size, halo, config)
+);
+"""
+
+FIELDS = ("performance", "predicted", "error", "streamlist", "timings")
+
+
+class ResultStore:
+    """A results database, opened once per process."""
+
+    def __init__(self, path, timeout=600):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=timeout)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def record(self, cell, step, **fields):
+        """Insert or update the row of ``step``; fields left out are kept."""
+        unknown = set(fields) - set(FIELDS)
+        if unknown:
+            raise ValueError(f"unknown result fields {sorted(unknown)}")
+        values = {name: fields.get(name) for name in FIELDS}
+        for name in ("streamlist", "timings"):
+            if values[name] is not None:
+                values[name] = json.dumps(values[name])
+        updates = ", ".join(f"{name} = COALESCE(excluded.{name}, {name})" for name in FIELDS)
+        with self.conn:
+            self.conn.execute(
+                f"INSERT INTO results VALUES (?, ?, ?, ?, ?, {', '.join('?' * len(FIELDS))}, ?) "
+                f"ON CONFLICT (program, mesh_size, halo, config, step) DO UPDATE SET {updates}, recorded = excluded.recorded",
+                tuple(cell) + (str(step),) + tuple(values[name] for name in FIELDS) + (time.time(),),
+            )
+
+    def recorder(self, cell):
+        """A ``recorder(step, **fields)`` callback bound to ``cell``.
+
+        It is a plain closure so that ``copy.deepcopy`` of the code generator
+        holding it shares the store instead of copying the connection.
+        """
+
+        def record(step, **fields):
+            self.record(cell, step, **fields)
+
+        return record
+
+    def start_cell(self, cell):
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO cells VALUES (?, ?, ?, ?, 'running', ?, NULL, NULL)",
+                tuple(cell) + (time.time(),),
+            )
+
+    def finish_cell(self, cell, error=None):
+        with self.conn:
+            self.conn.execute(
+                "UPDATE cells SET status = ?, finished = ?, error = ? "
+                "WHERE program = ? AND mesh_size = ? AND halo = ? AND config = ?",
+                ("failed" if error else "done", time.time(), error) + tuple(cell),
+            )
+
+    def done(self, cell):
+        row = self.conn.execute(
+            "SELECT status FROM cells WHERE program = ? AND mesh_size = ? AND halo = ? AND config = ?",
+            tuple(cell),
+        ).fetchone()
+        return row is not None and row[0] == "done"
+
+    def rows(self, **where):
+        """All result rows matching the ``column=value`` filters, as dicts."""
+        query = "SELECT * FROM results"
+        if where:
+            query += " WHERE " + " AND ".join(f"{name} = ?" for name in where)
+        cursor = self.conn.execute(query, tuple(where.values()))
+        names = [d[0] for d in cursor.description]
+        result = []
+        for row in cursor:
+            row = dict(zip(names, row))
+            for name in ("streamlist", "timings"):
+                if row[name] is not None:
+                    row[name] = json.loads(row[name])
+            result.append(row)
+        return result
+
+
+def method_name(step):
+    """The key ``parsing_performance.py`` gives a step."""
+    return f"StencilG-step-{step}" if step.isdigit() else step
+
+
+def performance_dict(rows):
+    """``{program: {mesh_size: {method: performance}}}`` of measured rows."""
+    result = {}
+    for row in rows:
+        if row["performance"] is None:
+            continue
+        mesh = result.setdefault(row["program"], {}).setdefault(str(row["mesh_size"]), {})
+        mesh[method_name(row["step"])] = row["performance"]
+    return result
+
+
+def streamlist_dict(rows):
+    """``{program: {mesh_size: {fuse_step: streamlist}}}`` of measured rows."""
+    result = {}
+    for row in rows:
+        if row["streamlist"] is None:
+            continue
+        if row["step"] == "parallel-max":
+            fuse_step = "0"
+        elif row["step"].isdigit():
+            fuse_step = row["step"]
+        else:
+            continue
+        mesh = result.setdefault(row["program"], {}).setdefault(str(row["mesh_size"]), {})
+        mesh[fuse_step] = str(row["streamlist"])
+    return result
+
+
+def _load(path, view):
+    if path.endswith(".json"):
+        with open(path, "r") as f:
+            return json.load(f)
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    store = ResultStore(path)
+    try:
+        return view(store.rows())
+    finally:
+        store.close()
+
+
+def load_performance(path):
+    """Read a results store, or a ``performance_*.json`` of ``parsing_performance.py``."""
+    return _load(path, performance_dict)
+
+
+def load_streamlists(path):
+    """Read a results store, or a ``streamlist_*.json`` of ``parsing_performance.py``."""
+    return _load(path, streamlist_dict)
+
+
+def results_path(default):
+    """The results to plot: the store in ``STENCIL_RESULTS``, ``default`` otherwise.
+
+    ``default`` is usually a JSON file exported by ``parsing_performance.py``.
+    """
+    return os.environ.get("STENCIL_RESULTS", default)
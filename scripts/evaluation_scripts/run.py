@@ -3,6 +3,8 @@ import tvm
 from tvm import relay
 from tvm.relay.transform.dnn_fusion import StencilFuseOps, MappingType, PrintOpType, register_tag_pattern
 from tvm.relay.transform.mlir import BuildGraph, MLIRCodeGen
+from tvm.relay.transform.cost_model import CostModel
+from tvm.relay.transform.tracing import TRACER
 from change import gen_mlir_file
 import os
 import shutil
@@ -29,6 +31,18 @@ mlir_file_list = [x for x in sorted(os.listdir()) if x.endswith('.mlir')]
 
 HALO_WIDTH = 8
 cwd = os.getcwd()
+# 标定过的代价模型（python -m tvm.relay.transform.cost_model 生成），存在时搜索只实测预测最快的几步
+COST_MODEL = os.path.join(cwd, "cost_model.json")
+cost_model = CostModel.load(COST_MODEL) if os.path.exists(COST_MODEL) else None
+# mlir: open-earth 编译到 GPU；llvm: TE compute 在 CPU 上构建运行
+BACKEND = os.environ.get("STENCIL_BACKEND", "mlir")
+# 时间步展开的步数与主机端循环次数，输出按顺序回填到输入
+TIMESTEPS = int(os.environ.get("STENCIL_TIMESTEPS", "1"))
+RUN_STEPS = int(os.environ.get("STENCIL_RUN_STEPS", "1"))
+# 网格元素类型 f64/f32，f32 时打印相对 f64 的最大误差
+PRECISION = os.environ.get("STENCIL_PRECISION", "f64")
+# 为数据库里没有的 kernel 搜索分块，结果按 kernel 内容哈希存入 STENCIL_TUNING_DB
+TUNE_TILES = os.environ.get("STENCIL_TUNE_TILES", "0") == "1"
 tag_list = ["StencilG", "baseline", "fuse-max", "parallel-max"]
 def is_runned(f, index, mesh_size, halo_width, dirs):
     if index == 0:
@@ -41,6 +55,8 @@ def is_runned(f, index, mesh_size, halo_width, dirs):
 
 def bench():
     global HALO_WIDTH
+    # 每个程序写一份 trace.json，不设 STENCIL_TRACE 也记录
+    TRACER.enabled = True
     for f in mlir_file_list:
         assert f.endswith('.mlir')
         try:
@@ -56,33 +72,31 @@ def bench():
         single_bench_start = time.time()
         shutil.copy(os.path.join(cwd, 'util.h'), os.path.join(cwd, f[:-5]))
         print(f'run {f[:-5]}')
-        for mesh_size in mesh_size_list:
-            mlir_code = gen_mlir_file(os.path.join(cwd, f), 64, 4, mesh_size, HALO_WIDTH)
-            # with open(f"inline-{mesh_size}.mlir", 'w') as ff:
-            #     print(mlir_code, file=ff)
-            #     continue
-            mlir_code = mlir_code.split("\n")
-            os.chdir(os.path.join(cwd, f[:-5]))
-            config_list = [(1, 1, 0), (0, 0, 0), (0, 0, 1), (0, 1, 0)]
-            # config_list = [(1, 1, 0)]
-
-            for index, config in enumerate(config_list):
-                # print(mlir_code)
-                # if is_runned(f, index, mesh_size, HALO_WIDTH, os.listdir()):
-                #     continue
-                codegen = MLIRCodeGen(mesh_size, HALO_WIDTH,FUSION = config[0], STREAM = config[1], INLINE = config[2], output_on=False)
-
-                codegen.from_mlir(copy.copy(mlir_code), f[:-5])
-                try:
-                    codegen.fuse_op()
-                except KeyboardInterrupt as interrupt:
-                    raise interrupt
-                except Exception as e:
-                    print(f"config FUSION, STREAM, INLINE = {config} encounter a problem; continue to run")
-                    print(e)
+        # 只在第一个网格大小上解析并搜索融合方案，其余大小复用搜索得到的方案
+        mlir_code = gen_mlir_file(os.path.join(cwd, f), 64, 4, mesh_size_list[0], HALO_WIDTH)
+        mlir_code = mlir_code.split("\n")
+        os.chdir(os.path.join(cwd, f[:-5]))
+        config_list = [(1, 1, 0), (0, 0, 0), (0, 0, 1), (0, 1, 0)]
+        # config_list = [(1, 1, 0)]
+
+        for index, config in enumerate(config_list):
+            codegen = MLIRCodeGen(mesh_size_list[0], HALO_WIDTH,FUSION = config[0], STREAM = config[1], INLINE = config[2], output_on=False, cost_model=cost_model, backend=BACKEND, timesteps=TIMESTEPS, run_steps=RUN_STEPS, precision=PRECISION, tune_tiles=TUNE_TILES)
+
+            codegen.from_mlir(copy.copy(mlir_code), f[:-5])
+            try:
+                codegen.fuse_op_sizes(mesh_size_list)
+            except KeyboardInterrupt as interrupt:
+                raise interrupt
+            except Exception as e:
+                print(f"config FUSION, STREAM, INLINE = {config} encounter a problem; continue to run")
+                print(e)
         os.mkdir(os.path.join(cwd, f[:-5], "done"))
         single_bench_end = time.time()
         print(f"bench {f[:-5]} spend {single_bench_end - single_bench_start}s")
+        # 各阶段耗时：trace.json 可在 chrome://tracing 或 Perfetto 中打开
+        TRACER.write(os.path.join(cwd, f[:-5], "trace.json"))
+        print(TRACER.format_summary())
+        TRACER.clear()
         f_stdout.close()
 
 
@@ -1 +0,0 @@
-oec-opt --canonicalize --stencil-shape-inference --stencil-storage-materialization $1
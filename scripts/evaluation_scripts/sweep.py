@@ -0,0 +1,173 @@
+"""Resumable benchmark sweep over programs x mesh sizes x configs.
+
+Every (program, mesh size, halo, config) cell writes its results to a
+``ResultStore``; cells already done are skipped when the sweep is restarted,
+failed or interrupted ones run again. The cells of a (program, halo, config)
+run together in one directory and process: the program is parsed and its
+fusion searched once, at the first mesh size, and the plans of the search are
+re-ranked and measured at the others (``MLIRCodeGen.fuse_op_sizes``).
+
+    python sweep.py --store results.db --jobs 2 s10-i10-o4-e28.mlir hori.mlir
+
+Cell groups run concurrently up to ``--jobs``. Measurements of concurrent cells
+share the GPU, so keep ``--jobs 1`` for numbers that go into a paper and
+raise it for smoke runs or the cpu and llvm backends.
+"""
+import argparse
+import contextlib
+import os
+import shutil
+import sys
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from results_store import Cell, ResultStore
+
+
+MESH_SIZES = [64, 128, 256, 512]
+# config -> (FUSION, STREAM, INLINE)
+CONFIGS = {
+    "StencilG": (1, 1, 0),
+    "baseline": (0, 0, 0),
+    "open-earth": (0, 0, 1),
+    "parallel-max": (0, 1, 0),
+}
+
+
+def default_halo(program):
+    return 16 if program.startswith("hori") else 8
+
+
+def default_configs(program):
+    # 与 run_real.py 一致，hori 不跑 open-earth
+    if program.startswith("hori"):
+        return [c for c in CONFIGS if c != "open-earth"]
+    return list(CONFIGS)
+
+
+@contextlib.contextmanager
+def redirect_output(path):
+    """Send this process' stdout, including the compilers', to ``path``."""
+    sys.stdout.flush()
+    saved = os.dup(1)
+    with open(path, "a") as log:
+        os.dup2(log.fileno(), 1)
+        try:
+            with contextlib.redirect_stdout(log):
+                yield log
+        finally:
+            sys.stdout.flush()
+            os.dup2(saved, 1)
+            os.close(saved)
+
+
+def run_cells(store_path, root, cells, options):
+    """Run the cells of one (program, halo, config) in a worker process.
+
+    Returns ``(cells, error)``.
+    """
+    from tvm.relay.transform.mlir import MLIRCodeGen
+    from tvm.relay.transform.cost_model import CostModel
+    from tvm.relay.transform.tracing import TRACER
+    from change import gen_mlir_file
+
+    program, _, halo, config = cells[0]
+    mesh_sizes = [cell.mesh_size for cell in cells]
+    cell_dir = os.path.join(root, program, f"{halo}-{config}")
+    os.makedirs(cell_dir, exist_ok=True)
+    if os.path.exists(os.path.join(root, "util.h")):
+        shutil.copy(os.path.join(root, "util.h"), cell_dir)
+    store = ResultStore(store_path)
+    for cell in cells:
+        store.start_cell(cell)
+    error = None
+    cwd = os.getcwd()
+    # worker 进程会被复用，每组单元格的 trace 单独写
+    TRACER.enabled = True
+    TRACER.clear()
+    try:
+        with redirect_output(os.path.join(cell_dir, "log.txt")):
+            try:
+                mlir_code = gen_mlir_file(os.path.join(root, program + ".mlir"), 64, 4, mesh_sizes[0], halo)
+                os.chdir(cell_dir)
+                fusion, stream, inline = CONFIGS[config]
+                cost_model = CostModel.load(options["cost_model"]) if options.get("cost_model") else None
+                codegen = MLIRCodeGen(
+                    mesh_sizes[0],
+                    halo,
+                    FUSION=fusion,
+                    STREAM=stream,
+                    INLINE=inline,
+                    output_on=False,
+                    cost_model=cost_model,
+                    backend=options.get("backend", "mlir"),
+                    precision=options.get("precision", "f64"),
+                )
+                codegen.from_mlir(mlir_code.split("\n"), program)
+                codegen.fuse_op_sizes(mesh_sizes, {cell.mesh_size: store.recorder(cell) for cell in cells})
+            except Exception as err:  # pylint: disable=broad-except
+                traceback.print_exc(file=sys.stdout)
+                error = repr(err)
+            TRACER.write(os.path.join(cell_dir, "trace.json"))
+            print(TRACER.format_summary())
+    finally:
+        os.chdir(cwd)
+        for cell in cells:
+            store.finish_cell(cell, error)
+        store.close()
+    return cells, error
+
+
+def plan_cells(programs, mesh_sizes, configs=None, halo=None):
+    cells = []
+    for program in programs:
+        for mesh_size in mesh_sizes:
+            for config in configs or default_configs(program):
+                cells.append(Cell(program, mesh_size, halo or default_halo(program), config))
+    return cells
+
+
+def sweep(store_path, root, cells, jobs=1, options=None):
+    """Run every cell not yet done in the store, ``jobs`` at a time."""
+    store = ResultStore(store_path)
+    todo = [cell for cell in cells if not store.done(cell)]
+    store.close()
+    print(f"{len(cells) - len(todo)} of {len(cells)} cells already done, running {len(todo)}")
+    # 同一 (program, halo, config) 的各网格大小共用一次搜索
+    groups = {}
+    for cell in todo:
+        groups.setdefault((cell.program, cell.halo, cell.config), []).append(cell)
+    failed = []
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(run_cells, store_path, root, group, options or {}) for group in groups.values()]
+        for future in as_completed(futures):
+            group, error = future.result()
+            for cell in group:
+                print(f"{'failed' if error else 'done'}: {tuple(cell)}" + (f" {error}" if error else ""))
+            if error:
+                failed.extend(group)
+    return failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the benchmark sweep into a results store.")
+    parser.add_argument("programs", nargs="*", help="mlir files, all *.mlir in the directory by default")
+    parser.add_argument("--store", default="results.db")
+    parser.add_argument("--jobs", type=int, default=1, help="cells run concurrently")
+    parser.add_argument("--mesh-sizes", type=int, nargs="+", default=MESH_SIZES)
+    parser.add_argument("--configs", nargs="+", choices=list(CONFIGS))
+    parser.add_argument("--halo", type=int, help="halo width, 16 for hori and 8 otherwise by default")
+    parser.add_argument("--backend", default=os.environ.get("STENCIL_BACKEND", "mlir"), choices=["mlir", "cpu", "llvm"])
+    parser.add_argument("--precision", default=os.environ.get("STENCIL_PRECISION", "f64"), choices=["f64", "f32"],
+                        help="element type of the grids; use a separate store per precision")
+    parser.add_argument("--cost-model", default="cost_model.json" if os.path.exists("cost_model.json") else None)
+    args = parser.parse_args()
+
+    root = os.getcwd()
+    files = args.programs or sorted(f for f in os.listdir(root) if f.endswith(".mlir"))
+    programs = [os.path.basename(f)[:-5] for f in files]
+    cells = plan_cells(programs, args.mesh_sizes, args.configs, args.halo)
+    options = {"backend": args.backend, "precision": args.precision, "cost_model": args.cost_model and os.path.abspath(args.cost_model)}
+    failed = sweep(os.path.abspath(args.store), root, cells, args.jobs, options)
+    sys.exit(1 if failed else 0)
@@ -7,8 +7,17 @@
 
 #include <iostream>
 #include <array>
+#include <cmath>
+#include <cstdio>
+#include <cstdlib>
+#include <cstring>
+#include <string>
+#include <vector>
+// STENCIL_CPU_ONLY: CPU 主程序 (CpuGenMain) 不链接 CUDA，只用主机端的存储函数
+#ifndef STENCIL_CPU_ONLY
 #include <cuda_runtime.h>
 #include <cuda.h>
+#endif
 
 #define EARTH_RADIUS ((ElementType)6371.229e3) // radius of the earth
 #define EARTH_RADIUS_RECIP ((ElementType)1.0 / EARTH_RADIUS)
@@ -145,6 +154,7 @@ void freeStorage(Storage &ref) {
     ref.alignedPtr = nullptr;
 }
 
+#ifndef STENCIL_CPU_ONLY
 template <typename Storage>
 void freeDeviceStorage(Storage &ref) {
     cudaFree(ref.allocatedPtr);
@@ -179,6 +189,7 @@ void memD2H(Storage &ref) {
     ref.allocatedPtr = hostPtr;
     ref.alignedPtr = &ref.allocatedPtr[(32 - halo_width)];
 }
+#endif // STENCIL_CPU_ONLY
 
 void fillMath(ElementType a, ElementType b, ElementType c, ElementType d,
               ElementType e, ElementType f, Storage3D &field, const int32_t domain_size, const int32_t domain_height) {
@@ -228,5 +239,106 @@ void initValue(Storage3D &ref, const ElementType val, const int32_t domain_size,
             }
 }
 
+// 计时参数由 Evaluate 通过环境变量传入，未设置时与单次运行相同
+int envInt(const char *name, int value) {
+    const char *env = std::getenv(name);
+    return env ? std::atoi(env) : value;
+}
+
+// 把计时样本 (ms) 以 JSON 写到 STENCIL_TIMING_FILE，供 timing.read_samples 读取
+void writeTiming(int warmup, const std::vector<double> &samples) {
+    const char *path = std::getenv("STENCIL_TIMING_FILE");
+    if (path == nullptr) {
+        return;
+    }
+    FILE *f = fopen(path, "w");
+    if (f == nullptr) {
+        return;
+    }
+    fprintf(f, "{\"warmup\": %d, \"samples\": [", warmup);
+    for (size_t i = 0; i < samples.size(); i++) {
+        fprintf(f, i ? ", %.9g" : "%.9g", samples[i]);
+    }
+    fprintf(f, "]}\n");
+    fclose(f);
+}
+
+// 输出写到 STENCIL_OUTPUT_DIR（默认当前目录），设为空串时不写，见 stencil_outputs.py
+bool outputPath(const char *name, const char *ext, std::string &path) {
+    const char *dir = std::getenv("STENCIL_OUTPUT_DIR");
+    if (dir == nullptr) {
+        dir = ".";
+    }
+    if (*dir == '\0') {
+        return false;
+    }
+    path = std::string(dir) + "/" + name + ext;
+    return true;
+}
+
+// 内部点按 (i, j, k) 的 C 顺序写成 .npy，可直接 np.load(mmap_mode="r")
+void writeNpy(const char *name, Storage3D &ref) {
+    std::string path;
+    if (!outputPath(name, ".npy", path)) {
+        return;
+    }
+    FILE *f = fopen(path.c_str(), "wb");
+    if (f == nullptr) {
+        std::cerr << "cannot write " << path << std::endl;
+        exit(1);
+    }
+    char header[128];
+    int length = snprintf(header, sizeof(header), "{'descr': '<f%d', 'fortran_order': False, 'shape': (%d, %d, %d), }",
+                          (int)sizeof(ElementType), domain_size, domain_size, domain_height);
+    // magic(6) + 版本(2) + 头长度(2) + 头，补空格到 64 字节对齐，以换行结尾
+    int padded = (10 + length + 1 + 63) / 64 * 64 - 10;
+    memset(header + length, ' ', padded - length - 1);
+    header[padded - 1] = '\n';
+    fwrite("\x93NUMPY\x01\x00", 1, 8, f);
+    unsigned char size[2] = {(unsigned char)(padded & 0xff), (unsigned char)(padded >> 8)};
+    fwrite(size, 1, 2, f);
+    fwrite(header, 1, padded, f);
+    std::vector<ElementType> row(domain_height);
+    for (int i = 0; i < domain_size; i++)
+        for (int j = 0; j < domain_size; j++) {
+            for (int k = 0; k < domain_height; k++) {
+                row[k] = ref(i, j, k);
+            }
+            fwrite(row.data(), sizeof(ElementType), domain_height, f);
+        }
+    fclose(f);
+}
+
+// 只写内部点的和、L2 范数与最大绝对值
+void writeChecksum(const char *name, Storage3D &ref) {
+    std::string path;
+    if (!outputPath(name, ".checksum.json", path)) {
+        return;
+    }
+    double sum = 0.0, sum_abs = 0.0, sum_sq = 0.0, max_abs = 0.0;
+    long nan = 0;
+    for (int i = 0; i < domain_size; i++)
+        for (int j = 0; j < domain_size; j++)
+            for (int k = 0; k < domain_height; k++) {
+                double v = ref(i, j, k);
+                if (std::isnan(v)) {
+                    nan++;
+                    continue;
+                }
+                sum += v;
+                sum_abs += std::fabs(v);
+                sum_sq += v * v;
+                max_abs = std::fmax(max_abs, std::fabs(v));
+            }
+    FILE *f = fopen(path.c_str(), "w");
+    if (f == nullptr) {
+        std::cerr << "cannot write " << path << std::endl;
+        exit(1);
+    }
+    fprintf(f, "{\"shape\": [%d, %d, %d], \"sum\": %.17g, \"sum_abs\": %.17g, \"l2\": %.17g, \"max_abs\": %.17g, \"nan\": %ld}\n",
+            domain_size, domain_size, domain_height, sum, sum_abs, std::sqrt(sum_sq), max_abs, nan);
+    fclose(f);
+}
+
 #endif // UTIL_H
 
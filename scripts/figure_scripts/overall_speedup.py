@@ -1,4 +1,7 @@
-import json
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "evaluation_scripts"))
+from results_store import load_performance, results_path
 import matplotlib.pyplot as plt
 import numpy as np
 
@@ -16,9 +19,8 @@ def compute_speedup(data):
 sum = {"64":0, "128":0, "256":0, "512":0}
 
 if __name__ == "__main__":
-    filename = "../../test_cases/performance_v100.json"
-    with open(filename, "r") as f:
-        data = json.load(f)
+    filename = results_path("../../test_cases/performance_v100.json")
+    data = load_performance(filename)
     # filter stencil
     stencil_list = [
        's10-i9-o4-e26', 's10-i10-o4-e28', 's10-i10-o4-e29-1','s10-i12-o2-e35',   
@@ -1,4 +1,7 @@
-import json
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "evaluation_scripts"))
+from results_store import load_performance, results_path
 from matplotlib.font_manager import FontProperties
 import matplotlib.pyplot as plt
 import numpy as np
@@ -34,10 +37,9 @@ def plot_subfig(data, x, y, ax, x_offset):
 
 if __name__ == "__main__":
     
-    filename = "../../test_cases/performance_v100.json"
+    filename = results_path("../../test_cases/performance_v100.json")
     outname = "eva-overall-performace-v100.pdf"
-    with open(filename, "r") as f:
-        data = json.load(f)
+    data = load_performance(filename)
     # filter stencil
     VOERALL = 0
     stencil_list = [
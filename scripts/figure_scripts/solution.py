@@ -1,4 +1,7 @@
-import json
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "evaluation_scripts"))
+from results_store import load_performance, load_streamlists, results_path
 import matplotlib.pyplot as plt
 import numpy as np
 import functools
@@ -26,12 +29,10 @@ mesh_list = ["64", "128", "256", "512"]
 # stencil_name=['s15-i12-o3-e49']
 
 if __name__ == "__main__":
-    filename = "../../test_cases/performance_v100.json"
+    filename = results_path("../../test_cases/performance_v100.json")
     outname = "eva-searching-v100.pdf"
-    with open(filename, "r") as f:
-        data = json.load(f)
-    with open("../../test_cases/streamlist_v100.json", "r") as f:
-        solution_data = json.load(f)
+    data = load_performance(filename)
+    solution_data = load_streamlists(filename if not filename.endswith(".json") else "../../test_cases/streamlist_v100.json")
     # filter stencil
 
     fig, ax = plt.subplots(len(stencil_list)//4, 4, sharex="col", sharey="row", figsize=(14, 8*(len(stencil_list)/24)+1.8))
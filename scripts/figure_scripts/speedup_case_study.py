@@ -1,4 +1,7 @@
-import json
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "evaluation_scripts"))
+from results_store import load_performance, results_path
 import matplotlib.pyplot as plt
 
 csfont = {'family':'Times New Roman', 'size':16}
@@ -16,9 +19,8 @@ def compute_speedup(data,stencil):
 
 
 if __name__ == "__main__":
-    filename = "../../realworld_stencil/performance_v100.json"
-    with open(filename, "r") as f:
-        data = json.load(f)
+    filename = results_path("../../realworld_stencil/performance_v100.json")
+    data = load_performance(filename)
     # filter stencil
     stencil_list = ["fastwaves", "hori"]
     dict = {"fastwaves":"fastwaves", "hori":"horizontal diffusion"}
@@ -112,6 +112,16 @@ struct Grid2MOStencilAttrs : public tvm::AttrsNode<Grid2MOStencilAttrs> {
   }
 }; // struct Grid2MOStencilAttrs
 
+/*! \brief Attributes used in variadic stencil.apply operator */
+struct StencilApplyAttrs : public tvm::AttrsNode<StencilApplyAttrs> {
+    std::string tag; // 设置
+    int output_num; // 输出 grid 个数
+    TVM_DECLARE_ATTRS(StencilApplyAttrs, "relay.attrs.StencilApplyAttrs") {
+        TVM_ATTR_FIELD(tag).set_default("default").describe("Compute tag, for telling compute detail.");
+        TVM_ATTR_FIELD(output_num).set_default(1).describe("Output Grid number.");
+  }
+}; // struct StencilApplyAttrs
+
 }  // namespace relay
 }  // namespace tvm
 #endif  // TVM_RELAY_ATTRS_STENCIL_H_
@@ -15,3 +15,5 @@ reg.register_strategy("stencil.grid5stencil", strategy.stencil_5grid_strategy)
 reg.register_strategy("stencil.grid6stencil", strategy.stencil_6grid_strategy)
 
 reg.register_strategy("stencil.grid2mostencil", strategy.stencil_2mogrid_strategy)
+
+reg.register_strategy("stencil.apply", strategy.stencil_apply_strategy)
@@ -1,4 +1,5 @@
 from . import _make
+from ..expr import Tuple
 
 def star2d2r(data, weight, placeholder=False):
     return _make.star2d2r(data, weight, placeholder)
@@ -26,3 +27,11 @@ def grid6stencil(grid1, grid2, grid3, grid4, grid5, grid6, tag="default"):
 
 def grid2mostencil(grid1, grid2, tag="default", output_num=1):
     return _make.grid2mostencil(grid1, grid2, tag, output_num)
+
+def apply(grids, tag="default", output_num=1):
+    """Stencil compute of any number of input grids and ``output_num`` output grids.
+
+    The grids are passed as one tuple, the op returns a tensor for one output
+    and a tuple of tensors otherwise.
+    """
+    return _make.stencil_apply(Tuple(list(grids)), tag, output_num)
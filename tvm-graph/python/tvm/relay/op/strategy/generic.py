@@ -1905,7 +1905,9 @@ def wrap_compute_stencil(topi_compute):
     """ Wrap stencil topi compute """
     
     def _compute_stencil(attrs, inputs, out_type):
-        return [topi_compute(*inputs)]
+        out = topi_compute(*inputs)
+        # 多输出的 compute 返回 tensor 列表
+        return list(out) if isinstance(out, (list, tuple)) else [out]
     return _compute_stencil
 
 @override_native_generic_func("stencil_1d4r_strategy")
@@ -1932,7 +1934,7 @@ def stencil_1grid_strategy(attrs, inputs, out_type, target):
     tag = attrs.tag
 
     compute = stencil_register.get_compute(tag)
-    schedule = stencil_register.get_schedule(tag)
+    schedule = stencil_register.get_schedule(tag, target)
 
     strategy.add_implementation(
         wrap_compute_stencil(compute),
@@ -1950,7 +1952,7 @@ def stencil_2grid_strategy(attrs, inputs, out_type, target):
     tag = attrs.tag
 
     compute = stencil_register.get_compute(tag)
-    schedule = stencil_register.get_schedule(tag)
+    schedule = stencil_register.get_schedule(tag, target)
 
     strategy.add_implementation(
         wrap_compute_stencil(compute),
@@ -1968,7 +1970,7 @@ def stencil_3grid_strategy(attrs, inputs, out_type, target):
     tag = attrs.tag
 
     compute = stencil_register.get_compute(tag)
-    schedule = stencil_register.get_schedule(tag)
+    schedule = stencil_register.get_schedule(tag, target)
 
     strategy.add_implementation(
         wrap_compute_stencil(compute),
@@ -1986,7 +1988,7 @@ def stencil_4grid_strategy(attrs, inputs, out_type, target):
     tag = attrs.tag
 
     compute = stencil_register.get_compute(tag)
-    schedule = stencil_register.get_schedule(tag)
+    schedule = stencil_register.get_schedule(tag, target)
 
     strategy.add_implementation(
         wrap_compute_stencil(compute),
@@ -2004,7 +2006,7 @@ def stencil_5grid_strategy(attrs, inputs, out_type, target):
     tag = attrs.tag
 
     compute = stencil_register.get_compute(tag)
-    schedule = stencil_register.get_schedule(tag)
+    schedule = stencil_register.get_schedule(tag, target)
 
     strategy.add_implementation(
         wrap_compute_stencil(compute),
@@ -2022,7 +2024,7 @@ def stencil_6grid_strategy(attrs, inputs, out_type, target):
     tag = attrs.tag
 
     compute = stencil_register.get_compute(tag)
-    schedule = stencil_register.get_schedule(tag)
+    schedule = stencil_register.get_schedule(tag, target)
 
     strategy.add_implementation(
         wrap_compute_stencil(compute),
@@ -2040,7 +2042,26 @@ def stencil_2mogrid_strategy(attrs, inputs, out_type, target):
     tag = attrs.tag
 
     compute = stencil_register.get_compute(tag)
-    schedule = stencil_register.get_schedule(tag)
+    schedule = stencil_register.get_schedule(tag, target)
+
+    strategy.add_implementation(
+        wrap_compute_stencil(compute),
+        wrap_topi_schedule(schedule),
+        name=tag,
+    )
+
+    return strategy
+
+
+@override_native_generic_func("stencil_apply_strategy")
+def stencil_apply_strategy(attrs, inputs, out_type, target):
+    """ stencil N grid M output stencil strategy """
+    # 输入 tuple 的各个 grid 已展开在 inputs 中
+    strategy = _op.OpStrategy()
+    tag = attrs.tag
+
+    compute = stencil_register.get_compute(tag)
+    schedule = stencil_register.get_schedule(tag, target)
 
     strategy.add_implementation(
         wrap_compute_stencil(compute),
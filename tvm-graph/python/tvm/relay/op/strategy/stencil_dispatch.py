@@ -1,10 +1,12 @@
 from tvm.topi.generic import default_stencil_schedule
+from tvm.topi.x86 import schedule_stencil as schedule_stencil_cpu
 from tvm.topi.stencil import hypterm_1_flux_0, hypterm_2_flux_0, hypterm_3_flux_0
 
 class StencilImplementation:
     def __init__(self) -> None:
         self._compute = None
-        self._schedule = default_stencil_schedule
+        # target key -> schedule, "generic" is used when no key of the target matches
+        self._schedule = {"generic": default_stencil_schedule, "cpu": schedule_stencil_cpu}
     
     @property
     def compute(self):
@@ -13,14 +15,20 @@ class StencilImplementation:
     
     @property
     def schedule(self):
-        assert self._schedule, "schedule is None"
-        return self._schedule
+        return self.schedule_for()
+
+    def schedule_for(self, target=None):
+        keys = list(target.keys) if target is not None else []
+        for key in keys + ["generic"]:
+            if key in self._schedule:
+                return self._schedule[key]
+        raise AssertionError("schedule is None")
     
     def set_compute(self, compute):
         self._compute = compute
     
-    def set_schedule(self, schedule):
-        self._schedule = schedule
+    def set_schedule(self, schedule, key="generic"):
+        self._schedule[key] = schedule
 
 
 
@@ -33,18 +41,18 @@ class TagDispatch:
             self._dispatch_stencil[tag] = StencilImplementation()
         self._dispatch_stencil[tag].set_compute(compute)
     
-    def register_schedule(self, tag, schedule):
+    def register_schedule(self, tag, schedule, key="generic"):
         if tag not in self._dispatch_stencil.keys():
             self._dispatch_stencil[tag] = StencilImplementation()
-        self._dispatch_stencil[tag].set_schedule(schedule)
+        self._dispatch_stencil[tag].set_schedule(schedule, key)
     
     def get_compute(self, tag):
         assert tag in self._dispatch_stencil.keys(), f"{tag} not register"
         return self._dispatch_stencil[tag].compute
     
-    def get_schedule(self, tag):
+    def get_schedule(self, tag, target=None):
         assert tag in self._dispatch_stencil.keys(), f"{tag} not register"
-        return self._dispatch_stencil[tag].schedule
+        return self._dispatch_stencil[tag].schedule_for(target)
 
 stencil_register = TagDispatch()
 
@@ -722,3 +722,28 @@ def conv2d_winograd_without_weight_transfrom_strategy_cpu(attrs, inputs, out_typ
             "Unsupported conv2d_winograd_without_weight_transfrom layout {}".format(layout)
         )
     return strategy
+
+
+@stencil_2d2r_strategy.register("cpu")
+def stencil_2d2r_strategy_cpu(attrs, inputs, out_type, target):
+    """stencil star2d2r x86 strategy"""
+    strategy = _op.OpStrategy()
+    strategy.add_implementation(
+        wrap_compute_stencil_test(topi.stencil.star2d2r),
+        wrap_topi_schedule(topi.x86.schedule_stencil_star2d2r),
+        name="stencil.star2d2r.x86",
+    )
+    return strategy
+
+
+@stencil_1d4r_strategy.register("cpu")
+def stencil_1d4r_strategy_cpu(attrs, inputs, out_type, target):
+    """stencil star1d4r x86 strategy"""
+    strategy = _op.OpStrategy()
+    if attrs.regular:
+        strategy.add_implementation(
+            wrap_compute_stencil(topi.stencil.star1d4r_regular),
+            wrap_topi_schedule(topi.x86.schedule_stencil_star1d4r),
+            name="stencil.star1d4r.x86",
+        )
+    return strategy
@@ -0,0 +1,413 @@
+"""Analytical cost model of fused stencil programs.
+
+The model predicts the run time of a fusion plan, i.e. a partition of the
+applies of a ``StencilProgram`` into kernels, from the fused bodies alone:
+bytes loaded and stored per grid point, distinct access offsets, flops, the
+halo a kernel has to compute and the levels the stream solver will run
+concurrently. The prediction is linear in a handful of plan features so that
+it can be calibrated against measured ``performance.txt`` results without a
+GPU.
+"""
+import json
+import re
+import weakref
+from collections import Counter
+
+from tvm.relay.transform.stencil_ir import StencilProgram
+from tvm.relay.transform.tracing import traced
+
+
+FEATURES = ("launch", "sync", "traffic", "access", "flops", "critical")
+
+# Rough V100 numbers in ms; calibrate for anything serious.
+DEFAULT_WEIGHTS = {
+    "launch": 5e-3,  # per kernel launch
+    "sync": 5e-3,  # per barrier between stream levels
+    "traffic": 1.3e-9,  # per byte of DRAM traffic
+    "access": 2e-11,  # per stencil.access (cache traffic)
+    "flops": 1.5e-10,  # per floating point operation
+    "critical": 0.0,  # per byte on the slowest kernel of every level
+}
+
+
+class KernelCost:
+    """Per kernel features.
+
+    ``bytes_loaded``, ``bytes_stored``, ``accesses`` and ``flops`` are counted
+    per grid point, ``points`` is the number of points the kernel computes
+    including its halo and ``live`` the peak number of values a point keeps
+    in registers.
+    """
+
+    __slots__ = ("tags", "points", "halo", "bytes_loaded", "bytes_stored", "accesses", "flops", "live")
+
+    def __init__(self, tags, points, halo, bytes_loaded, bytes_stored, accesses, flops, live=0):
+        self.tags = tags
+        self.points = points
+        self.halo = halo
+        self.bytes_loaded = bytes_loaded
+        self.bytes_stored = bytes_stored
+        self.accesses = accesses
+        self.flops = flops
+        self.live = live
+
+    @property
+    def traffic(self):
+        return self.points * (self.bytes_loaded + self.bytes_stored)
+
+    def __repr__(self):
+        return (
+            f"KernelCost({'_'.join(sorted(self.tags))}, points={self.points}, "
+            f"bytes={self.bytes_loaded + self.bytes_stored}, accesses={self.accesses}, "
+            f"flops={self.flops})"
+        )
+
+
+def live_values(body):
+    """Peak number of values live at once when the ops of ``body`` run in order."""
+    position = {op: i for i, op in enumerate(body.ops)}
+    last_use = {}
+    for i, op in enumerate(body.ops):
+        for operand in op.operands:
+            if operand in position:
+                last_use[operand] = i
+    for result in body.results:
+        last_use[result] = len(body.ops)
+    ends = Counter()
+    live = peak = 0
+    for i, op in enumerate(body.ops):
+        live -= ends[i]
+        # 常量是立即数，不占寄存器
+        if op.is_constant or op not in last_use:
+            continue
+        live += 1
+        ends[last_use[op]] += 1
+        peak = max(peak, live)
+    return peak
+
+
+def kernel_cost(program, tags, mesh_size, elem_bytes=8):
+    """Features of the kernel fusing the applies named by ``tags``."""
+    body, inputs, outputs = program.group_body(tags)
+    halo = 0
+    rank = 3
+    for op in body.accesses():
+        rank = len(op.offset)
+        halo = max([halo] + [abs(v) for v in op.offset])
+    flops = sum(1 for op in body.ops if not (op.is_access or op.is_constant))
+    accesses = sum(len(offsets) for offsets in body.access_offsets().values())
+    return KernelCost(
+        frozenset(tags),
+        (mesh_size + 2 * halo) ** rank,
+        halo,
+        len(inputs) * elem_bytes,
+        len(outputs) * elem_bytes,
+        accesses,
+        flops,
+        live_values(body),
+    )
+
+
+def schedule_levels(program, groups):
+    """Group the kernels of a plan by their ASAP level, like ``StreamSolver``."""
+    owner = {}
+    for group in groups:
+        for tag in group:
+            owner[tag] = group
+    deps = {group: set() for group in groups}
+    for apply in program.applies:
+        for operand in apply.operands:
+            producer = program.producer.get(operand)
+            if producer is not None and owner[producer[0].tag] is not owner[apply.tag]:
+                deps[owner[apply.tag]].add(owner[producer[0].tag])
+    level = {}
+
+    def visit(group):
+        if group not in level:
+            level[group] = max([visit(dep) + 1 for dep in deps[group]], default=0)
+        return level[group]
+
+    for group in groups:
+        visit(group)
+    levels = [[] for _ in range(max(level.values(), default=-1) + 1)]
+    for group in groups:
+        levels[level[group]].append(group)
+    return levels
+
+
+class CostModel:
+    """Linear cost model over the plan features in ``FEATURES``.
+
+    Parameters
+    ----------
+    weights : dict, optional
+        Weight of every feature, ``DEFAULT_WEIGHTS`` when omitted.
+    elem_bytes : int
+        Size of a grid element.
+    """
+
+    def __init__(self, weights=None, elem_bytes=8):
+        self.weights = dict(DEFAULT_WEIGHTS)
+        if weights:
+            self.weights.update(weights)
+        self.elem_bytes = elem_bytes
+        # 按程序对象缓存：程序被回收后 id 可能被新程序复用
+        self._kernels = weakref.WeakKeyDictionary()
+
+    def kernel(self, program, tags, mesh_size):
+        kernels = self._kernels.setdefault(program, {})
+        key = (frozenset(tags), mesh_size)
+        if key not in kernels:
+            kernels[key] = kernel_cost(program, tags, mesh_size, self.elem_bytes)
+        return kernels[key]
+
+    def kernel_time(self, program, tags, mesh_size):
+        """Predicted time of a single kernel, used by the stream scheduler."""
+        k = self.kernel(program, tags, mesh_size)
+        return (
+            self.weights["launch"]
+            + self.weights["traffic"] * k.traffic
+            + self.weights["access"] * k.points * k.accesses
+            + self.weights["flops"] * k.points * k.flops
+        )
+
+    def features(self, program, groups, mesh_size):
+        """Feature values of the plan partitioning ``program`` into ``groups``."""
+        groups = [frozenset(group) for group in groups]
+        levels = schedule_levels(program, groups)
+        features = dict.fromkeys(FEATURES, 0)
+        features["launch"] = len(groups)
+        features["sync"] = max(len(levels) - 1, 0)
+        for level in levels:
+            kernels = [self.kernel(program, group, mesh_size) for group in level]
+            features["traffic"] += sum(k.traffic for k in kernels)
+            features["access"] += sum(k.points * k.accesses for k in kernels)
+            features["flops"] += sum(k.points * k.flops for k in kernels)
+            features["critical"] += max(k.traffic for k in kernels)
+        return features
+
+    @traced("scoring")
+    def predict(self, program, groups, mesh_size):
+        features = self.features(program, groups, mesh_size)
+        return sum(self.weights[name] * features[name] for name in FEATURES)
+
+    def fit(self, samples, iterations=2000):
+        """Fit non-negative weights to ``(features, measured_time)`` samples.
+
+        Projected coordinate descent on the least squares problem, with every
+        feature scaled to unit norm first.
+        """
+        if not samples:
+            raise ValueError("no samples to calibrate the cost model with")
+        names = list(FEATURES)
+        rows = [[float(f[name]) for name in names] for f, _ in samples]
+        target = [float(t) for _, t in samples]
+        scale = []
+        for j in range(len(names)):
+            norm = sum(row[j] ** 2 for row in rows) ** 0.5
+            scale.append(norm if norm > 0 else 1.0)
+        cols = [[row[j] / scale[j] for row in rows] for j in range(len(names))]
+        x = [0.0] * len(names)
+        residual = list(target)
+        for _ in range(iterations):
+            delta = 0.0
+            for j, col in enumerate(cols):
+                norm = sum(v * v for v in col)
+                if norm == 0:
+                    continue
+                step = sum(c * r for c, r in zip(col, residual)) / norm
+                new = max(0.0, x[j] + step)
+                if new != x[j]:
+                    change = new - x[j]
+                    residual = [r - change * c for r, c in zip(residual, col)]
+                    delta = max(delta, abs(change))
+                    x[j] = new
+            if delta < 1e-12:
+                break
+        self.weights = {name: x[j] / scale[j] for j, name in enumerate(names)}
+        return self
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump({"weights": self.weights, "elem_bytes": self.elem_bytes}, f, indent=2)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r") as f:
+            data = json.load(f)
+        return cls(data["weights"], data.get("elem_bytes", 8))
+
+
+SCORE_TERMS = ("traffic", "access", "launch", "recompute", "spill")
+
+
+class FusionScore:
+    """Score of fusing two kernels: the time the fusion is predicted to save.
+
+    The terms of ``breakdown`` compare the fused body against the two
+    separate ones, all built by ``StencilProgram.group_body``:
+
+    * ``traffic``: DRAM bytes saved, i.e. inputs read once instead of twice
+      and temps passed on chip, less the bytes the halo the fused kernel
+      grows by costs;
+    * ``access``: ``stencil.access`` operations saved;
+    * ``launch``: the kernel launch saved;
+    * ``recompute``: flops the producer recomputes at every offset its
+      consumer reads it at (negative);
+    * ``spill``: values beyond ``registers`` live at once, each stored and
+      reloaded per point (negative).
+
+    Parameters
+    ----------
+    program : StencilProgram
+        The program the fused tags belong to.
+    mesh_size : int
+        Mesh size the kernels run on.
+    cost_model : CostModel, optional
+        Supplies the (calibrated) per byte, per access, per launch and per
+        flop weights, a default ``CostModel`` when omitted.
+    weights : dict, optional
+        Overrides of the weights, keyed like ``SCORE_TERMS``.
+    registers : int
+        Values a point can keep live without spilling.
+    """
+
+    def __init__(self, program, mesh_size, cost_model=None, weights=None, registers=32):
+        self.program = program
+        self.mesh_size = mesh_size
+        self.cost_model = cost_model or CostModel()
+        model_weights = self.cost_model.weights
+        self.weights = {
+            "traffic": model_weights["traffic"],
+            "access": model_weights["access"],
+            "launch": model_weights["launch"],
+            "recompute": model_weights["flops"],
+            "spill": 2 * self.cost_model.elem_bytes * model_weights["traffic"],
+        }
+        if weights:
+            self.weights.update(weights)
+        self.registers = registers
+
+    def kernel(self, key):
+        return self.cost_model.kernel(self.program, {"%" + tag for tag in key}, self.mesh_size)
+
+    def breakdown(self, key_a, key_b):
+        """The weighted terms of fusing the tags ``key_a`` and ``key_b`` and their total."""
+        a, b = self.kernel(key_a), self.kernel(key_b)
+        fused = self.kernel(frozenset(key_a) | frozenset(key_b))
+
+        def saved(value):
+            return value(a) + value(b) - value(fused)
+
+        def spilled(k):
+            return k.points * max(k.live - self.registers, 0)
+
+        terms = {
+            "traffic": saved(lambda k: k.traffic),
+            "access": saved(lambda k: k.points * k.accesses),
+            "launch": 1,
+            "recompute": saved(lambda k: k.points * k.flops),
+            "spill": saved(spilled),
+        }
+        result = {name: self.weights[name] * terms[name] for name in SCORE_TERMS}
+        result["total"] = sum(result.values())
+        result["halo"] = fused.halo
+        result["live"] = fused.live
+        return result
+
+    def __call__(self, key_a, key_b):
+        return self.breakdown(key_a, key_b)["total"]
+
+
+class RecomputeBudget:
+    """Refuses fusions that recompute too much.
+
+    Inlining a producer into a consumer that reads it at several offsets
+    evaluates the producer once per offset. A pair is admissible while the
+    flops per point the fused body adds over the two separate bodies stay
+    within ``max_flops`` and the fused body has at most ``max_instructions``
+    flops and accesses; past that the producer stays a kernel of its own and
+    its result goes through memory. ``None`` leaves a limit off.
+    """
+
+    def __init__(self, program, mesh_size, cost_model=None, max_flops=None, max_instructions=None):
+        self.program = program
+        self.mesh_size = mesh_size
+        self.cost_model = cost_model or CostModel()
+        self.max_flops = max_flops
+        self.max_instructions = max_instructions
+
+    def kernel(self, key):
+        return self.cost_model.kernel(self.program, {"%" + tag for tag in key}, self.mesh_size)
+
+    def __call__(self, key_a, key_b):
+        a, b = self.kernel(key_a), self.kernel(key_b)
+        fused = self.kernel(frozenset(key_a) | frozenset(key_b))
+        if self.max_flops is not None and fused.flops - a.flops - b.flops > self.max_flops:
+            return False
+        if self.max_instructions is not None and fused.flops + fused.accesses > self.max_instructions:
+            return False
+        return True
+
+
+def parse_performance(path):
+    """Read the measured plans of a ``performance.txt``.
+
+    Returns ``(mesh_size, step, groups, performance)`` tuples for every step
+    whose stream list was recorded with kernel tags.
+    """
+    records = []
+    mesh_size = None
+    step = None
+    groups = None
+    with open(path, "r") as f:
+        for line in f:
+            m = re.match(r"mesh_size = (\d+)", line)
+            if m:
+                mesh_size = int(m.group(1))
+            m = re.match(r"step = (.*)", line)
+            if m:
+                step = m.group(1).strip()
+                groups = None
+            if line.startswith("[["):
+                groups = []
+                for name in re.findall(r"(?:stencil|fuse)_[\d_]+", line):
+                    group = frozenset("%" + tag for tag in name.split("_")[1:] if tag)
+                    if group not in groups:
+                        groups.append(group)
+            if line.startswith("performance=") and groups:
+                records.append((mesh_size, step, groups, float(line.split("=")[1])))
+                groups = None
+    return records
+
+
+def calibrate(program, records, model=None):
+    """Fit ``model`` (a new ``CostModel`` by default) to measured records."""
+    model = model or CostModel()
+    samples = [
+        (model.features(program, groups, mesh_size), performance)
+        for mesh_size, _, groups, performance in records
+    ]
+    return model.fit(samples)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Calibrate the stencil cost model.")
+    parser.add_argument("--mlir", required=True, help="the stencil program of the runs")
+    parser.add_argument("--performance", required=True, nargs="+", help="performance.txt files")
+    parser.add_argument("--output", default="cost_model.json")
+    args = parser.parse_args()
+
+    with open(args.mlir, "r") as f:
+        program = StencilProgram.from_mlir(f)
+    records = []
+    for path in args.performance:
+        records += parse_performance(path)
+    model = calibrate(program, records)
+    for mesh_size, step, groups, performance in records:
+        predicted = model.predict(program, groups, mesh_size)
+        print(f"mesh_size = {mesh_size} step = {step}: measured {performance:.4f} predicted {predicted:.4f}")
+    model.save(args.output)
+    print(f"weights written to {args.output}")
@@ -8,7 +8,7 @@ from tvm.relay.expr import ExprWithOp
 from tvm.relay.expr_functor import MixedModeMutator
 from tvm.relay.op.op import OpPattern
 from .custom_fuse_ops import FuseMutator, IndexedForwardGraph
-from .utils import ReplaceParams, is_scalar, EmitTuple
+from .utils import ReplaceParams, call_args, is_scalar, EmitTuple
 
 class MappingType(IntEnum):
     OneToOne = 0
@@ -80,7 +80,7 @@ class GroupOp:
     def init_args(self, group: List[relay.Call]) -> List[ExprWithOp]:
         args = []
         for node in group:
-            for arg in node.args:
+            for arg in call_args(node):
                 if isinstance(arg, relay.TupleGetItem) and (arg.tuple_value in group):
                     continue
                 if arg not in args and arg not in group:
@@ -110,7 +110,7 @@ class GroupOp:
     def flatten_expr(self, expr: relay.Expr, params: List[relay.Var]) -> relay.Expr:
         if isinstance(expr, relay.Tuple):
             func1_args = []
-            for arg in expr.fields[1].args:
+            for arg in call_args(expr.fields[1]):
                 if isinstance(arg, relay.TupleGetItem):
                     func1_args.append(arg.tuple_value)
                 else:
@@ -193,7 +193,7 @@ class GroupOp:
     def serial_flatten(self, expr: relay.Expr, params: List[relay.Var]) -> relay.Expr:
         # flatten first fuse op
         global_replace = {}
-        for arg in expr.args:
+        for arg in call_args(expr):
             if arg not in params and isinstance(arg, relay.TupleGetItem):
                 tuple_value = arg.tuple_value
                 if not isinstance(tuple_value.op, relay.Function):
@@ -291,7 +291,7 @@ class DNNFusion(MixedModeMutator):
         depend_relations = {}
         for node in call_group:
             depends = []
-            for arg in node.args:
+            for arg in call_args(node):
                 if arg in call_group:
                     depends.append(arg)
             depend_relations[node] = depends
@@ -496,7 +496,7 @@ class StencilFusion(MixedModeMutator):
         for node in call_list:
             graph[node] = {"input": [], "output": []}
         for node in call_list:
-            for arg in node.args:
+            for arg in call_args(node):
                 if arg in call_list:
                     graph[node]["input"].append(arg)
                     graph[arg]["output"].append(node)
@@ -0,0 +1,255 @@
+"""Incremental state of the greedy stencil fusion search.
+
+Every node is a (possibly fused) stencil identified by the frozenset of the
+original stencil tags it contains. Reachability is kept as bitset transitive
+closures and the scores of all legal pairs live in a max-heap, so a fusion
+step only touches the closures of the merged node's relatives and pushes the
+new pairs of the merged node.
+"""
+import heapq
+
+
+class FusionNode:
+    """A node of the fusion graph.
+
+    Parameters
+    ----------
+    key : frozenset of str
+        Tags of the stencils grouped in this node.
+    inputs : dict
+        Maps every consumed value to its number of elements. Values produced
+        by stencils are keyed ``("stencil", tag, index)``, program inputs
+        ``("var", name)``.
+    fusible : bool
+        Whether the node may take part in a fusion at all.
+    """
+
+    __slots__ = ("key", "inputs", "fusible", "id", "alive")
+
+    def __init__(self, key, inputs, fusible=True):
+        self.key = frozenset(key)
+        self.inputs = dict(inputs)
+        self.fusible = fusible
+        self.id = None
+        self.alive = True
+
+    def __repr__(self):
+        return "FusionNode(" + "_".join(sorted(self.key, key=_tag_order)) + ")"
+
+
+def _tag_order(tag):
+    return (0, int(tag)) if tag.isdigit() else (1, tag)
+
+
+class FusionGraph:
+    """Fusion candidates of a stencil program, updated in place on fusion.
+
+    Parameters
+    ----------
+    nodes : list of FusionNode
+        The stencils of the program, preferably in topological order; ties
+        between equal scores are broken by this order.
+    p_input : int
+        Weight of an input read by both stencils of a pair.
+    p_stencil : int
+        Weight of a temp passed from one stencil of a pair to the other.
+    scorer : callable, optional
+        ``scorer(key_a, key_b)`` scoring a pair from the tags of its nodes,
+        e.g. a ``cost_model.FusionScore``; the weighted element counts of
+        ``score_terms`` when omitted. It may provide ``breakdown(key_a,
+        key_b)`` for ``explain``.
+    admissible : callable, optional
+        ``admissible(key_a, key_b)`` is False for pairs never to fuse even
+        when legal, e.g. a ``cost_model.RecomputeBudget``.
+    """
+
+    def __init__(self, nodes, p_input=1, p_stencil=2, scorer=None, admissible=None):
+        self.p_input = p_input
+        self.p_stencil = p_stencil
+        self.scorer = scorer
+        self.admissible = admissible
+        self.nodes = []
+        self.tag2node = {}
+        self.anc = []
+        self.desc = []
+        self.heap = []
+        for node in nodes:
+            self._add(node)
+        self._init_closure()
+        alive = self.alive_nodes()
+        for i, node in enumerate(alive):
+            for other in alive[i + 1:]:
+                self._push(node, other)
+
+    def _add(self, node):
+        node.id = len(self.nodes)
+        self.nodes.append(node)
+        self.anc.append(0)
+        self.desc.append(0)
+        for tag in node.key:
+            self.tag2node[tag] = node
+
+    def copy(self):
+        """An independent copy, so a search can explore several plans."""
+        other = FusionGraph.__new__(FusionGraph)
+        other.p_input = self.p_input
+        other.p_stencil = self.p_stencil
+        other.scorer = self.scorer
+        other.admissible = self.admissible
+        other.nodes = []
+        for node in self.nodes:
+            clone = FusionNode(node.key, node.inputs, node.fusible)
+            clone.id = node.id
+            clone.alive = node.alive
+            other.nodes.append(clone)
+        other.tag2node = {tag: other.nodes[node.id] for tag, node in self.tag2node.items()}
+        other.anc = list(self.anc)
+        other.desc = list(self.desc)
+        other.heap = list(self.heap)
+        return other
+
+    def alive_nodes(self):
+        return [node for node in self.nodes if node.alive]
+
+    def producers(self, node):
+        """The nodes computing the values read by ``node``."""
+        result = {}
+        for value in node.inputs:
+            if value[0] == "stencil":
+                producer = self.tag2node.get(value[1])
+                if producer is not None and producer is not node:
+                    result[producer.id] = producer
+        return list(result.values())
+
+    def _init_closure(self):
+        preds = {node.id: self.producers(node) for node in self.nodes}
+        indegree = {node.id: len(preds[node.id]) for node in self.nodes}
+        succs = {node.id: [] for node in self.nodes}
+        for node in self.nodes:
+            for producer in preds[node.id]:
+                succs[producer.id].append(node)
+        order = []
+        ready = [node for node in self.nodes if indegree[node.id] == 0]
+        while ready:
+            node = ready.pop()
+            order.append(node)
+            for succ in succs[node.id]:
+                indegree[succ.id] -= 1
+                if indegree[succ.id] == 0:
+                    ready.append(succ)
+        if len(order) != len(self.nodes):
+            raise ValueError("the stencil graph has a cycle")
+        for node in order:
+            for producer in preds[node.id]:
+                self.anc[node.id] |= self.anc[producer.id] | (1 << producer.id)
+        for node in reversed(order):
+            for succ in succs[node.id]:
+                self.desc[node.id] |= self.desc[succ.id] | (1 << succ.id)
+
+    def depends(self, a, b):
+        """Whether ``b`` (transitively) reads a value of ``a``."""
+        return bool(self.desc[a.id] >> b.id & 1)
+
+    def legal(self, a, b):
+        """Two nodes can be fused unless a path between them leaves the pair."""
+        if a is b or not (a.alive and b.alive and a.fusible and b.fusible):
+            return False
+        return not (self.desc[a.id] & self.anc[b.id] or self.desc[b.id] & self.anc[a.id])
+
+    def score_terms(self, a, b):
+        """The (input reuse, temp reuse) element counts of fusing ``a`` and ``b``."""
+        shared = sum(a.inputs[value] for value in a.inputs.keys() & b.inputs.keys())
+        passed = 0
+        for consumer, producer in ((a, b), (b, a)):
+            for value, size in consumer.inputs.items():
+                if value[0] == "stencil" and value[1] in producer.key:
+                    passed += size
+        return shared, passed
+
+    def score(self, a, b):
+        if self.scorer is not None:
+            return self.scorer(a.key, b.key)
+        shared, passed = self.score_terms(a, b)
+        return shared * self.p_input + passed * self.p_stencil
+
+    def explain(self, a, b):
+        """The terms the score of fusing ``a`` and ``b`` is made of."""
+        if self.scorer is not None and hasattr(self.scorer, "breakdown"):
+            return self.scorer.breakdown(a.key, b.key)
+        shared, passed = self.score_terms(a, b)
+        return {
+            "shared": shared * self.p_input,
+            "passed": passed * self.p_stencil,
+            "total": self.score(a, b),
+        }
+
+    def _push(self, a, b):
+        if not self.legal(a, b):
+            return
+        # 两个节点的内容不再变化，所以只需在入堆时判断一次
+        if self.admissible is not None and not self.admissible(a.key, b.key):
+            return
+        if a.id > b.id:
+            a, b = b, a
+        heapq.heappush(self.heap, (-self.score(a, b), a.id, b.id))
+
+    def pop_best(self):
+        """Remove and return ``(a, b, score)`` of the best legal pair, or None.
+
+        Entries whose nodes were merged or that became illegal are dropped on
+        the way; a pair never becomes legal again once a path through a third
+        node exists, so dropping them is safe.
+        """
+        while self.heap:
+            neg_score, a_id, b_id = heapq.heappop(self.heap)
+            a, b = self.nodes[a_id], self.nodes[b_id]
+            if self.legal(a, b):
+                return a, b, -neg_score
+        return None
+
+    def candidates(self, k):
+        """The ``k`` best legal pairs as ``(a, b, score)``, left in the heap."""
+        result = []
+        while len(result) < k:
+            best = self.pop_best()
+            if best is None:
+                break
+            result.append(best)
+        for a, b, _ in result:
+            self._push(a, b)
+        return result
+
+    def merge(self, a, b):
+        """Replace ``a`` and ``b`` by their fusion and return the new node."""
+        key = a.key | b.key
+        inputs = {}
+        for node in (a, b):
+            for value, size in node.inputs.items():
+                if not (value[0] == "stencil" and value[1] in key):
+                    inputs[value] = size
+        merged = FusionNode(key, inputs, a.fusible and b.fusible)
+        a.alive = b.alive = False
+        self._add(merged)
+
+        removed = (1 << a.id) | (1 << b.id)
+        bit = 1 << merged.id
+        anc = (self.anc[a.id] | self.anc[b.id]) & ~removed
+        desc = (self.desc[a.id] | self.desc[b.id]) & ~removed
+        self.anc[merged.id] = anc
+        self.desc[merged.id] = desc
+        for node_id in _bits(anc):
+            self.desc[node_id] = (self.desc[node_id] & ~removed) | desc | bit
+        for node_id in _bits(desc):
+            self.anc[node_id] = (self.anc[node_id] & ~removed) | anc | bit
+
+        for other in self.alive_nodes():
+            if other is not merged:
+                self._push(other, merged)
+        return merged
+
+
+def _bits(mask):
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
@@ -0,0 +1,160 @@
+"""Beam search over stencil fusion plans.
+
+A plan is a partition of the stencils into kernels. The greedy search of
+``NodeAutoFusion`` follows the single best pair at every step; this driver
+keeps the ``beam_width`` best plans of every step instead, optionally looking
+a few fusions ahead before ranking them. Plans are memoized on a canonical
+form of their partition, so a partition reached by fusing the same groups in
+a different order is evaluated only once, and the number of evaluations can
+be capped by a budget.
+"""
+import hashlib
+
+from tvm.relay.transform.fusion_graph import _tag_order
+from tvm.relay.transform.timing import faster
+
+
+def canonical_partition(groups):
+    """A partition as sorted tuples of sorted tags, equal for equal partitions."""
+    return tuple(sorted(tuple(sorted(group, key=_tag_order)) for group in groups))
+
+
+def partition_hash(groups):
+    """Short stable hash of a partition, used to name plans in reports."""
+    key = canonical_partition(groups)
+    return hashlib.sha1(repr(key).encode()).hexdigest()[:12]
+
+
+class SearchState:
+    """A plan: the fusion graph after ``merges``, a list of ``(key, key)`` pairs."""
+
+    __slots__ = ("graph", "merges", "key")
+
+    def __init__(self, graph, merges=()):
+        self.graph = graph
+        self.merges = list(merges)
+        self.key = canonical_partition(node.key for node in graph.alive_nodes())
+
+    @property
+    def groups(self):
+        return [frozenset(group) for group in self.key]
+
+    @property
+    def hash(self):
+        return partition_hash(self.key)
+
+    def children(self, branching):
+        """The plans fusing one of the ``branching`` best scored pairs."""
+        for a, b, _ in self.graph.candidates(branching):
+            graph = self.graph.copy()
+            graph.merge(graph.nodes[a.id], graph.nodes[b.id])
+            yield SearchState(graph, self.merges + [(a.key, b.key)])
+
+
+class BeamSearch:
+    """Beam search with lookahead and a memo table of evaluated partitions.
+
+    Parameters
+    ----------
+    evaluate : callable
+        Maps a ``SearchState`` to its cost (lower is better), e.g. a predicted
+        or measured run time. ``float("inf")`` marks a plan that failed. A
+        measured ``Timing`` only replaces the best plan when it is faster
+        beyond noise.
+    beam_width : int
+        Plans kept at every step.
+    lookahead : int
+        A plan is ranked by the best cost found within ``lookahead`` further
+        fusions of it.
+    branching : int
+        Pairs tried per plan, best pair score first.
+    budget : int, optional
+        Maximum number of evaluations, unlimited when omitted.
+    max_steps : int, optional
+        Maximum number of fusion steps.
+    """
+
+    def __init__(self, evaluate, beam_width=4, lookahead=0, branching=8, budget=None, max_steps=None):
+        self.evaluate = evaluate
+        self.beam_width = beam_width
+        self.lookahead = lookahead
+        self.branching = branching
+        self.budget = budget
+        self.max_steps = max_steps
+        self.memo = {}
+        self.states = {}
+        self.hits = 0
+        self.best = None
+
+    @property
+    def evaluations(self):
+        return len(self.memo)
+
+    def exhausted(self):
+        return self.budget is not None and self.evaluations >= self.budget
+
+    def value(self, state):
+        """The memoized cost of ``state``, None once the budget is spent."""
+        if state.key in self.memo:
+            self.hits += 1
+            return self.memo[state.key]
+        if self.exhausted():
+            return None
+        cost = self.evaluate(state)
+        self.memo[state.key] = cost
+        self.states[state.key] = state
+        # 测量值在噪声范围内的方案不替换已有的最优
+        if self.best is None or faster(cost, self.best[0]):
+            self.best = (cost, state)
+        return cost
+
+    def lookahead_value(self, state, depth):
+        cost = self.value(state)
+        if depth <= 0 or cost is None:
+            return cost
+        for child in state.children(self.branching):
+            child_cost = self.lookahead_value(child, depth - 1)
+            if child_cost is not None:
+                cost = min(cost, child_cost)
+        return cost
+
+    def run(self, root):
+        """Search from ``root`` and return the best ``(cost, state)`` found."""
+        self.value(root)
+        frontier = [root]
+        step = 0
+        while frontier and not self.exhausted():
+            if self.max_steps is not None and step >= self.max_steps:
+                break
+            step += 1
+            children = {}
+            for state in frontier:
+                for child in state.children(self.branching):
+                    if child.key in children:
+                        self.hits += 1
+                    children.setdefault(child.key, child)
+            ranked = []
+            for order, child in enumerate(children.values()):
+                cost = self.lookahead_value(child, self.lookahead)
+                if cost is not None:
+                    ranked.append((cost, order, child))
+            ranked.sort(key=lambda item: item[:2])
+            frontier = [child for _, _, child in ranked[:self.beam_width]]
+        return self.best
+
+    def ranked(self, n=None):
+        """The ``n`` cheapest evaluated ``(cost, state)``, cheapest first."""
+        keys = sorted(self.memo, key=self.memo.get)[:n]
+        return [(self.memo[key], self.states[key]) for key in keys]
+
+    def report(self):
+        """Summary of the search: the best plan and the evaluation counts."""
+        cost, state = self.best
+        return {
+            "cost": cost,
+            "plan": state.hash,
+            "groups": [list(group) for group in state.key],
+            "steps": len(state.merges),
+            "evaluations": self.evaluations,
+            "memo_hits": self.hits,
+        }
@@ -12,16 +12,111 @@ class Kernel:
         return f"name : {self.name}; variables : {self.variables}"
 
 
+def happens_before(stream_list):
+    """Map every kernel of ``stream_list`` to the kernels finished before it starts.
+
+    Kernels of one stream run in order; ``sync_i`` is a barrier of the streams
+    holding it and ``record_i`` happens before every ``wait_i``. Kernels not
+    ordered by these edges may run concurrently.
+    """
+    preds = defaultdict(set)
+    kernels = []
+    markers = 0
+    for stream in stream_list:
+        prev = None
+        for ele in stream:
+            if ele.startswith("sync_"):
+                node = ele
+            elif ele.startswith("record_") or ele.startswith("wait_"):
+                node = (ele, markers)
+                markers += 1
+                if ele.startswith("wait_"):
+                    preds[node].add(ele.replace("wait_", "record_"))
+            else:
+                node = ele
+                kernels.append(ele)
+            if ele.startswith("record_"):
+                # 所有 wait_i 都依赖同一个 record_i
+                preds[ele].add(node)
+            if prev is not None:
+                preds[node].add(prev)
+            prev = node
+
+    before = {}
+
+    def ancestors(node):
+        if node not in before:
+            before[node] = set()
+            result = set()
+            for pred in preds[node]:
+                result |= ancestors(pred)
+                result.add(pred)
+            before[node] = result
+        return before[node]
+
+    kernel_set = set(kernels)
+    return {kernel: ancestors(kernel) & kernel_set for kernel in kernels}
+
+
+def plan_buffers(stream_list, kernels, variables):
+    """Assign ``variables`` to shared buffers by their live ranges.
+
+    A variable lives from the first to the last kernel accessing it. Two
+    variables may share a buffer when every access of one happens before
+    every access of the other (see ``happens_before``), so lifetimes that
+    overlap on concurrent streams never share. Variables are placed in the
+    order of their first access into the first buffer all of whose variables
+    are dead by then, like the greedy coloring of an interval graph.
+
+    Returns a dict mapping every variable to the variable owning its buffer.
+    """
+    before = happens_before(stream_list)
+    access = {var: [k.name for k in kernels if var in k.variables and k.name in before] for var in variables}
+
+    def ordered(u, v):
+        return all(a in before[b] for a in access[u] for b in access[v])
+
+    def first_access(var):
+        return (min((len(before[k]) for k in access[var]), default=0), var)
+
+    buffers = []
+    for var in sorted(variables, key=first_access):
+        for buffer in buffers:
+            if all(ordered(u, var) for u in buffer):
+                buffer.append(var)
+                break
+        else:
+            buffers.append([var])
+    return {var: buffer[0] for buffer in buffers for var in buffer}
+
+
+OUTPUT_MODES = {True: "npy", "npy": "npy", "checksum": "checksum", "text": "text"}
+# 网格元素类型 -> (C 类型, 字节数)
+ELEMENT_TYPES = {"f64": ("double", 8), "f32": ("float", 4)}
+
+
 class GenMain:
-    def __init__(self, domain_size=64, halo_width = 4, variables=[], kernels: List[Kernel] = None, stream_list=[], output_on=True):
+    def __init__(self, domain_size=64, halo_width = 4, variables=[], kernels: List[Kernel] = None, stream_list=[], output_on=True, reuse_buffers=False,
+                 run_step=1, swaps=(), dtype="f64"):
         self.domain_size = domain_size
+        if dtype not in ELEMENT_TYPES:
+            raise ValueError(f"unsupported element type {dtype!r}")
+        self.element_type, self.element_size = ELEMENT_TYPES[dtype]
         self.halo_width = halo_width
         self.kernels = kernels
         self.stream_list = stream_list
         self.sync_var_length = defaultdict(int)
-        self.run_step = 1
+        # record_i/wait_i 点对点依赖使用的 event_i 标志
+        self.event_vars = []
+        self.run_step = run_step
+        # (output, input) 对：时间步之间交换两者的存储，上一步的输出成为下一步的输入
+        self.swaps = list(swaps)
         self.stream_size = 0
-        self.output_on = output_on
+        # 输出方式："npy" (True) 写内部点的 .npy，"checksum" 只写和与范数，"text" 用 printStorage 逐点打印
+        self.output_on = bool(output_on)
+        self.output_mode = OUTPUT_MODES.get(output_on, output_on) if output_on else None
+        if self.output_on and self.output_mode not in OUTPUT_MODES.values():
+            raise ValueError(f"unknown output mode {output_on!r}")
 
         self.init_stream_list(stream_list)
         self.variables = variables  # dict key all_varibles, in_varibles, mid_varibles, useless_varibles
@@ -36,12 +131,39 @@ class GenMain:
         for kernel in kernels:
             self.name2kernel[kernel.name] = kernel
 
+        # 中间变量 -> 与之共用存储的变量，reuse_buffers 关闭时每个变量独占一块
+        if reuse_buffers:
+            swapped = {var for pair in self.swaps for var in pair}
+            self.buffer_of = plan_buffers(stream_list, kernels, self.mid_variables - swapped)
+        else:
+            self.buffer_of = {var: var for var in self.mid_variables}
+
+    def allocated_variables(self):
+        """The variables that own a device buffer."""
+        return [k for k in sorted(list(self.all_variables.keys() - self.useless_variables))
+                if self.buffer_of.get(k, k) == k]
+
+    def memory_report(self):
+        """Device footprint in bytes of one buffer per variable and after reuse."""
+        def size(dim):
+            return (self.domain_size + 2 * self.halo_width) ** dim * self.element_size
+
+        variables = sorted(list(self.all_variables.keys() - self.useless_variables))
+        return {
+            "buffers": len(variables),
+            "shared_buffers": len(self.allocated_variables()),
+            "footprint": sum(size(self.all_variables[k]) for k in variables),
+            "shared_footprint": sum(size(self.all_variables[k]) for k in self.allocated_variables()),
+        }
+
     def init_stream_list(self, stream_list):
         self.stream_size = len(stream_list)
         for index, stream in enumerate(stream_list):
             for ele in stream:
                 if isinstance(ele, str) and ele.startswith("sync_"):
                     self.sync_var_length[ele] += 1
+                elif isinstance(ele, str) and ele.startswith("record_"):
+                    self.event_vars.append(ele.replace("record_", "event_"))
 
     def gen_struct_parameter(self, varibles: dict):
         paras_list = [f'Storage{var_dim}D {var_name};' for var_name, var_dim in varibles.items()]
@@ -56,13 +178,14 @@ struct parameter
         self.code.append(struct_parameter)
 
     def gen_header(self, domain_size, halo_width):
-        sync_vars = [f'std::atomic<int> {k}(0);' for k in self.sync_var_length]
+        sync_vars = [f'std::atomic<int> {k}(0);' for k in list(self.sync_var_length) + self.event_vars]
         sync_vars_str = "\n".join(sync_vars)
         header = \
             f'''
 #include <cmath>
 #include <chrono>
 #include <atomic>
+#include <utility>
 
 // define the domain size and the halo width
 int32_t domain_size = {domain_size};
@@ -70,7 +193,7 @@ int32_t domain_height = {domain_size};
 int32_t halo_width = {halo_width};
 const int N = 1 << 20;
 
-typedef double ElementType;
+typedef {self.element_type} ElementType;
 std::atomic<int> START(0);
 {sync_vars_str}
 #include "util.h"
@@ -143,6 +266,17 @@ __global__ void kernel(float *x, int n)
 '''
             return statement
 
+        def gen_record_event(var):
+            statement = \
+                f'''
+    cudaStreamSynchronize(0);
+    {var.replace("record_", "event_")}=1;
+'''
+            return statement
+
+        def gen_wait_event(var):
+            return f'while({var.replace("wait_", "event_")}!=1);'
+
         def gen_kernel_call(var):
             kernel = self.name2kernel[var]
             varibles = kernel.variables
@@ -156,11 +290,15 @@ __global__ void kernel(float *x, int n)
         def gen_single_call(var):
             if var.startswith("sync_"):
                 return gen_synchronize_var(var)
+            if var.startswith("record_"):
+                return gen_record_event(var)
+            if var.startswith("wait_"):
+                return gen_wait_event(var)
             return gen_kernel_call(var)
 
         z = set()
         for var in stream:
-            if isinstance(var, str) and not var.startswith("sync_"):
+            if isinstance(var, str) and var in self.name2kernel:
                 z = z | set(self.name2kernel[var].variables)
 
         var_assign_statement = [f'Storage{self.all_variables[var_name]}D {var_name} = p->{var_name};' for var_name in
@@ -219,7 +357,11 @@ int main(int argc, char **argv) {
         struct_para = "  struct parameter *p =  new parameter;"
         self.code.append(struct_para)
 
-        var_def = [f'p->{var_name} = allocateStorage(sizes{var_dim}D);' for var_name, var_dim in varibles.items()]
+        report = self.memory_report()
+        self.code.append(f"  // buffers: {report['buffers']} -> {report['shared_buffers']}, "
+                         f"peak footprint: {report['footprint']} -> {report['shared_footprint']} bytes")
+        var_def = [f'p->{var_name} = allocateStorage(sizes{var_dim}D);' for var_name, var_dim in varibles.items()
+                   if self.buffer_of.get(var_name, var_name) == var_name]
         self.code.append("\n  ".join(var_def))
 
     def gen_init_statement(self):
@@ -243,12 +385,16 @@ int main(int argc, char **argv) {
         
         # for kernel in self.kernels:
         #     varibles = kernel.variables
-        for k in sorted(list(self.all_variables.keys() - self.useless_variables)):
+        for k in self.allocated_variables():
             if k in self.in_variables:
                 mem2d_gen = mem2d_copy.replace("${var_name}", k)
             else:
                 mem2d_gen = mem2d_memset.replace("${var_name}", k)
             self.code.append(mem2d_gen)
+        # 生命周期不重叠的中间变量共用同一块设备存储
+        for var, owner in sorted(self.buffer_of.items()):
+            if var != owner:
+                self.code.append(f'  p->{var} = p->{owner};')
 
     #  生成pthread调用的相关代码
     def gen_timing_and_run(self):
@@ -271,9 +417,16 @@ int main(int argc, char **argv) {
         def init_sync_vars():
             sync_vars = ["START"]
             sync_vars += list(self.sync_var_length.keys())
+            sync_vars += self.event_vars
             init = [f"{var}=0;" for var in sync_vars]
             return "\n    ".join(init)
 
+        def gen_swap():
+            if not self.swaps:
+                return ""
+            swap = [f"std::swap(p->{out_var}, p->{in_var});" for out_var, in_var in self.swaps]
+            return "if(i + 1 < iterations){\n      " + "\n      ".join(swap) + "\n    }"
+
         timing = \
             f'''
   cudaEvent_t start, stop;
@@ -281,11 +434,16 @@ int main(int argc, char **argv) {
   // double sum=0.0;
   // double min_time = 100000.0;
   // double max_time = 0.0;
-  pthread_t threads[8];
+  pthread_t threads[{max(self.stream_size, 1)}];
   {gen_init_device_mem()}
 
+  // 前 warmup 次不计时，之后 repeats 遍 steps 步，每步一个样本
   int steps = {self.run_step};
-  for(int i = 0; i < steps; i++){{
+  int warmup = envInt("STENCIL_WARMUP", 0);
+  int repeats = envInt("STENCIL_REPEATS", 1);
+  int iterations = warmup + steps * repeats;
+  std::vector<double> samples;
+  for(int i = 0; i < iterations; i++){{
     {init_sync_vars()}
     {gen_pthread_create()}
     while(START!={self.stream_size});
@@ -301,22 +459,30 @@ int main(int argc, char **argv) {
     cudaEventSynchronize(stop);
     cudaEventElapsedTime(&elapsed, start, stop);
 
-    std::cout << "time : " << elapsed << std::endl;
-  }}'''
+    if(i >= warmup){{
+      samples.push_back(elapsed);
+      std::cout << "time : " << elapsed << std::endl;
+    }}
+    {gen_swap()}
+  }}
+  writeTiming(warmup, samples);'''
 
         self.code.append(timing)
 
+    def gen_output(self, out):
+        """Statements writing the output ``out`` on the host in ``output_mode``."""
+        if self.output_mode == "text":
+            return [f'  printf("-------{out}-------");', f"  printStorage(p->{out});"]
+        func = "writeChecksum" if self.output_mode == "checksum" else "writeNpy"
+        return [f'  {func}("{out}", p->{out});']
+
     def gen_mem_out(self):
 
-        for out in self.out_variables:
+        for out in sorted(self.out_variables):
             self.code.append(f"  memD2H(p->{out});")
-            self.code.append(f'  printf("-------{out}-------");')
-
-            self.code.append(f"  printStorage(p->{out});")
-
+            self.code += self.gen_output(out)
             self.code.append(f"  freeStorage(p->{out});")
 
-           
 
     def gen_main_end(self):
         main_end = \
@@ -345,6 +511,303 @@ int main(int argc, char **argv) {
         print("\n".join(self.code), file=file)
 
 
+def task_graph(stream_list):
+    """The kernels of ``stream_list`` and the direct dependencies between them.
+
+    Returns the kernels in stream order and a dict mapping every kernel to the
+    kernels it waits for, with the edges implied by others removed.
+    """
+    before = happens_before(stream_list)
+    kernels = list(before)
+    preds = {}
+    for kernel in kernels:
+        preds[kernel] = [a for a in kernels if a in before[kernel]
+                         and not any(a in before[b] for b in before[kernel])]
+    return kernels, preds
+
+
+# 任务图运行时：工作线程池 + 依赖计数，前驱全部完成的 kernel 才进入就绪队列，线程阻塞等待而不自旋
+CPU_RUNTIME = r"""
+class WorkerPool {
+ public:
+  explicit WorkerPool(int size) : pinned(size) {
+    for (int i = 0; i < size; i++) {
+      workers.emplace_back([this, i] { work(i); });
+    }
+  }
+
+  ~WorkerPool() {
+    {
+      std::lock_guard<std::mutex> lock(mutex);
+      stop = true;
+    }
+    ready.notify_all();
+    for (auto &worker : workers) {
+      worker.join();
+    }
+  }
+
+  int size() const { return (int)workers.size(); }
+
+  // worker < 0 时任一线程可执行，否则只由第 worker % size() 个线程执行
+  void submit(std::function<void()> task, int worker = -1) {
+    {
+      std::lock_guard<std::mutex> lock(mutex);
+      if (worker < 0) {
+        queue.push_back(std::move(task));
+      } else {
+        pinned[worker % size()].push_back(std::move(task));
+      }
+    }
+    if (worker < 0) {
+      ready.notify_one();
+    } else {
+      ready.notify_all();
+    }
+  }
+
+  // 在第 worker 个线程上执行 f，完成后返回
+  void run_on(int worker, const std::function<void()> &f) {
+    std::promise<void> done;
+    submit([&f, &done] {
+      f();
+      done.set_value();
+    }, worker);
+    done.get_future().wait();
+  }
+
+ private:
+  void work(int id) {
+    for (;;) {
+      std::function<void()> task;
+      {
+        std::unique_lock<std::mutex> lock(mutex);
+        ready.wait(lock, [this, id] { return stop || !queue.empty() || !pinned[id].empty(); });
+        if (stop && queue.empty() && pinned[id].empty()) {
+          return;
+        }
+        auto &source = pinned[id].empty() ? queue : pinned[id];
+        task = std::move(source.front());
+        source.pop_front();
+      }
+      task();
+    }
+  }
+
+  std::vector<std::deque<std::function<void()>>> pinned;
+  std::vector<std::thread> workers;
+  std::deque<std::function<void()>> queue;
+  std::mutex mutex;
+  std::condition_variable ready;
+  bool stop = false;
+};
+
+int poolSize() {
+  const char *env = std::getenv("STENCIL_NUM_THREADS");
+  int size = env ? std::atoi(env) : (int)std::thread::hardware_concurrency();
+  return size > 0 ? size : 1;
+}
+
+class TaskGraph {
+ public:
+  explicit TaskGraph(int size)
+      : body(size), worker(size, -1), successors(size), num_deps(size), pending(new std::atomic<int>[size]) {}
+
+  void depend(int task, int pred) {
+    successors[pred].push_back(task);
+    num_deps[task] += 1;
+  }
+
+  void run(WorkerPool &pool) {
+    int size = (int)body.size();
+    remaining = size;
+    for (int i = 0; i < size; i++) {
+      pending[i] = num_deps[i];
+    }
+    for (int i = 0; i < size; i++) {
+      if (num_deps[i] == 0) {
+        pool.submit([this, &pool, i] { execute(pool, i); }, worker[i]);
+      }
+    }
+    std::unique_lock<std::mutex> lock(mutex);
+    done.wait(lock, [this] { return remaining == 0; });
+  }
+
+  std::vector<std::function<void()>> body;
+  // 执行每个任务的 worker，-1 为任意
+  std::vector<int> worker;
+
+ private:
+  void execute(WorkerPool &pool, int task) {
+    body[task]();
+    for (int next : successors[task]) {
+      if (--pending[next] == 0) {
+        pool.submit([this, &pool, next] { execute(pool, next); }, worker[next]);
+      }
+    }
+    std::lock_guard<std::mutex> lock(mutex);
+    if (--remaining == 0) {
+      done.notify_all();
+    }
+  }
+
+  std::vector<std::vector<int>> successors;
+  std::vector<int> num_deps;
+  std::unique_ptr<std::atomic<int>[]> pending;
+  int remaining = 0;
+  std::mutex mutex;
+  std::condition_variable done;
+};
+
+// 由最先访问它的 kernel 所在的 worker 清零，页面分配在该线程的 NUMA 节点上
+template <typename Storage>
+void firstTouch(WorkerPool &pool, Storage &ref, int worker) {
+  ElementType *data = ref.allocatedPtr;
+  size_t count = ref.getMemSize() / sizeof(ElementType);
+  pool.run_on(worker, [data, count] { std::fill(data, data + count, ElementType(0)); });
+}
+"""
+
+
+class CpuGenMain(GenMain):
+    """Host code running CPU-compiled kernels of the same stream list.
+
+    Instead of one pthread per stream spinning on counters, the kernels are
+    the tasks of a graph whose edges are the stream order, the ``sync_i``
+    barriers and the ``record_i``/``wait_i`` events. A pool of
+    ``std::thread::hardware_concurrency()`` workers (``STENCIL_NUM_THREADS``
+    overrides it) runs every task once its dependency counter drops to zero,
+    so the streams of the list only bound how many kernels may run at once.
+    The lowered kernels are sequential loop nests, so every kernel runs on
+    the worker of its stream, and each grid is first touched on the worker of
+    the first kernel accessing it, i.e. its producer or, for inputs, its
+    first reader. Runs are timed with ``std::chrono``.
+    """
+
+    def gen_header(self, domain_size, halo_width):
+        header = \
+            f"""
+#include <cmath>
+#include <chrono>
+#include <atomic>
+#include <utility>
+#include <algorithm>
+#include <condition_variable>
+#include <cstdlib>
+#include <deque>
+#include <functional>
+#include <future>
+#include <iomanip>
+#include <memory>
+#include <mutex>
+#include <thread>
+#include <vector>
+
+// define the domain size and the halo width
+int32_t domain_size = {domain_size};
+int32_t domain_height = {domain_size};
+int32_t halo_width = {halo_width};
+
+typedef {self.element_type} ElementType;
+#define STENCIL_CPU_ONLY
+#include "util.h"
+"""
+        self.code.append(header)
+        return header
+
+    def gen_runtime(self):
+        self.code.append(CPU_RUNTIME)
+
+    def kernel_workers(self):
+        """The worker running every kernel: the index of its stream."""
+        workers = {}
+        for index, stream in enumerate(self.stream_list):
+            for ele in stream:
+                if ele in self.name2kernel:
+                    workers[ele] = index
+        return workers
+
+    def first_worker(self, var):
+        """The worker of the first kernel accessing ``var``, 0 if none does."""
+        before = happens_before(self.stream_list)
+        workers = self.kernel_workers()
+        access = [k for k in before if var in self.name2kernel[k].variables]
+        if not access:
+            return 0
+        return workers[min(access, key=lambda k: len(before[k]))]
+
+    def gen_task_graph(self):
+        kernels, preds = task_graph(self.stream_list)
+        index = {kernel: i for i, kernel in enumerate(kernels)}
+        workers = self.kernel_workers()
+        lines = [f"  TaskGraph graph({len(kernels)});"]
+        for kernel in kernels:
+            args = ", ".join(f"&p->{var}" for var in self.name2kernel[kernel].variables)
+            lines.append(f"  graph.body[{index[kernel]}] = [p] {{ _mlir_ciface_{kernel}({args}); }};")
+            lines.append(f"  graph.worker[{index[kernel]}] = {workers[kernel]};")
+        for kernel in kernels:
+            for pred in preds[kernel]:
+                lines.append(f"  graph.depend({index[kernel]}, {index[pred]});")
+        self.code.append("\n".join(lines))
+
+    def gen_mem2d(self):
+        self.code.append("  WorkerPool pool(poolSize());")
+        for k in self.allocated_variables():
+            self.code.append(f"  firstTouch(pool, p->{k}, {self.first_worker(k)});")
+        for var, owner in sorted(self.buffer_of.items()):
+            if var != owner:
+                self.code.append(f'  p->{var} = p->{owner};')
+
+    def gen_timing_and_run(self):
+        swap = ""
+        if self.swaps:
+            swap = "if(i + 1 < iterations){\n      " + "\n      ".join(
+                f"std::swap(p->{out_var}, p->{in_var});" for out_var, in_var in self.swaps) + "\n    }"
+        timing = \
+            f"""
+  int steps = {self.run_step};
+  int warmup = envInt("STENCIL_WARMUP", 0);
+  int repeats = envInt("STENCIL_REPEATS", 1);
+  int iterations = warmup + steps * repeats;
+  std::vector<double> samples;
+  for(int i = 0; i < iterations; i++){{
+    auto start = std::chrono::steady_clock::now();
+    graph.run(pool);
+    auto stop = std::chrono::steady_clock::now();
+    double elapsed = std::chrono::duration<double, std::milli>(stop - start).count();
+
+    if(i >= warmup){{
+      samples.push_back(elapsed);
+      std::cout << "time : " << std::fixed << std::setprecision(6) << elapsed << std::defaultfloat << std::endl;
+    }}
+    {swap}
+  }}
+  writeTiming(warmup, samples);"""
+        self.code.append(timing)
+
+    def gen_mem_out(self):
+        for out in sorted(self.out_variables):
+            self.code += self.gen_output(out)
+            self.code.append(f"  freeStorage(p->{out});")
+
+    def gen(self, file=sys.stdout):
+        self.gen_header(self.domain_size, self.halo_width)
+        self.gen_kernel_def()
+        self.gen_printStorage()
+        self.gen_runtime()
+        self.gen_struct_parameter(self.all_variables)
+        self.gen_main_start()
+        self.gen_var_def(self.all_variables)
+        self.gen_mem2d()
+        self.gen_init_statement()
+        self.gen_task_graph()
+        self.gen_timing_and_run()
+        if self.output_on:
+            self.gen_mem_out()
+        self.gen_main_end()
+        print("\n".join(self.code), file=file)
+
+
 if __name__ == '__main__':
     kernel_name = "fastwavesuv"  # kernel 名
     varibles = {
@@ -12,23 +12,43 @@
 #   2. 实现 apply 计算合并
 import sys
 import copy
-from queue import deque
 import tvm
 from tvm import relay
 from collections import defaultdict
 from tvm.ir.module import IRModule
 from tvm.relay import ExprVisitor, ExprMutator
-from tvm.relay.transform.utils import BuildGraph
+from tvm.relay.transform.utils import BuildGraph, call_args
 from tvm.relay.transform.dnn_fusion import StencilFuseOps
 from tvm.relay.transform.node_auto_fusion import NodeAutoFusion
 from tvm.relay.transform.streamSolve import StreamSolver
+from tvm.relay.transform.stencil_executor import compare, precision_error, DTYPES
+from tvm.relay.transform.stencil_te import register_apply, benchmark
+from tvm.relay.transform.cost_model import CostModel
+from tvm.relay.transform.temporal import unroll_timesteps, default_feedback
+from tvm.relay.transform.stencil_ir import (
+    ApplyBody,
+    StencilApply,
+    StencilProgram,
+    access_extents,
+    format_bounds,
+    fuse_applies,
+    infer_bounds,
+    parse_bounds,
+    resize_mlir,
+    retype_mlir,
+)
 import os
+import time
+import shutil
 import subprocess
 import re
 import sys
 
-from tvm.relay.transform.maingen import GenMain, Kernel
+from tvm.relay.transform.maingen import ELEMENT_TYPES, CpuGenMain, GenMain, Kernel
 from tvm.relay.transform.run import Evaluate
+from tvm.relay.transform.tracing import span, traced
+from tvm.relay.transform.tile_tuner import TileTuner, TuningDatabase, runner_for, TUNING_DB
+from tvm.relay.transform.stencil_outputs import compare_outputs, mismatched
 
 
 name2relayop = {
@@ -64,7 +84,7 @@ class BuildGraph(ExprVisitor):
         self.call_list.append(call)
         # 访问 call 的父节点，而不是访问 op 里面的东西
         # return super().visit_call(call)
-        for a in call.args:
+        for a in call_args(call):
             self.visit(a)
 
     def topo_sort(self, graph):
@@ -82,7 +102,7 @@ class BuildGraph(ExprVisitor):
         depend_graph = {}
         for call in self.call_list:
             depend_graph[call] = set()
-            for a in call.args:
+            for a in call_args(call):
                 if isinstance(a, relay.Call):
                     depend_graph[call].add(a)
                 elif isinstance(a, relay.TupleGetItem):
@@ -121,7 +141,7 @@ class ReplaceCallOp(ExprVisitor):
             new_tag = fuse_tag.replace("fuse_", "%")
             self.variable2name[call] = new_tag
         self.visit(call.op)
-        for a in call.args:
+        for a in call_args(call):
             self.visit(a)
     
     def visit_var(self, var):
@@ -136,10 +156,14 @@ class ReplaceCallOp(ExprVisitor):
 
 
 class MLIRCodeGen:
-    def __init__(self, mesh_size=128, halo_width=8, FUSION = True, STREAM = True, INLINE = False, output_on = False) -> None:
+    def __init__(self, mesh_size=128, halo_width=8, FUSION = True, STREAM = True, INLINE = False, output_on = False, cost_model = None, measure_top = 3, verify = False, backend = "mlir", search = None, max_streams = None, recorder = None, reuse_buffers = False, timesteps = 1, feedback = None, run_steps = 1, reference_outputs = None, precision = "f64", keep_f64 = (), tuning_db = TUNING_DB, tune_tiles = False) -> None:
         self.ir_module = None
         self.call_sequence = None
-        self.dtype = "f64"
+        # 网格与计算的元素类型 "f64"/"f32"；keep_f64 中的 apply（True 为全部）在 f32 网格上仍用 f64 计算
+        self.dtype = precision
+        self.keep_f64 = keep_f64
+        # 降精度时 from_mlir 在小网格上相对 f64 程序的最大误差，{arg: {"max_abs", "max_rel"}}
+        self.precision_error = {}
 
         self.args_base = 0
         # tag 2 stencil.apply, load
@@ -160,16 +184,57 @@ class MLIRCodeGen:
         self.mlir_name = ""
 
         self.step = 0
+        # call -> ApplyBody，融合后的 call 不变，跨步骤与网格大小复用
+        self.apply_cache = {}
+        self.extent_cache = {}
 
 
         self.mesh_size = mesh_size
         self.halo_width = halo_width
         # self.run_autofusion = run_autofusion
         # self.run_baseline = run_baseline
+        # True/"npy"、"checksum" 或 "text"，见 GenMain.output_mode；前两种每次运行后与参考输出比对
         self.output_on = output_on
+        # mesh_size -> 参考输出目录，如基线运行的输出；没有时第一次运行的输出作为参考
+        self.reference_outputs = dict(reference_outputs or {})
         self.FUSION = FUSION
         self.STREAM = STREAM
         self.INLINE = INLINE
+        # 有代价模型时搜索只按预测值前进，最后实测预测最快的 measure_top 个方案
+        # 流量按网格实际的元素大小计，f64 上标定的权重同样适用于 f32
+        elem_bytes = ELEMENT_TYPES[precision][1]
+        if cost_model is not None and cost_model.elem_bytes != elem_bytes:
+            cost_model = CostModel(cost_model.weights, elem_bytes)
+        self.cost_model = cost_model
+        # 没有代价模型时给流调度和融合打分用的未标定模型
+        self.scoring_model = cost_model or CostModel(elem_bytes=elem_bytes)
+        self.measure_top = measure_top
+        self.program = None
+        # 每步用 NumPy 执行器逐位比对融合前后的程序
+        self.verify = verify
+        # "mlir": open-earth 编译到 GPU；"cpu": open-earth 降到 CPU 循环，由 CpuGenMain 的任务图多线程运行；
+        # "llvm": TE compute 经 relay.build 在 CPU 上运行
+        self.backend = backend
+        # NodeAutoFusion 的搜索参数，如 {"beam_width": 4, "lookahead": 1, "budget": 50}
+        self.search = search or {}
+        # 给定时用列表调度分配最多 max_streams 个 stream，否则按层分配
+        self.max_streams = max_streams
+        # recorder(step, **fields) 收到每个测量结果，如 ResultStore.recorder(cell)
+        self.recorder = recorder
+        # 按生命周期让中间结果共用设备存储，见 maingen.plan_buffers；和 GenMain 一样默认关闭
+        self.reuse_buffers = reuse_buffers
+        # 时间步展开：timesteps 步连成一个图再融合，feedback 为 {输出 field: 输入 field}，
+        # 如 {"arg10": "arg0"}；run_steps 为主机端循环次数，步间交换输入输出的存储
+        self.timesteps = timesteps
+        self.feedback = feedback
+        self.run_steps = run_steps
+        # 按 kernel 内容哈希记录的分块，每次 Evaluate 前查询；tune_tiles 时先为每个方案的 kernel 调优
+        self.tuning = TuningDatabase(tuning_db) if tuning_db else None
+        self.tune_tiles = tune_tiles
+        # 最近一次 Evaluate 的编译/链接/运行耗时
+        self.timings = {}
+        # 最近一次生成的主程序的 memory_report
+        self.memory = None
         # self.run_only_basic = run_only_basic
 
     def register_code_with_tag(self, tag, code):
@@ -187,7 +252,7 @@ class MLIRCodeGen:
             shape = [int(dim) for dim in string.split("x")[:-1]]
             return [max(dim, 1) for dim in shape]
     
-    def parse_apply(self, line, code):
+    def parse_apply(self, line, lines):
         # parse func_tag and ret_number
         mlir_tag = line.split()[0]
         if ":" in mlir_tag:
@@ -200,8 +265,10 @@ class MLIRCodeGen:
         
         # parse args
         args = line[line.find("(") + 1:line.find(")")].split(", ")
+        arg_names = []
         args_tag = []
         for arg in args:
+            arg_names.append(arg.split()[0])
             var_tag = arg.split()[2]
             args_tag.append(var_tag)
         # get args value
@@ -216,17 +283,20 @@ class MLIRCodeGen:
                 args_var.append(self.tag2code[tag]["data"])
         
         # build relay.stencil
-        relay_op = name2relayop[f"in{len(args_var)}out{ret_num}" if ret_num == 1 else f"in{len(args_var)}mout"]
-        relay_args = copy.copy(args_var)
-        relay_args.append(func_tag)
-        if ret_num > 1:
-            relay_args.append(ret_num)
-        data = relay_op(*relay_args) #Call
+        op_name = f"in{len(args_var)}out{ret_num}" if ret_num == 1 else f"in{len(args_var)}mout"
+        if op_name in name2relayop:
+            relay_args = copy.copy(args_var)
+            relay_args.append(func_tag)
+            if ret_num > 1:
+                relay_args.append(ret_num)
+            data = name2relayop[op_name](*relay_args) #Call
+        else:
+            # 没有固定元数的算子时使用可变输入输出的 stencil.apply
+            data = relay.stencil.apply(args_var, func_tag, ret_num)
         
         # mlir code body
         body = []
-        while code:
-            line = code.pop(0)
+        for line in lines:
             body.append(line)
             if "stencil.return" in line:
                 break
@@ -234,16 +304,16 @@ class MLIRCodeGen:
         self.tag2code[mlir_tag] = {
             "type": "func",
             "data": data,
-            "mlir_body": body
+            "mlir_body": body,
+            "body": ApplyBody.from_mlir(body, arg_names),
         }
+        register_apply(func_tag, self.tag2code[mlir_tag]["body"])
 
-        return code
-    
     def parse_load(self, line):
         mlir_tag = line.split()[0]
         data_tag = mlir_tag.replace("%", "data_")
         shape = self.parse_shape(line[line.find("<") + 1:line.find(">")])
-        data = relay.var(data_tag, shape=shape)
+        data = relay.var(data_tag, shape=shape, dtype=DTYPES[self.dtype].__name__)
         mlir_shape = line.split()[-1]
         self.data2shape[data] = mlir_shape
         self.data2shape[mlir_tag] = mlir_shape
@@ -261,20 +331,36 @@ class MLIRCodeGen:
         last_args = line.split(":")[-2].split(", ")[-1]
         self.args_base = int(last_args.replace("%arg", "")) + 1
     
+    @traced("parse")
     def from_mlir(self, code, mlir_name=''):
         self.mlir_name = mlir_name
+        if self.timesteps > 1 or self.feedback:
+            self.feedback = {k.lstrip("%"): v.lstrip("%") for k, v in
+                             (self.feedback or default_feedback(StencilProgram.from_mlir(code))).items()}
+            code = unroll_timesteps(code, self.timesteps, self.feedback)
         self.in_code = copy.copy(code)
         code = self.format_code(code)
+        if self.dtype != "f64":
+            reference = code
+            code = retype_mlir(code, self.dtype, self.keep_f64)
+            self.in_code = copy.copy(code)
+            if self.verify:
+                self.check_precision(reference, code)
         self.original_code = code
+        self.program = StencilProgram.from_mlir(code)
+        self.build_module(code)
+
+    def build_module(self, code):
+        """Parse the applies, loads and stores of ``code`` into the relay module."""
         args_data = []
         ret_var = []
         ret_data = []
         cast_data = []
         program_data = []
-        while code:
-            line = code.pop(0)
+        lines = iter(code)
+        for line in lines:
             if "stencil.apply" in line:
-                code = self.parse_apply(line, code)
+                self.parse_apply(line, lines)
             elif "stencil.load" in line:
                 cast_data.append(line)
                 var = self.parse_load(line)
@@ -295,7 +381,8 @@ class MLIRCodeGen:
         
         func = relay.Function(args_data, ret_var) #args_data 输入网格 ret_var Call node
         mod = tvm.IRModule.from_expr(func)
-        mod = relay.transform.InferType()(mod)
+        with span("InferType"):
+            mod = relay.transform.InferType()(mod)
         self.ir_module = mod
 
         self.args_data    = args_data
@@ -321,10 +408,59 @@ class MLIRCodeGen:
         #     print(call.attrs.tag if call.attrs else call.op.attrs['tag'])
         #     print("\n".join(code_lines))
 
+    def fusion_generator(self):
+        """A copy of the code generator for the fusion search, sharing the body caches."""
+        memo = {id(self.apply_cache): self.apply_cache, id(self.extent_cache): self.extent_cache}
+        return copy.deepcopy(self, memo)
+
     def fuse_op(self):
         # self.ir_module = StencilFuseOps()(self.ir_module)
-        generator = copy.deepcopy(self)
-        self.ir_module = NodeAutoFusion(self.ir_module).fuse(generator)
+        generator = self.fusion_generator()
+        self.ir_module = NodeAutoFusion(self.ir_module, **self.search).fuse(generator)
+
+    def resize(self, mesh_size, halo_width=None):
+        """Move the parsed program to another mesh size without parsing it again.
+
+        The MLIR lines and the StencilProgram get the bounds of the new size.
+        The relay graph, the apply bodies and their fusions don't depend on the
+        size and are kept, except for the llvm backend, whose computes take the
+        grid shapes from the graph: its module is rebuilt from the resized lines.
+        """
+        halo_width = self.halo_width if halo_width is None else halo_width
+        self.mesh_size = mesh_size
+        self.halo_width = halo_width
+        self.in_code = resize_mlir(self.in_code, mesh_size, halo_width)
+        self.original_code = resize_mlir(self.original_code, mesh_size, halo_width)
+        self.cast_data = resize_mlir(self.cast_data, mesh_size, halo_width)
+        self.ret_data = resize_mlir(self.ret_data, mesh_size, halo_width)
+        self.program = self.program.resized(mesh_size, halo_width)
+        if self.backend == "llvm":
+            self.build_module(self.original_code)
+
+    def fuse_op_sizes(self, mesh_sizes, recorders=None):
+        """``fuse_op`` at every mesh size of ``mesh_sizes`` with one fusion search.
+
+        The search runs at the first size, the other sizes re-rank and measure
+        its plans with ``NodeAutoFusion.evaluate_plans``. ``recorders`` maps a
+        mesh size to the recorder of its results. Returns the best module of
+        every size.
+        """
+        recorders = recorders or {}
+        modules = {}
+        fusion = None
+        for mesh_size in mesh_sizes:
+            if mesh_size != self.mesh_size:
+                self.resize(mesh_size)
+            self.recorder = recorders.get(mesh_size, self.recorder)
+            generator = self.fusion_generator()
+            if fusion is None or not self.FUSION:
+                fusion = NodeAutoFusion(self.ir_module, **self.search)
+                modules[mesh_size] = fusion.fuse(generator)
+            else:
+                rebuilt = self.ir_module if self.backend == "llvm" else None
+                modules[mesh_size] = fusion.evaluate_plans(generator, rebuilt)
+        self.ir_module = modules[mesh_sizes[-1]]
+        return modules
     
     def reverse_variable_name(self, func):
         for tag, value in self.tag2code.items():
@@ -332,68 +468,42 @@ class MLIRCodeGen:
         replace_op = ReplaceCallOp(self.tag2code, self.variable2name)
         replace_op.transform(func)
     
-    def add_suffix(self, body_list):
-        for idx, body in enumerate(body_list):
-            for line_id, line in enumerate(body):
-                tokens = line.split()
-                tokens = [(token + f"_{idx}") if "%" in token else token for token in tokens]
-                tokens = [token.replace(f",_{idx}", f"_{idx},") for token in tokens]
-                line = " ".join(tokens)
-                body[line_id] = line
-    
-    def args_replace(self, body_list, call):
+    def args_replace(self, call):
+        """Bind the arguments of every stencil in a fused call.
+
+        Returns the per-stencil argument bindings and the (stencil, result)
+        pairs returned by the fused apply, see ``stencil_ir.fuse_applies``.
+        """
         fuse_tag = self.variable2name[call]
         sub_tags = ["%" + tag for tag in fuse_tag[1:].split("_")]
         fuse_args = list(call.op.params)
         sub_op = [self.tag2code[tag]["data"] for tag in sub_tags]
-        
-        # fuse args map
-        args_map = {}
-        for op_id, op in enumerate(sub_op):
-            for arg_id, arg in enumerate(op.args):
+        sub_body = [self.tag2code[tag]["body"] for tag in sub_tags]
+        op_index = {op: op_id for op_id, op in enumerate(sub_op)}
+
+        # fuse args map / serial op args map
+        bindings = []
+        for op in sub_op:
+            op_bindings = []
+            for arg in call_args(op):
                 if arg in fuse_args:
-                    args_map[f"%arg{self.args_base + arg_id}_{op_id}"] = f"%arg{self.args_base + fuse_args.index(arg)}"
-        # serial op args map
-        op_output = {}
-        for op_id, op in enumerate(sub_op):
-            body = body_list[op_id]
-            sub_output = []
-            for line in body:
-                if "stencil.store_result" in line:
-                    sub_output.append((line.split()[3], line.split()[0]))
-                elif "stencil.return" in line:
-                    order = line[:line.find(":")].replace(",", "").split()[1:]
-                    sub_output.sort(key=lambda x: order.index(x[1]))
-            op_output[op] = sub_output
-            for arg_id, arg in enumerate(op.args):
-                if arg in op_output:
-                    args_map[f"%arg{self.args_base + arg_id}_{op_id}"] = op_output[arg][0][0]
-                elif isinstance(arg, relay.TupleGetItem) and arg.tuple_value in op_output:
-                    args_map[f"%arg{self.args_base + arg_id}_{op_id}"] = op_output[arg][arg.index][0]
-
-        # args var replace
-        for body in body_list:
-            for line_id, line in enumerate(body):
-                for key, value in args_map.items():
-                    line = line.replace(key + " ", value + " ")
-                body[line_id] = line
-        
-        # output remove, 也许应该把相关的 store 和 return 全部删除，然后重新生成
-        for op_id, op in enumerate(op_output):
-            body = body_list[op_id]
-            new_body = []
-            for line in body:
-                if "stencil.return" in line or "stencil.store_result" in line:
-                    continue
+                    op_bindings.append(("arg", fuse_args.index(arg)))
+                elif arg in op_index:
+                    op_bindings.append(("result", op_index[arg], 0))
+                elif isinstance(arg, relay.TupleGetItem) and arg.tuple_value in op_index:
+                    op_bindings.append(("result", op_index[arg.tuple_value], arg.index))
                 else:
-                    new_body.append(line)
-            body_list[op_id] = new_body
+                    raise ValueError(f"can not bind argument of {fuse_tag}: {arg}")
+            bindings.append(op_bindings)
+
+        def all_results(op_id):
+            return [(op_id, idx) for idx in range(len(sub_body[op_id].results))]
 
         # 寻找整体的 output
         output = call.op.body
-        output_var = []
+        outputs = []
         if isinstance(output, relay.Call):
-            output_var += op_output[output]
+            outputs += all_results(op_index[output])
         elif isinstance(output, relay.Tuple):
             output_call = []
             for sub_out in output.fields:
@@ -402,212 +512,84 @@ class MLIRCodeGen:
                 if sub_out not in output_call:
                     output_call.append(sub_out)
             for sub_out in output_call:
-                if sub_out in op_output:
-                    output_var += op_output[sub_out]
+                if sub_out in op_index:
+                    outputs += all_results(op_index[sub_out])
                 else:
                     if sub_out.attrs:
                         sub_out_tag = sub_out.attrs.tag
                     else:
                         sub_out_tag = sub_out.op.body.attrs.tag
-                    for key, value in op_output.items():
-                        if key.attrs.tag == sub_out_tag:
-                            output_var += value
+                    for op_id, op in enumerate(sub_op):
+                        if op.attrs.tag == sub_out_tag:
+                            outputs += all_results(op_id)
                             break
         else:
             raise TypeError("output class:" + type(output))
+        return bindings, outputs
 
-        body = []
-        return_var = []
-        for var_pair in output_var:
-            body.append(f"{var_pair[1]} = stencil.store_result {var_pair[0]} : ({self.dtype}) -> !stencil.result<{self.dtype}>")
-            return_var.append(var_pair[1])
-        var_list = ", ".join(return_var)
-        ret_type = ", ".join([f"!stencil.result<{self.dtype}>"] * len(return_var))
-        body.append(f"stencil.return {var_list} : {ret_type}")
-        body_list.append(body)
-
-    def repeat_access(self, body_list):
-        fuse_body = []
-        for body in body_list:
-            fuse_body += body
-        return self.repeat_access_once(fuse_body)
-
-    def repeat_access_once(self, fuse_body, last_deep_vars=set()):
-        # find repeat_access
-        wait_repeat_access = []
-        for line in fuse_body:
-            if "stencil.access" in line and "arg" not in line:
-                wait_repeat_access.append(line)
-        if len(wait_repeat_access) == 0 and len(last_deep_vars) == 0:
-            return fuse_body
-
-        # build var2line
-        var_def2line = {}
-        var_compute = {}
-        for idx, line in enumerate(fuse_body):
-            if line and len(line.split()) == 1:
-                print(line)
-                # import pdb; pdb.set_trace()
-            if line.split()[1] != "=":
-                continue
-            var = line.split()[0]
-            var_def2line[var] = (idx, line)
-            var_compute[var] = [tmp.replace(",", "") for tmp in line.split()[2:] if tmp[0] == "%"]
-
-        # search related code, in one stencil apply
-        def search_related_line(root_var):
-            """return: """
-            var_list = deque([root_var])
-            line_list = []
-            while var_list:
-                var = var_list.popleft()
-                idx_line = var_def2line.get(var, (-1, ""))
-                if idx_line[0] == -1:
-                    continue
-                line_list.append(idx_line)
-                body_idx = var.split("_")[1]
-                var_list += deque(filter(lambda x:x.split("_")[-1] == body_idx, var_compute.get(var, [])))
-            line_list.sort(key=lambda entry: entry[0])
-            line_list = sorted(set(line_list), key=line_list.index)
-            return line_list
-
-        access_var = {}
-        for line in wait_repeat_access:
-            var = line.split()[3]
-            if var in access_var:
-                continue
-            access_var[var] = search_related_line(var)
-
-        # 过滤repeat access 的代码，深层次 access 不展开
-        def filter_access(repeat_access):
-            access_var_depend = {}
-            for var, compute_line in access_var.items():
-                access_var_depend[var] = []
-                for line in compute_line:
-                    if "stencil.access" in line[1] and "arg" not in line[1]:
-                        access_var_depend[var].append(line[1].split()[3])
-
-            deep_var = set()
-            for var, depend_vars in access_var_depend.items():
-                for d_var in depend_vars:
-                    if d_var in access_var_depend:
-                        deep_var.add(d_var)
-            shallow_access = []
-            for line in repeat_access:
-                if line.split()[3] not in deep_var:
-                    shallow_access.append(line)
-            shallow_var = set(access_var_depend.keys()) - deep_var
-            return shallow_access, deep_var
-
-        # add offset
-        def add_offset(related_line, offset, deep_vars):
-            offseted_line = []
-            
-            for idx_line in related_line:
-                if "stencil.access" in idx_line[1]:
-                    line = idx_line[1]
-                    origin_offset = list(map(int, line[line.find("[") + 1: line.find("]")].split(", ")))
-                    new_offset = [a + b for a, b in zip(origin_offset, offset)]
-                    line = line.replace(", ".join(map(str, origin_offset)), ", ".join(map(str, new_offset)))
-                else:
-                    line = idx_line[1]
-                str_offset = "_" + "".join(map(str, offset))
-                def format_token(token):
-                    if token[0] == "%" and token[1].isdigit() and token not in deep_vars:
-                        return token + str_offset if token[-1] != "," else token[:-1] + str_offset + ","
-                    return token
-                line = " ".join(format_token(token) for token in line.split())
-                offseted_line.append((idx_line[0], line))
-            return offseted_line
-
-        # get ret var
-        ret_line = fuse_body[-1]
-        ret_vars = [token for token in ret_line.replace(",", "").split() if token.startswith("%")]
-        ret_def_vars = [var_def2line[var][1].split()[3] for var in ret_vars]
-
-        offset_code = {}
-        wait_repeat_access, deep_vars = filter_access(wait_repeat_access)
-        for line in wait_repeat_access:
-            var = line.split()[3]
-            offset = list(map(int, line[line.find("[") + 1: line.find("]")].split(", ")))
-            offset_code[line] = add_offset(access_var[var], offset, deep_vars)
-            if var in ret_def_vars:
-                offset_code["ret_var:" + var] = add_offset(access_var[var], [0] * len(offset), deep_vars)
-
-        # replace code
-        line_idx_map = {}
-        replace_var = {}
-        for line, code_list in offset_code.items():
-            if "ret_var" not in line:
-                use_var = line.split()[0]
-            else:
-                # 用于replace ret var, ret_var + "_000"
-                use_var = code_list[-1][1].split()[0].replace("_000", "")
-            for line_idx in code_list:
-                idx = line_idx[0]
-                if idx in line_idx_map:
-                    if line_idx[1] in line_idx_map[idx]:
-                        continue
-                    line_idx_map[idx].append(line_idx[1])
-                else:
-                    line_idx_map[idx] = [line_idx[1]]
-            if "ret_var" not in line:
-                idx = fuse_body.index(line)
-                fuse_body[idx] = ""
-            try:
-                replace_var[use_var] = code_list[-1][1].split()[0]
-            except:
-                print('ERROR!')
-                print(code_list)
-        new_body = []
-        for idx, line in enumerate(fuse_body):
-            if not line:
-                continue
-            new_body.append(line)
-            if idx in line_idx_map:
-                new_body.pop(-1)
-                if line.split()[0] in ret_vars:
-                    new_body.append(line)
-                new_body += line_idx_map[idx]
-        for idx, line in enumerate(new_body):
-            for var, new_var in replace_var.items():
-                line = line.replace(var + ",", new_var + ",").replace(var + " ", new_var + " ")
-            new_body[idx] = line
-        return self.repeat_access_once(new_body, deep_vars)
-
-    def return_fix(self, body_list, call):
-        # TODO: 修复 return 相关操作
-        pass
-
-    def fuse_body(self, body_list, call):
-        if len(body_list) == 1:
-            return "\n\t" + "\n\t".join(body_list[0]) + "\n"
-        self.add_suffix(body_list)
-        self.args_replace(body_list, call)
-        fuse_body = self.repeat_access(body_list)
-        return "\n\t" + "\n\t".join(fuse_body) + "\n"
-
-    def var_name_in_apply(self, body):
-        idx = 1
-        var_map = {}
-        var_list = [token.replace(",", "") for token in body.split() if token[0] == "%" and token[1].isdigit()]
-        for var in var_list:
-            if var not in var_map:
-                var_map[var] = f"%var_{idx}"
-                idx += 1
-            new_name = var_map[var]
-            body = body.replace(var + ",", new_name + ",")
-            body = body.replace(var + " ", new_name + " ")
-        return body
-
-    def access_shape_replace(self, body, args_shape):
-        for idx, line in enumerate(body):
-            if "stenci.access" in line:
-                arg_key_name = line.split()[3]
-                fake_shape = line[line.find("(") + 1: line.find(")")]
-                body[idx] = line.replace(fake_shape, args_shape[arg_key_name])
+    def fuse_body(self, call):
+        """Return the ApplyBody of a (possibly fused) call, built once per call."""
+        if call in self.apply_cache:
+            return self.apply_cache[call]
+        tag = self.variable2name[call]
+        if tag in self.tag2code:
+            body = self.tag2code[tag]["body"]
+        else:
+            sub_tags = ["%" + sub_tag for sub_tag in tag.replace("%", "").split("_")]
+            bodies = [self.tag2code[sub_tag]["body"] for sub_tag in sub_tags]
+            bindings, outputs = self.args_replace(call)
+            body = fuse_applies(bodies, bindings, outputs, len(call_args(call)))
+        self.apply_cache[call] = body
         return body
 
+    def fused_program(self):
+        """The current call sequence as a StencilProgram of ``fuse_body`` applies."""
+        results = {}
+        applies = []
+        for call in self.call_sequence:
+            tag = self.variable2name[call]
+            if tag in self.tag2code:
+                results[call] = list(self.program.apply(tag).results)
+            else:
+                sub_tags = ["%" + sub_tag for sub_tag in tag[1:].split("_")]
+                _, outputs = self.args_replace(call)
+                results[call] = [self.program.apply(sub_tags[k]).results[r] for k, r in outputs]
+            operands = []
+            for a in call_args(call):
+                if isinstance(a, relay.TupleGetItem):
+                    operands.append(results[a.tuple_value][a.index])
+                elif isinstance(a, relay.Call):
+                    operands.append(results[a][0])
+                else:
+                    operands.append(self.variable2name[a])
+            applies.append(StencilApply(tag, results[call], operands, self.fuse_body(call)))
+        return self.program.with_applies(applies)
+
+    def check_precision(self, reference, code, mesh_size=16):
+        """Print the error of the reduced-precision ``code`` against the f64 ``reference``.
+
+        The errors are kept in ``self.precision_error``; a program the NumPy
+        executor can't run is reported and doesn't stop the search.
+        """
+        try:
+            reference = StencilProgram.from_mlir(resize_mlir(reference, mesh_size, self.halo_width))
+            reduced = StencilProgram.from_mlir(resize_mlir(code, mesh_size, self.halo_width))
+            self.precision_error = precision_error(reference, reduced, DTYPES[self.dtype])
+        except Exception as err:
+            print(f"{self.mlir_name}: {self.dtype} precision check failed: {err!r}")
+            return
+        for arg, error in self.precision_error.items():
+            print(f"{self.dtype} {arg}: max abs error {error['max_abs']:.3g}, max rel error {error['max_rel']:.3g}")
+
+    def verify_fusion(self, mesh_size=16):
+        """Check the fused program against the original one bit for bit."""
+        original = self.program.resized(mesh_size, self.halo_width)
+        fused = self.fused_program().resized(mesh_size, self.halo_width)
+        mismatch = compare(original, fused)
+        if mismatch:
+            raise ValueError(f"{self.mlir_name} step {self.step}: fused program differs in {mismatch}")
+
+    @traced("print_code")
     def print_code(self, call, STREAM=0):
         # output
         output = self.variable2name[call]
@@ -622,7 +604,7 @@ class MLIRCodeGen:
 
         # arguments
         args = []
-        for a in call.args:
+        for a in call_args(call):
             tuple_str = ""
             v = ''
             if isinstance(a, relay.TupleGetItem):
@@ -636,25 +618,14 @@ class MLIRCodeGen:
             name = self.fuse_name_map.get(name, name)
             args.append(name.replace('%','%'+v) + tuple_str)
         args_list = []
-        args_shape = {}
         for idx, arg in enumerate(args):
             arg_key_name = f"%arg{self.args_base + idx}"
             arg_shape = self.data2shape.get(arg, f"!stencil.temp<?x?x?x{self.dtype}>")
             args_list.append(f"{arg_key_name} = {arg} : {arg_shape}")
-            args_shape[arg_key_name] = arg_shape
         args_str = ", ".join(args_list)
 
-        tag = self.variable2name[call]
-        if tag in self.tag2code:
-            body_list = [self.tag2code[tag]["mlir_body"]]
-        else:
-            body_list = []
-            mlir_tags = ["%" + sub_tag for sub_tag in tag.replace("%", "").split("_")[:]]
-            for mlir_tag in mlir_tags:
-                body_list.append(self.tag2code[mlir_tag]["mlir_body"][:])
-        body = self.fuse_body(body_list, call)
-        body = self.var_name_in_apply(body)
-        body = self.access_shape_replace(body, args_shape)
+        body = self.fuse_body(call).to_mlir(self.args_base)
+        body = "\n\t" + "\n\t".join(body) + "\n"
 
         return f"{output} = stencil.apply ({args_str}) -> {ret_type} " + "{" + body + "}"
 
@@ -741,7 +712,7 @@ class MLIRCodeGen:
         
         #找到这个call依赖的stencil结果(这个call里面所有的输出)
         call_input_list = []
-        for a in call.args:
+        for a in call_args(call):
             v = ''
             if isinstance(a, tvm.relay.expr.Var):
                 continue
@@ -758,7 +729,7 @@ class MLIRCodeGen:
         
 
 
-    def PRINT_CALL_MLIR(self, call, MESHSIZE, HALO, MLIR_PATH, call_shape_infer, file=sys.stdout):
+    def PRINT_CALL_MLIR(self, call, MESHSIZE, HALO, call_shape_infer, file=sys.stdout):
         def PRINT_BRA(n1,n2,n3):
             return '['+str(n1)+', '+str(n2)+', '+str(n3)+']'
         def PRINT_ANG(s1,s2,s3,s4):
@@ -780,7 +751,7 @@ class MLIRCodeGen:
         
         #找到这个call依赖的stencil结果(这个call里面所有的输出)
         call_input_list = []
-        for a in call.args:
+        for a in call_args(call):
             v = ''
             if isinstance(a, tvm.relay.expr.Var):
                 continue
@@ -798,7 +769,7 @@ class MLIRCodeGen:
         # 在原始func后添加input和output，对于每个stencil结果和依赖的输入, func注册名字 
         func_out_string = ''
         for name in call_input_list+call_output_list:
-            func_out_string+=', %func_'+name+': !stencil.field<?x?x?xf64>' #TODO:shape未对应，先留着
+            func_out_string+=', %func_'+name+': !stencil.field<?x?x?x'+self.dtype+'>' #TODO:shape未对应，先留着
         program_data = self.program_data[0]
         program_data=program_data.replace('>)','>'+func_out_string+')')
         print('func @kernel_'+GET_CALL_TAG(call)+'('+program_data.split('(')[-1], file=file)
@@ -808,7 +779,7 @@ class MLIRCodeGen:
         '''%cast_name  = stencil.cast %func_name([-4, -4, -4] : [124, 124, 124]) : (!stencil.field<?x?x?xf64>) -> !stencil.field<128x128x128xf64> '''
         mycast_list = []
         for name in call_input_list+call_output_list:
-            t = '('+PRINT_BRA(-HALO,-HALO,-HALO)+' : ' + PRINT_BRA(MESHSIZE+HALO,MESHSIZE+HALO,MESHSIZE+HALO)+ ')' + ' : (!stencil.field<?x?x?xf64>) -> !stencil.field'+ PRINT_ANG(str(MESHSIZE+2*HALO),str(MESHSIZE+2*HALO),str(MESHSIZE+2*HALO),'f64')
+            t = '('+PRINT_BRA(-HALO,-HALO,-HALO)+' : ' + PRINT_BRA(MESHSIZE+HALO,MESHSIZE+HALO,MESHSIZE+HALO)+ ')' + ' : (!stencil.field<?x?x?x'+self.dtype+'>) -> !stencil.field'+ PRINT_ANG(str(MESHSIZE+2*HALO),str(MESHSIZE+2*HALO),str(MESHSIZE+2*HALO),self.dtype)
             mycast_list.append('%cast_'+name+' = stencil.cast '+'%func_'+name+t)
         print("\n".join(self.cast_data), file=file)
         print("\n".join(mycast_list), file=file)
@@ -817,7 +788,7 @@ class MLIRCodeGen:
         '''call的arg名字 = stencil.load %cast名字 : (!stencil.field<128x128x128xf64>) -> !stencil.temp<?x?x?xf64>'''
         myload_list = []
         for name in call_input_list:
-            t = ':'+'(!stencil.field'+ PRINT_ANG(str(MESHSIZE+2*HALO),str(MESHSIZE+2*HALO),str(MESHSIZE+2*HALO),'f64') +') -> !stencil.temp<?x?x?xf64>' #TODO:shape未对应，先留着
+            t = ':'+'(!stencil.field'+ PRINT_ANG(str(MESHSIZE+2*HALO),str(MESHSIZE+2*HALO),str(MESHSIZE+2*HALO),self.dtype) +') -> !stencil.temp<?x?x?x'+self.dtype+'>' #TODO:shape未对应，先留着
             myload_list.append('%'+name+' = stencil.load '+ '%cast_'+name + t)
         print("\n".join(myload_list), file=file)
 
@@ -830,7 +801,7 @@ class MLIRCodeGen:
         mystore_list = []
         for name in call_output_list:
             # t = '('+PRINT_BRA(0,0,0)+' : ' + PRINT_BRA(MESHSIZE-2*HALO,MESHSIZE-2*HALO,MESHSIZE-2*HALO)+ ')'+ ': !stencil.temp<?x?x?xf64> to !stencil.field' + PRINT_ANG(str(MESHSIZE),str(MESHSIZE),str(MESHSIZE),'f64')
-            t = call_shape_infer[call]+ ': !stencil.temp<?x?x?xf64> to !stencil.field' + PRINT_ANG(str(MESHSIZE+2*HALO),str(MESHSIZE+2*HALO),str(MESHSIZE+2*HALO),'f64')
+            t = call_shape_infer[call]+ ': !stencil.temp<?x?x?x'+self.dtype+'> to !stencil.field' + PRINT_ANG(str(MESHSIZE+2*HALO),str(MESHSIZE+2*HALO),str(MESHSIZE+2*HALO),self.dtype)
             if isinstance(call.checked_type, relay.TupleType):
                 name2 = name[::-1].replace('_', '#', 1)[::-1]
                 mystore_list.append('stencil.store '+'%'+name2+' to '+'%cast_'+name+t)
@@ -842,39 +813,52 @@ class MLIRCodeGen:
         print("return", file=file)
         print("}\n}", file=file)
 
-    def shape_infer(self,func,MLIR_PATH):
-        #原始的func后的arg信息
-        self.func_args = self.program_data[0].split('(')[1].split(')')[0].split(',')
-        #得到原始stencil的所有shape
-        MLIRNAME = "codegen_"+self.mlir_name + f"-{self.step}-{self.mesh_size}" +"_1func.mlir"
-        SHAPENAME = "codegen_"+self.mlir_name+".shape"
-        
-        #(1)fusion后单func的代码生成
-        # f = open("a.out","w+")
-        f = open(os.path.join(MLIR_PATH,MLIRNAME),'w+')
-        f.write("module {")
-        f.write("\n".join(self.program_data)) #mlir func里所有stencil需要的arg，func头
-        f.write("\n".join(self.cast_data)) #load输入矩阵
+    def access_extents(self, call):
+        """Access extents of every argument of a call, kept across fusion steps."""
+        output = call.op.body if isinstance(call.op, relay.Function) else None
+        if isinstance(output, relay.Tuple):
+            output = tuple(GET_CALL_TAG(f.tuple_value if isinstance(f, relay.TupleGetItem) else f) for f in output.fields)
+        elif output is not None:
+            output = GET_CALL_TAG(output)
+        args = []
+        for a in call_args(call):
+            if isinstance(a, relay.TupleGetItem):
+                args.append((self.variable2name[a.tuple_value], a.index))
+            else:
+                args.append((self.variable2name[a], None))
+        key = (self.variable2name[call], tuple(args), output)
+        if key not in self.extent_cache:
+            self.extent_cache[key] = access_extents(self.fuse_body(call))
+        return self.extent_cache[key]
+
+    def kernel_time(self, call):
+        """Predicted run time of a (fused) call, for the stream scheduler."""
+        model = self.scoring_model
+        tags = ["%" + tag for tag in self.variable2name[call][1:].split("_")]
+        return model.kernel_time(self.program, tags, self.mesh_size)
+
+    @traced("shape inference")
+    def shape_infer(self, func):
+        """Infer the bounds of every call from the stores and its consumers' accesses.
+
+        Returns one ``([lb] : [ub])`` string per call of ``call_sequence``.
+        """
+        applies = []
         for call in self.call_sequence:
-            f.write(self.print_code(call))
-        self.print_output(func,f)
-        f.write("return")
-        f.write("}\n}")
-        f.close()
-        #(2)体外调用进行shape inference: MLIR_PATH调用shape.sh写到SHAPENAME
-        f = open(os.path.join(MLIR_PATH,SHAPENAME),'w+')
-        ret = subprocess.call(["sh shape-inference.sh"+" "+MLIRNAME], shell=True, cwd = MLIR_PATH, stdout=f)
-        f.close()
-
-        # print('====shape infer====')
-        list = []
-        f = open(os.path.join(MLIR_PATH,SHAPENAME),'r')
-        shape_code = f.readlines()
-        for line in shape_code:
-            if '}' in line and 'to' in line:
-                list.append(line.split('to')[-1].replace('\n','').replace(' ','',1))
-        # print(list)
-        return list
+            operands = []
+            for a in call_args(call):
+                if isinstance(a, relay.TupleGetItem):
+                    a = a.tuple_value
+                operands.append(a if isinstance(a, relay.Call) else None)
+            applies.append((call, self.access_extents(call), operands))
+        ret_vars = func.body.fields if len(self.ret_data) > 1 else [func.body]
+        stores = []
+        for line, var in zip(self.ret_data, ret_vars):
+            if isinstance(var, relay.TupleGetItem):
+                var = var.tuple_value
+            stores.append((var,) + parse_bounds(line))
+        bounds = infer_bounds(applies, stores)
+        return [format_bounds(*bounds[call]) for call in self.call_sequence]
 
     def generate_codengen_streamlist(self,tmp_list,stream_solver,func):
         streamlist = []
@@ -958,6 +942,27 @@ class MLIRCodeGen:
 
         return streamlist
         
+    def feedback_swaps(self, func):
+        """``(output, input)`` variables swapped between host steps, see ``feedback``."""
+        if not self.feedback:
+            return []
+        fields = func.body.fields if isinstance(func.body, relay.Tuple) else [func.body]
+        swaps = []
+        for line, value in zip(self.ret_data, fields):
+            field = line.split()[3].split("(")[0]
+            arg = self.program.casts[field][0].lstrip("%")
+            if arg not in self.feedback:
+                continue
+            index = ""
+            if isinstance(value, relay.TupleGetItem):
+                index = f"_{value.index}"
+                value = value.tuple_value
+            name = self.variable2name[value]
+            name = self.fuse_name_map.get(name, name)
+            swaps.append(("func_" + name.replace('%', '') + index, self.feedback[arg]))
+        return swaps
+
+    @traced("host codegen")
     def maingen_v1(self, streamlist, mesh_size, halo_width):
         all_vars = {}
         origin_vars = self.ORIGIN_CALL_ARGS()
@@ -998,9 +1003,13 @@ class MLIRCodeGen:
         # print(all_vars)
         vars = {'all_variables':all_vars, 'in_variables': real_input_vars, 'mid_variables':mid_vars, 'out_variables':out_put_vars, 'useless_variables': origin_input_vars - real_input_vars}
         print(vars)
-        gen = GenMain(mesh_size, halo_width, vars, kernel_list, stream_str_list, self.output_on)
+        func = self.ir_module.functions[self.ir_module.get_global_var("main")]
+        gen = self.main_generator()(mesh_size, halo_width, vars, kernel_list, stream_str_list, self.output_on,
+                                    self.reuse_buffers, self.run_steps, self.feedback_swaps(func), dtype=self.dtype)
+        # 缓冲区数与显存占用随测量结果记录，见 codegen
+        self.memory = gen.memory_report()
         # gen.gen()
-        with open(f"{mesh_size}-{halo_width}-{self.mlir_name}-{self.step}.cu", 'w') as f:
+        with open(f"{mesh_size}-{halo_width}-{self.mlir_name}-{self.step}{self.main_suffix()}", 'w') as f:
             gen.gen(f)
 
         # for k in kernel_list:
@@ -1008,10 +1017,17 @@ class MLIRCodeGen:
 
     # 使用open-earth运行原有的mlir， 参数为是否inline
     def origin_mlir_run(self, inline = True):
+        with span("codegen", step="open-earth" if inline else "baseline", mesh_size=self.mesh_size, backend=self.backend):
+            return self._origin_mlir_run(inline)
+
+    def _origin_mlir_run(self, inline = True):
         def get_kernel_name():
             program_data = self.program_data[0]
             result = re.findall("func @(.*)\(", program_data)
             return result[0]
+        if self.backend == "llvm":
+            # CPU 上没有 open-earth 的整体编译，基线就是未融合的模块
+            return benchmark(self.ir_module, "llvm")
         mesh_size = self.mesh_size
         halo_width = self.halo_width
         all_vars = self.ORIGIN_CALL_ARGS()
@@ -1023,37 +1039,115 @@ class MLIRCodeGen:
         stream_str_list = [[]]
         stream_str_list[0].append(kernel_name)
         kernel_list = [Kernel(kernel_name, self.KERNEL_ARGS())]
-        gen = GenMain(mesh_size, halo_width, vars, kernel_list, stream_str_list, self.output_on)
+        swaps = list((self.feedback or {}).items())
+        gen = self.main_generator()(mesh_size, halo_width, vars, kernel_list, stream_str_list, self.output_on,
+                                    run_step=self.run_steps, swaps=swaps, dtype=self.dtype)
         # gen.gen()
         suffix = "baseline" if not inline else "open-earth"
         if self.mlir_name:
             suffix = self.mlir_name + "-" + suffix
-        with open(f"{mesh_size}-{halo_width}-{suffix}.cu", 'w') as f:
+        with open(f"{mesh_size}-{halo_width}-{suffix}{self.main_suffix()}", 'w') as f, span("host codegen"):
             gen.gen(f)
         CWD = os.getcwd()
         with open(kernel_name + f"_{suffix}.mlir", "w") as f:
             print("\n".join(self.in_code), file=f)
         mlir_list = [kernel_name + f"_{suffix}.mlir"]
-        evaluate = Evaluate(CWD, f"{mesh_size}-{halo_width}-{suffix}.cu", mlir_list,inline=inline)
+        output_dir = self.output_dir(f"{mesh_size}-{halo_width}-{suffix}")
+        evaluate = Evaluate(CWD, f"{mesh_size}-{halo_width}-{suffix}{self.main_suffix()}", mlir_list, inline=inline,
+                            target=self.main_target(), output_dir=output_dir,
+                            tile_sizes=self.tuned_tile_sizes(CWD, f"{mesh_size}-{halo_width}-{suffix}{self.main_suffix()}", mlir_list))
         performance = evaluate.evaluate()
+        self.timings = evaluate.timings
+        self.check_outputs(output_dir)
         return performance
 
 
 
+    def output_dir(self, name):
+        """Where the run ``name`` writes its outputs, None without file outputs."""
+        if not self.output_on or self.output_on == "text":
+            return None
+        return os.path.join(os.getcwd(), f"outputs-{name}")
+
+    def check_outputs(self, output_dir):
+        """Compare the outputs of the last run with the reference at this mesh size.
+
+        The first outputs at a mesh size become its reference unless one was
+        given; outputs that agree are removed again.
+        """
+        if output_dir is None:
+            return
+        reference = self.reference_outputs.get(self.mesh_size)
+        if reference is None:
+            self.reference_outputs[self.mesh_size] = output_dir
+            return
+        reports = compare_outputs(reference, output_dir)
+        self.timings["outputs"] = reports
+        mismatch = mismatched(reports)
+        if mismatch:
+            raise ValueError(f"{self.mlir_name} step {self.step}: outputs differ from {reference} in {mismatch}")
+        shutil.rmtree(output_dir)
+
+    def tuned_tile_sizes(self, cwd, main_name, mlir_list):
+        """Tile sizes of the kernels of a program from the tuning database.
+
+        With ``tune_tiles`` the kernels it doesn't know yet are tuned first,
+        otherwise they are lowered with the default tiling.
+        """
+        if self.tuning is None:
+            return {}
+        if self.tune_tiles:
+            untuned = []
+            for mlir in mlir_list:
+                with open(os.path.join(cwd, mlir), "r") as f:
+                    if self.tuning.get(f.read(), self.main_target()) is None:
+                        untuned.append(mlir[:-5])
+            if untuned:
+                TileTuner(runner_for(self.main_target()), self.tuning).tune(cwd, main_name, mlir_list, untuned)
+        return self.tuning.tile_sizes(cwd, mlir_list, self.main_target())
+
+    def main_generator(self):
+        return CpuGenMain if self.backend == "cpu" else GenMain
+
+    def main_target(self):
+        """The ``Evaluate`` target of the host program: "cpu" or "cuda"."""
+        return "cpu" if self.backend == "cpu" else "cuda"
+
+    def main_suffix(self):
+        return ".cpp" if self.backend == "cpu" else ".cu"
+
+    def codegen_llvm(self):
+        """Build the current module from the TE computes for the CPU and time it.
+
+        Every (fused) call is one kernel, run in ``call_sequence`` order.
+        """
+        start = time.time()
+        performance = benchmark(self.ir_module, "llvm")
+        self.timings = {"build_and_run": time.time() - start}
+        print(performance)
+        return performance, [list(self.call_sequence)]
+
     def codegen(self):
+        with span("codegen", step=self.step, mesh_size=self.mesh_size, backend=self.backend):
+            return self._codegen()
+
+    def _codegen(self):
         func = self.ir_module.functions[self.ir_module.get_global_var("main")] #ir_module:优化后返回的mod，从mod里把唯一一个func拿出来
         self.call_sequence = BuildGraph().get_call_list(func)
         self.reverse_variable_name(func)
         call2code = self.build_apply2code()
         self.replace_fuse_output_name()
+        if self.verify:
+            self.verify_fusion()
+        if self.backend == "llvm":
+            return self.codegen_llvm()
 
         ''' 代码生成参数 '''
         MESHSIZE = self.mesh_size
         HALO = self.halo_width #需要激进一点，mlir输入文件的halo也是
-        MLIR_PATH = "/tmp/"
         
-        ''' 体外shape inference '''
-        list = self.shape_infer(func,MLIR_PATH) #输入fusion后的code，进行shape inference，得到每个call一个shape
+        ''' shape inference '''
+        list = self.shape_infer(func) #输入fusion后的code，进行shape inference，得到每个call一个shape
         print(list)
         call_shape_infer = {}
         for i in range(0, len(self.call_sequence)):
@@ -1069,10 +1163,14 @@ class MLIRCodeGen:
         # print("}\n}")
 
         ''' stream策略处理 '''
-        stream_solver = StreamSolver()
-        tmp_list = stream_solver.solve(func)
-        #创建代码生成需要的streamlist
-        streamlist = self.generate_codengen_streamlist(tmp_list,stream_solver,func)
+        with span("stream solve", max_streams=self.max_streams):
+            stream_solver = StreamSolver()
+            if self.max_streams:
+                streamlist = stream_solver.list_schedule(func, self.kernel_time, self.max_streams)
+            else:
+                tmp_list = stream_solver.solve(func)
+                #创建代码生成需要的streamlist
+                streamlist = self.generate_codengen_streamlist(tmp_list,stream_solver,func)
         
         # for stream in streamlist:
         #     print(stream)
@@ -1098,7 +1196,7 @@ class MLIRCodeGen:
                 if isinstance(ele, tvm.relay.expr.Call):
                     mlir_list.append(GET_CALL_TAG(ele) + ".mlir")
                     with open(GET_CALL_TAG(ele) + ".mlir", "w") as f:
-                        self.PRINT_CALL_MLIR(ele, MESHSIZE, HALO, MLIR_PATH, call_shape_infer, file=f)
+                        self.PRINT_CALL_MLIR(ele, MESHSIZE, HALO, call_shape_infer, file=f)
                 else:
                     print('***************'+ele+'***************')
 
@@ -1107,8 +1205,14 @@ class MLIRCodeGen:
         # print(CWD)
 
 
-        evaluate = Evaluate(CWD, f"{MESHSIZE}-{HALO}-{self.mlir_name}-{self.step}.cu", mlir_list)
+        output_dir = self.output_dir(f"{MESHSIZE}-{HALO}-{self.mlir_name}-{self.step}")
+        main_name = f"{MESHSIZE}-{HALO}-{self.mlir_name}-{self.step}{self.main_suffix()}"
+        evaluate = Evaluate(CWD, main_name, mlir_list, target=self.main_target(), output_dir=output_dir,
+                            tile_sizes=self.tuned_tile_sizes(CWD, main_name, mlir_list))
         performance = evaluate.evaluate()
+        self.timings = evaluate.timings
+        self.timings["memory"] = self.memory
+        self.check_outputs(output_dir)
         return performance, streamlist
 
 
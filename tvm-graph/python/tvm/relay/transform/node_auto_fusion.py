@@ -7,17 +7,27 @@ import tvm
 from tvm import relay
 from tvm.ir.module import IRModule
 from tvm.relay.transform.transform import InferType
-from tvm.relay.transform.utils import ReplaceParams, BuildGraph
+from tvm.relay.transform.utils import ReplaceParams, BuildGraph, call_args, is_scalar
+from tvm.relay.transform.fusion_graph import FusionGraph, FusionNode
+from tvm.relay.transform.fusion_search import BeamSearch, SearchState
 from tvm.relay.transform.dnn_fusion import GroupOp
+from tvm.relay.transform.run import CompileError
+from tvm.relay.transform.timing import faster
+from tvm.relay.transform.cost_model import FusionScore, RecomputeBudget
+from tvm.relay.transform.tracing import span, traced
 import copy
 
+def infer_type(mod):
+    with span("InferType"):
+        return InferType()(mod)
+
 def build_depence(call_list):
     graph = {}
     # init
     for call in call_list:
         graph[call] = {"input": set(), "output": set()}
     for call in call_list:
-        for arg in call.args:
+        for arg in call_args(call):
             if isinstance(arg, relay.Call):
                 graph[call]["input"].add(arg)
                 graph[arg]["output"].add(call)
@@ -25,108 +35,134 @@ def build_depence(call_list):
                 graph[call]["input"].add(arg.tuple_value)
                 graph[arg.tuple_value]["output"].add(call)
 
-    def find_father(node):
-        father = list(graph[node]["input"])
-        indirect_node = []
-        for f in father:
-            indirect_node += find_father(f)
-        return father + indirect_node
-    
-    def find_child(node):
-        child = list(graph[node]["output"])
-        indirect_node = []
-        for c in child:
-            indirect_node += find_child(c)
-        return child + indirect_node
-    
+    # 共享的祖先/后代只遍历一次
+    def closure(node, direction, memo):
+        if node not in memo:
+            nodes = {}
+            for n in graph[node][direction]:
+                nodes[n] = None
+                for m in closure(n, direction, memo):
+                    nodes[m] = None
+            memo[node] = list(nodes)
+        return memo[node]
+
+    fathers, children = {}, {}
     depence_graph = {}
     for node in graph.keys():
-        depence_graph[node] = {"input": find_father(node), "output": find_child(node)}
+        depence_graph[node] = {
+            "input": closure(node, "input", fathers),
+            "output": closure(node, "output", children),
+        }
     return depence_graph
 
 
+def call_key(call):
+    """The tags of the stencils computed by a (fused) stencil call."""
+    if call.attrs and hasattr(call.attrs, "tag"):
+        return frozenset([call.attrs.tag.replace("stencil_", "")])
+    return frozenset(call.op.attrs["tag"].replace("fuse_", "").split("_"))
+
+
+def value_key(expr):
+    """Name a tensor independently of how fusion rewrote the graph around it."""
+    if isinstance(expr, relay.Var):
+        return ("var", expr.name_hint)
+    if isinstance(expr, relay.TupleGetItem):
+        value = expr.tuple_value
+        if isinstance(value, relay.Call) and isinstance(value.op, relay.Function):
+            return value_key(value.op.body.fields[expr.index])
+        return ("stencil", value.attrs.tag.replace("stencil_", ""), expr.index)
+    if isinstance(expr, relay.Call):
+        if isinstance(expr.op, relay.Function):
+            return value_key(expr.op.body)
+        return ("stencil", expr.attrs.tag.replace("stencil_", ""), None)
+    return ("const", expr)
+
+
+def call_tag(call):
+    if call.attrs and hasattr(call.attrs, "tag"):
+        return call.attrs.tag
+    return call.op.attrs["tag"]
+
+
+def streamlist_tags(streamlist):
+    """The stream list with kernel tags in place of the calls, on one line."""
+    return [[e if isinstance(e, str) else call_tag(e) for e in stream] for stream in streamlist]
+
+
+def plan_groups(fusion_graph, pair=None):
+    """The kernels of the current plan, or of the plan after fusing ``pair``."""
+    nodes = fusion_graph.alive_nodes()
+    groups = [node.key for node in nodes]
+    if pair is not None:
+        a, b = pair[0], pair[1]
+        groups = [key for key in groups if key not in (a.key, b.key)] + [a.key | b.key]
+    return [{"%" + tag for tag in key} for key in groups]
+
+
 class NodeAutoFusion:
-    def __init__(self, mod) -> None:
+    def __init__(self, mod, num_candidates=8, beam_width=1, lookahead=0, budget=None, max_steps=30, scoring="model", score_weights=None, registers=32,
+                 recompute_budget=None, max_body_ops=None) -> None:
         self.step_mod = mod
+        self.origin_mod = mod
         self.fuse_steps = 0
+        # 有代价模型时每步评估的候选对数目
+        self.num_candidates = num_candidates
+        # beam_width > 1 或 lookahead > 0 时用 BeamSearch 代替贪心搜索
+        self.beam_width = beam_width
+        self.lookahead = lookahead
+        self.budget = budget
+        self.max_steps = max_steps
+        # "model": FusionScore 估计融合节省的时间；"count": 共享输入与传递结果的元素数
+        self.scoring = scoring
+        self.score_weights = score_weights
+        self.registers = registers
+        # 融合后每个点多算的 flops / 融合体的指令数超过上限时不融合，生产者单独成为 kernel
+        self.recompute_budget = recompute_budget
+        self.max_body_ops = max_body_ops
+        # 搜索得到的方案 (step, merges, groups)，换网格大小时由 evaluate_plans 重新评估
+        self.plans = []
+        self.plan_funcs = {}
 
     def get_call_list(self, mod):
         func = mod.functions[mod.get_global_var("main")]
         return BuildGraph().get_call_list(func)
 
-    def analysis_exclusion(self, call_list):
-        exclusion = set()
-        depend_graph = build_depence(call_list)
+    def build_fusion_graph(self, call_list, generator):
+        nodes = []
         for call in call_list:
-            exclusion.add((call, call))
-            for parent in depend_graph[call]["input"]:
-                for child in depend_graph[call]["output"]:
-                    exclusion.add((parent, child))
-                    exclusion.add((child, parent))
-        return exclusion
-
-    def calculate_score(self, call, call_list, exclusion):
-        score = {}
-        # get call args set
-        call_args = set(call.args)
-        p_input = 1
-        p_stencil = 2
-
-        for other in call_list:
-            if (call, other) in exclusion:
-                score[other] = -1
-                continue
-            other_args = set(other.args)
-            inter_set = set()
-            input_set = set()
-            stencil_set=set()
-
-            # input 复用
-            input_set = inter_set.union(call_args & other_args)
-
-            # 结果复用
-            if call in other_args:
-                stencil_set.add(call)
-            elif other in call_args:
-                stencil_set.add(other)
-            else:
-                # TupleGetItem
-                for arg in call_args:
-                    if isinstance(arg, relay.TupleGetItem) and arg.tuple_value is other:
-                        stencil_set.add(arg)
-                for arg in other_args:
-                    if isinstance(arg, relay.TupleGetItem) and arg.tuple_value is call:
-                        stencil_set.add(arg)
-            
-            score_value = 0
-
-            # 计算 score
-            if input_set:
-                for tensor in input_set:
-                    shape = tensor.checked_type.concrete_shape
-                    score_value += functools.reduce(lambda x, y: x * y, shape)*p_input
-            if stencil_set:
-                for tensor in stencil_set:
-                    shape = tensor.checked_type.concrete_shape
-                    score_value += functools.reduce(lambda x, y: x * y, shape)*p_stencil
-            
-            score[other] = score_value
-
-        return score
-
-    def find_fuse_pair(self, score_dict, call_list):
-        max_score = -1
-        fuse_pair = (None, None)
-        for call1 in call_list:
-            for call2 in call_list:
-                if score_dict[call1][call2] > max_score:
-                    max_score = score_dict[call1][call2]
-                    fuse_pair = (call1, call2)
-        return fuse_pair,max_score
+            inputs = {}
+            for arg in call_args(call):
+                if is_scalar(arg):
+                    continue
+                shape = arg.checked_type.concrete_shape
+                inputs[value_key(arg)] = functools.reduce(lambda x, y: x * y, shape, 1)
+            # scf.if 在解析时已转换为 select，条件 stencil 同样可以融合
+            nodes.append(FusionNode(call_key(call), inputs))
+        scorer = None
+        if self.scoring == "model":
+            scorer = FusionScore(generator.program, generator.mesh_size, generator.scoring_model,
+                                 self.score_weights, self.registers)
+        admissible = None
+        if self.recompute_budget is not None or self.max_body_ops is not None:
+            admissible = RecomputeBudget(generator.program, generator.mesh_size, generator.scoring_model,
+                                         self.recompute_budget, self.max_body_ops)
+        return FusionGraph(nodes, scorer=scorer, admissible=admissible)
 
     def stop_fused(self):
-        return self.fuse_steps >= 30
+        return self.max_steps is not None and self.fuse_steps >= self.max_steps
+
+    def materialize(self, mod, merges):
+        """Replay the fusions ``merges`` (pairs of call keys) on a copy of ``mod``."""
+        mod = infer_type(IRModule.from_expr(mod["main"]))
+        for key1, key2 in merges:
+            call_list = self.get_call_list(mod)
+            key2call = {call_key(call): call for call in call_list}
+            fuse_pair = sorted([key2call[key1], key2call[key2]], key=call_list.index)
+            mod = self.fusion_call2call(fuse_pair, mod, call_list)
+        return mod
 
+    @traced("fusion_call2call")
     def fusion_call2call(self, fuse_pair, mod: IRModule, call_list):
         call1, call2 = fuse_pair
         # 获取整个复杂 stencil 的返回值
@@ -138,8 +174,8 @@ class NodeAutoFusion:
             ret_calls = [ret_calls]
         # 获取参数
         def get_args(call_expr):
-            call_args = {}
-            for arg in call_expr.args:
+            used_args = {}
+            for arg in call_args(call_expr):
                 if isinstance(arg, relay.TupleGetItem):
                     node = arg.tuple_value
                     used_expr = arg
@@ -148,10 +184,10 @@ class NodeAutoFusion:
                     used_expr = arg
                 else:
                     continue
-                if node not in call_args:
-                    call_args[node] = set()
-                call_args[node].add(used_expr)
-            return call_args
+                if node not in used_args:
+                    used_args[node] = set()
+                used_args[node].add(used_expr)
+            return used_args
         call1_args = get_args(call1)
         call2_args = get_args(call2)
         other_args = {}
@@ -219,10 +255,40 @@ class NodeAutoFusion:
                     offset += len(out.checked_type.fields)
         fuse_expr = ReplaceParams(relay_call_map).visit(expr)
         mod.update_func(mod.get_global_var("main"), fuse_expr)
-        mod = InferType()(mod)
+        mod = infer_type(mod)
 
         return mod
 
+    def reporters(self, generator):
+        """``record``, ``print_performance`` and ``print_compile_error`` of the measurements.
+
+        Results go to performance.txt in the working directory and, as
+        structured rows, to ``generator.recorder``.
+        """
+        performance_result_path = os.path.join(os.getcwd(), "performance.txt")
+        def record(step, **fields):
+            # 结构化结果另外交给 generator.recorder，performance.txt 照常写
+            if generator.recorder is not None:
+                generator.recorder(str(step), **fields)
+
+        def print_performance(performance, streamlist, step):
+            with open(performance_result_path, "a") as f:
+                print(f"step = {step}", file=f)
+                print(streamlist_tags(streamlist), file=f)
+                print(f'performance={performance}',file=f)
+                print("--------------------------------------",file=f)
+            record(step, performance=performance, streamlist=streamlist_tags(streamlist), timings=generator.timings)
+
+        def print_compile_error(err, step):
+            print(err)
+            with open(performance_result_path, "a") as f:
+                print(f"step = {step}", file=f)
+                print(f"compile_error={err}", file=f)
+                print("--------------------------------------",file=f)
+            record(step, error=str(err))
+
+        return record, print_performance, print_compile_error
+
     def fuse(self,generator):
         mesh_size = generator.mesh_size
         halo_width = generator.halo_width
@@ -233,12 +299,7 @@ class NodeAutoFusion:
         # performance_result_path = f"performance{get_time()}.txt"
         performance_result_path = f"performance.txt"
         CWD = os.getcwd()
-        def print_performance(performance, streamlist, step):
-            with open(os.path.join(CWD, performance_result_path), "a") as f:
-                print(f"step = {step}", file=f)
-                print(streamlist, file=f)
-                print(f'performance={performance}',file=f)
-                print("--------------------------------------",file=f)
+        record, print_performance, print_compile_error = self.reporters(generator)
 
         #first, run gen All split kernel
         with open(os.path.join(CWD, performance_result_path), "a") as f:
@@ -258,12 +319,14 @@ class NodeAutoFusion:
                         print("step = open-earth", file=f)
                         print(f'performance={performance}',file=f)
                         print("--------------------------------------",file=f)
+                    record("open-earth", performance=performance, timings=generator.timings)
                 else:
                     performance = generator.origin_mlir_run(inline=False)
                     with open(os.path.join(CWD, performance_result_path), "a") as f:
                         print("step = baseline", file=f)
                         print(f'performance={performance}',file=f)
                         print("--------------------------------------",file=f)
+                    record("baseline", performance=performance, timings=generator.timings)
             
             # STREAM为真, 但是不进行FUSION， 即最大化并行
             if generator.STREAM == True:
@@ -273,68 +336,215 @@ class NodeAutoFusion:
             return self.step_mod
         # if generator.FUSION:
         # 能到这里说明FUSION为True
+        if self.beam_width > 1 or self.lookahead > 0:
+            return self.beam_fuse(generator, print_performance, print_compile_error)
+        cost_model = generator.cost_model
+        program = generator.program
+        fusion_graph = None
+        plans = []
+        merges = []
         while True:
             starttime = time.time()
             self.fuse_steps += 1
-            score_dict = {}
             call_list = self.get_call_list(self.step_mod)
-            exclusions = self.analysis_exclusion(call_list)
-            for call in call_list:
-                if hasattr(call, "attrs") and call.attrs:
-                    tag = call.attrs.tag
+            with span("scoring", step=self.fuse_steps):
+                if fusion_graph is None:
+                    fusion_graph = self.build_fusion_graph(call_list, generator)
+                # 取出分数最大的合法节点对；有代价模型时在前几个候选里选预测最快的
+                if cost_model is None:
+                    best = fusion_graph.pop_best()
                 else:
-                    tag = None
-                if tag:
-                    tag = tag.replace("stencil_", "%")
-                    # import pdb; pdb.set_trace()
-                    body = generator.tag2code[tag]["mlir_body"][:]
-                    has_if = False
-                    for line in body:
-                        if "if" in line:
-                            has_if = True
-                            break
-                else:
-                    continue
-                if has_if:
-                    for other in call_list:
-                        exclusions.add((call, other))
-                        exclusions.add((other, call))
-
-            # 更新每个节点call对所有节点的分数，填到score[call]里
-            for call in call_list:
-                score_dict[call] = self.calculate_score(call, call_list, exclusions)
-            # 找到最大的分数，把这两个call融合
-            fuse_pair,max_score = self.find_fuse_pair(score_dict, call_list)
-            # print(step)
-            print(call_list)
-            print(fuse_pair)
-            if max_score<0:
+                    candidates = fusion_graph.candidates(self.num_candidates)
+            if cost_model is not None:
+                best = min(
+                    candidates,
+                    key=lambda c: cost_model.predict(program, plan_groups(fusion_graph, c), mesh_size),
+                    default=None,
+                )
+            # 按模型打分时，预计不再节省时间的融合不做
+            if best is None or (fusion_graph.scorer is not None and best[2] <= 0):
                 break
+            node1, node2, max_score = best
+            key2call = {call_key(call): call for call in call_list}
+            fuse_pair = sorted([key2call[node1.key], key2call[node2.key]], key=call_list.index)
+            breakdown = fusion_graph.explain(node1, node2)
+            print(node1, node2, f"score = {max_score}", breakdown)
+            with open(os.path.join(CWD, performance_result_path), "a") as f:
+                print(f"fuse = {node1} {node2}; score = {breakdown}", file=f)
 
             # fuse, 更新step_mod
-            # try:
-            # if self.fuse_steps >= 5:
-            #     import pdb; pdb.set_trace()
+            merges.append((node1.key, node2.key))
             self.step_mod = self.fusion_call2call(fuse_pair, self.step_mod, call_list)
-            # except:
-            #     break
+            with span("scoring", step=self.fuse_steps):
+                fusion_graph.merge(node1, node2)
+            self.plans.append((self.fuse_steps, list(merges), plan_groups(fusion_graph)))
+            self.plan_funcs[self.fuse_steps] = self.step_mod["main"]
+            if cost_model is not None:
+                # 只记录预测值，搜索结束后实测预测最快的几个方案
+                predicted = cost_model.predict(program, plan_groups(fusion_graph), mesh_size)
+                plans.append((predicted, self.fuse_steps, self.step_mod["main"]))
+                print(f"StencilG-step-{self.fuse_steps} predicted = {predicted}")
+                with open(os.path.join(CWD, performance_result_path), "a") as f:
+                    print(f"step = {self.fuse_steps}", file=f)
+                    print(f"predicted={predicted}", file=f)
+                    print("--------------------------------------", file=f)
+                record(self.fuse_steps, predicted=predicted)
+                if self.stop_fused():
+                    break
+                continue
             # 往后的流程
             generator.step = f'StencilG-step-{self.fuse_steps}'
             generator.ir_module = self.step_mod
 
-
-            #
-            # if self.fuse_steps<8:
-            #     continue
             profile_start = time.time()
             print(generator.step)
-            performance, streamlist = generator.codegen()
+            try:
+                performance, streamlist = generator.codegen()
+            except CompileError as err:
+                # 编译失败的候选只跳过测量，搜索继续
+                print_compile_error(err, self.fuse_steps)
+            else:
+                print_performance(performance, streamlist, self.fuse_steps)
             profile_end = time.time()
             print('search_time = ', profile_start - starttime, 's')
             print('profile_time = ', profile_end - profile_start,'s')
-            print_performance(performance, streamlist, self.fuse_steps)
-            # performance = 0
 
             if self.stop_fused():
                 break
-        return self.step_mod
\ No newline at end of file
+        if plans:
+            self.step_mod = self.measure_plans(generator, plans, print_performance, print_compile_error)
+        return self.step_mod
+
+    def beam_fuse(self, generator, print_performance, print_compile_error):
+        """Search fusion plans with ``BeamSearch`` and return the best module.
+
+        Plans are ranked by the cost model when the generator has one (the
+        ``measure_top`` best predictions are measured at the end), otherwise
+        every plan is built and measured.
+        """
+        cost_model = generator.cost_model
+        program = generator.program
+        origin_mod = self.step_mod
+        performance_result_path = os.path.join(os.getcwd(), "performance.txt")
+
+        def evaluate(state):
+            groups = [{"%" + tag for tag in group} for group in state.groups]
+            if cost_model is not None:
+                predicted = cost_model.predict(program, groups, generator.mesh_size)
+                print(f"StencilG-beam-{state.hash} predicted = {predicted}")
+                return predicted
+            generator.step = f"StencilG-beam-{state.hash}"
+            generator.ir_module = self.materialize(origin_mod, state.merges)
+            print(generator.step)
+            try:
+                performance, streamlist = generator.codegen()
+            except CompileError as err:
+                print_compile_error(err, f"beam-{state.hash}")
+                return float("inf")
+            print_performance(performance, streamlist, f"beam-{state.hash}")
+            return performance
+
+        search = BeamSearch(
+            evaluate,
+            beam_width=self.beam_width,
+            lookahead=self.lookahead,
+            branching=self.num_candidates,
+            budget=self.budget,
+            max_steps=self.max_steps,
+        )
+        root = SearchState(self.build_fusion_graph(self.get_call_list(origin_mod), generator))
+        _, best = search.run(root)
+        self.fuse_steps = len(best.merges)
+        self.step_mod = self.materialize(origin_mod, best.merges)
+        report = search.report()
+        # 没有代价模型时其他网格大小只实测这里最快的 measure_top 个方案
+        for _, state in search.ranked(None if cost_model is not None else generator.measure_top):
+            groups = [{"%" + tag for tag in group} for group in state.groups]
+            self.plans.append((f"beam-{state.hash}", state.merges, groups))
+        if cost_model is not None:
+            plans = []
+            for predicted, state in search.ranked(generator.measure_top):
+                func = self.materialize(origin_mod, state.merges)["main"]
+                plans.append((predicted, f"beam-{state.hash}", func))
+            self.step_mod = self.measure_plans(generator, plans, print_performance, print_compile_error)
+        print("best plan:", report)
+        with open(performance_result_path, "a") as f:
+            print(f"best_plan = {report['plan']}", file=f)
+            print(report["groups"], file=f)
+            print(f"cost={report['cost']}", file=f)
+            print(f"evaluations={report['evaluations']}; memo_hits={report['memo_hits']}", file=f)
+            print("--------------------------------------", file=f)
+        return self.step_mod
+
+    def measure_plans(self, generator, plans, print_performance, print_compile_error):
+        """Run the ``measure_top`` plans the cost model predicts to be fastest."""
+        plans = sorted(plans, key=lambda plan: plan[0])
+        best_mod = infer_type(IRModule.from_expr(plans[0][2]))
+        best_performance = None
+        for predicted, step, func in sorted(plans[:generator.measure_top], key=lambda plan: plan[1]):
+            generator.step = f'StencilG-step-{step}'
+            generator.ir_module = infer_type(IRModule.from_expr(func))
+            print(generator.step, f"predicted = {predicted}")
+            try:
+                performance, streamlist = generator.codegen()
+            except CompileError as err:
+                print_compile_error(err, step)
+                continue
+            print_performance(performance, streamlist, step)
+            # 置信区间重叠的方案视为一样快，保留先测的
+            if faster(performance, best_performance):
+                best_performance = performance
+                best_mod = generator.ir_module
+        return best_mod
+
+    def evaluate_plans(self, generator, mod=None):
+        """Evaluate the plans of an earlier ``fuse`` at the generator's mesh size.
+
+        Fusion legality doesn't depend on the mesh size, so the search is not
+        run again: with a cost model its plans are re-ranked by the predictions
+        at this size and the ``measure_top`` best measured, otherwise all of
+        them are measured. The modules of the search are reused unless ``mod``,
+        the unfused module rebuilt for this size, is given; then the fusions of
+        every plan are replayed on it.
+        """
+        record, print_performance, print_compile_error = self.reporters(generator)
+        with open(os.path.join(os.getcwd(), "performance.txt"), "a") as f:
+            print(f'mesh_size = {generator.mesh_size}; halo_width = {generator.halo_width}', file=f)
+            print("--------------------------------------",file=f)
+        if not self.plans:
+            return mod if mod is not None else self.origin_mod
+
+        def plan_func(step, merges):
+            if mod is not None:
+                return self.materialize(mod, merges)["main"]
+            if step not in self.plan_funcs:
+                self.plan_funcs[step] = self.materialize(self.origin_mod, merges)["main"]
+            return self.plan_funcs[step]
+
+        cost_model = generator.cost_model
+        if cost_model is not None:
+            ranked = []
+            for step, merges, groups in self.plans:
+                predicted = cost_model.predict(generator.program, groups, generator.mesh_size)
+                record(step, predicted=predicted)
+                ranked.append((predicted, step, merges))
+            ranked.sort(key=lambda plan: plan[0])
+            plans = [(predicted, step, plan_func(step, merges)) for predicted, step, merges in ranked[:generator.measure_top]]
+            return self.measure_plans(generator, plans, print_performance, print_compile_error)
+
+        best_mod = None
+        best_performance = None
+        for step, merges, _ in self.plans:
+            generator.step = f'StencilG-step-{step}'
+            generator.ir_module = infer_type(IRModule.from_expr(plan_func(step, merges)))
+            print(generator.step)
+            try:
+                performance, streamlist = generator.codegen()
+            except CompileError as err:
+                print_compile_error(err, step)
+                continue
+            print_performance(performance, streamlist, step)
+            if faster(performance, best_performance):
+                best_performance = performance
+                best_mod = generator.ir_module
+        return best_mod if best_mod is not None else generator.ir_module
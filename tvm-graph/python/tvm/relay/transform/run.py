@@ -8,69 +8,234 @@ import argparse
 import time
 
 import shutil
+import hashlib
+import tempfile
+import functools
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+from tvm.relay.transform.timing import Timing, read_samples, WARMUP, REPEATS, MAX_REPEATS, REL_CI
+from tvm.relay.transform.tracing import TRACER, span, call_collected
+
+
+PIPELINE = "oec-opt --canonicalize --stencil-shape-inference --stencil-storage-materialization --stencil-shape-inference --stencil-combine-to-ifelse --cse \
+    --canonicalize --convert-stencil-to-std --cse --parallel-loop-tiling=parallel-loop-tile-sizes=128,1,1 \
+    --canonicalize --test-gpu-greedy-parallel-loop-mapping --convert-parallel-loops-to-gpu --lower-affine \
+    --convert-scf-to-std --gpu-kernel-outlining --cse \
+    --canonicalize --stencil-kernel-to-cubin --cse --canonicalize --mlir-disable-threading"
+
+INLINE_PIPELINE = "oec-opt --canonicalize --stencil-inlining --cse --canonicalize --stencil-shape-inference --stencil-storage-materialization --stencil-shape-inference --stencil-combine-to-ifelse --cse \
+    --canonicalize --convert-stencil-to-std --cse --parallel-loop-tiling=parallel-loop-tile-sizes=128,1,1 \
+    --canonicalize --test-gpu-greedy-parallel-loop-mapping --convert-parallel-loops-to-gpu --lower-affine \
+    --convert-scf-to-std --gpu-kernel-outlining --cse \
+    --canonicalize --stencil-kernel-to-cubin --cse --canonicalize --mlir-disable-threading"
+
+# CPU 上运行：不做 GPU 映射，循环直接降到 LLVM，导出 _mlir_ciface_ 包装
+CPU_PIPELINE = "oec-opt --canonicalize --stencil-shape-inference --stencil-storage-materialization --stencil-shape-inference --stencil-combine-to-ifelse --cse \
+    --canonicalize --convert-stencil-to-std --cse --canonicalize --lower-affine --convert-scf-to-std \
+    --convert-std-to-llvm=emit-c-wrappers=1 --cse --canonicalize --mlir-disable-threading"
+
+CPU_INLINE_PIPELINE = "oec-opt --canonicalize --stencil-inlining --cse --canonicalize --stencil-shape-inference --stencil-storage-materialization --stencil-shape-inference --stencil-combine-to-ifelse --cse \
+    --canonicalize --convert-stencil-to-std --cse --canonicalize --lower-affine --convert-scf-to-std \
+    --convert-std-to-llvm=emit-c-wrappers=1 --cse --canonicalize --mlir-disable-threading"
+
+# GPU 流水线的默认分块；按 kernel 调优过的分块见 tile_tuner
+DEFAULT_TILE_SIZES = (128, 1, 1)
+TILING = "--parallel-loop-tiling=parallel-loop-tile-sizes="
+
+TRANSLATE = "mlir-translate --mlir-to-llvmir"
+LLC = "llc -O3"
+CLANG = "clang -c -fPIE"
+CPU_LINK = "clang++ -O3 -std=c++17 -pthread"
+
+# 编译缓存目录与并行度，可用环境变量覆盖
+CACHE_DIR = os.environ.get("STENCIL_COMPILE_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "stencil-compile"))
+COMPILE_JOBS = int(os.environ.get("STENCIL_COMPILE_JOBS", min(8, os.cpu_count() or 1)))
+
+
+class CompileError(RuntimeError):
+    """Building a candidate failed; the search can skip it and go on."""
+
+    def __init__(self, stage, name, returncode=None):
+        super().__init__(f"{stage} failed for {name} (exit code {returncode})")
+        self.stage = stage
+        self.name = name
+        self.returncode = returncode
+
+    def __reduce__(self):
+        return (CompileError, (self.stage, self.name, self.returncode))
+
+
+@functools.lru_cache(maxsize=None)
+def tool_version(tool):
+    try:
+        out = subprocess.run([tool, "--version"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=60)
+        return out.stdout.decode(errors="replace").strip()
+    except (OSError, subprocess.SubprocessError):
+        return "unknown"
+
+
+def normalize_mlir(code):
+    """Drop comments, blank lines and indentation that don't change the kernel."""
+    lines = []
+    for line in code.splitlines():
+        line = line.split("//")[0].strip()
+        if line:
+            lines.append(" ".join(line.split()))
+    return "\n".join(lines)
+
+
+def pipeline(inline, target="cuda", tile_sizes=None):
+    """The oec-opt lowering of a kernel for ``target`` ("cuda" or "cpu").
+
+    ``tile_sizes`` replaces the tiling of the parallel loops, 128x1x1 blocks
+    on the GPU; on the CPU the loops are only tiled when it is given.
+    """
+    if target == "cpu":
+        cmd = CPU_INLINE_PIPELINE if inline else CPU_PIPELINE
+        if tile_sizes is not None:
+            cmd = cmd.replace("--convert-stencil-to-std --cse", "--convert-stencil-to-std --cse " + tiling(tile_sizes), 1)
+        return cmd
+    cmd = INLINE_PIPELINE if inline else PIPELINE
+    if tile_sizes is not None:
+        cmd = cmd.replace(tiling(DEFAULT_TILE_SIZES), tiling(tile_sizes))
+    return cmd
+
+
+def tiling(tile_sizes):
+    return TILING + ",".join(str(size) for size in tile_sizes)
+
+
+def cache_key(code, inline, target="cuda", tile_sizes=None):
+    h = hashlib.sha256()
+    h.update(normalize_mlir(code).encode())
+    h.update(pipeline(inline, target, tile_sizes).encode())
+    for cmd in (TRANSLATE, LLC, CLANG):
+        h.update(cmd.encode())
+    for tool in ("oec-opt", "mlir-translate", "llc", "clang"):
+        h.update(tool_version(tool).encode())
+    return h.hexdigest()
+
+
+def cached_object(key):
+    return os.path.join(CACHE_DIR, key[:2], key + ".o")
+
+
+def compile_object(cwd, bench_name, inline, key=None, target="cuda", tile_sizes=None):
+    """Lower ``bench_name.mlir`` to ``bench_name.o``, reusing the cache when possible.
+
+    Runs in a worker process of ``Evaluate.compile_all``.
+    """
+    origin_mlir_path = os.path.join(cwd, bench_name + ".mlir")
+    object_path = os.path.join(cwd, bench_name + ".o")
+    if key is None:
+        with open(origin_mlir_path, "r") as f:
+            key = cache_key(f.read(), inline, target, tile_sizes)
+    cached = cached_object(key)
+    if os.path.exists(cached):
+        print(f"Compiling MLIR...{bench_name} (cached)")
+        with span("compile", kernel=bench_name, cached=True):
+            shutil.copy(cached, object_path)
+        return object_path
+    with span("compile", kernel=bench_name, cached=False, tile_sizes=tile_sizes):
+        return _compile_object(cwd, bench_name, inline, target, tile_sizes, origin_mlir_path, object_path, cached)
+
+
+def _compile_object(cwd, bench_name, inline, target, tile_sizes, origin_mlir_path, object_path, cached):
+    """The compiler subprocesses of a cache miss of ``compile_object``."""
+    print(f"Compiling MLIR...{bench_name}")
+    with tempfile.TemporaryDirectory(dir=cwd) as tmp:
+        lowered_mlir_path = os.path.join(tmp, bench_name + "_lowered.mlir")
+        bc_path = os.path.join(tmp, bench_name + ".bc")
+        assembly_path = os.path.join(tmp, bench_name + ".s")
+        tmp_object_path = os.path.join(tmp, bench_name + ".o")
+        cmd = pipeline(inline, target, tile_sizes) + " " + origin_mlir_path
+        with open(lowered_mlir_path, "w") as f, span("oec-opt", kernel=bench_name):
+            ret = subprocess.call(cmd.split(), cwd=cwd, stdout=f)
+        if ret != 0:
+            raise CompileError("lowering", bench_name, ret)
+        with open(bc_path, "w") as f, span("mlir-translate", kernel=bench_name):
+            ret = subprocess.call((TRANSLATE + " " + lowered_mlir_path).split(), cwd=cwd, stdout=f)
+        if ret != 0:
+            raise CompileError("translation", bench_name, ret)
+        with span("llc", kernel=bench_name):
+            ret = subprocess.call((LLC + " " + bc_path + " -o " + assembly_path).split(), cwd=cwd)
+        if ret != 0:
+            raise CompileError("llc", bench_name, ret)
+        with span("clang", kernel=bench_name):
+            ret = subprocess.call((CLANG + " " + assembly_path + " -o " + tmp_object_path).split(), cwd=cwd)
+        if ret != 0:
+            raise CompileError("clang", bench_name, ret)
+        # 先写临时文件再改名，并发写同一个 key 也不会读到半个文件
+        os.makedirs(os.path.dirname(cached), exist_ok=True)
+        fd, tmp_cached = tempfile.mkstemp(dir=os.path.dirname(cached), suffix=".o")
+        os.close(fd)
+        shutil.copy(tmp_object_path, tmp_cached)
+        os.replace(tmp_cached, cached)
+        shutil.copy(tmp_object_path, object_path)
+    return object_path
 
 # self.cwd = os.path.realpath(os.path.dirname(__file__))
 class Evaluate:
-    def __init__(self, cwd, main_name, mlir_list, inline=False):
+    def __init__(self, cwd, main_name, mlir_list, inline=False, jobs=COMPILE_JOBS, target="cuda",
+                 warmup=WARMUP, repeats=REPEATS, max_repeats=MAX_REPEATS, rel_ci=REL_CI, output_dir=None, tile_sizes=None):
         self.cwd = cwd
         
         self.object_paths = []
         self.main_name = main_name
         self.mlir_list = mlir_list
         self.clean_path = []
-        assert main_name.endswith('.cu')
-        self.execuable = f'{main_name[:-3]}'
+        # "cuda": .cu 主程序由 nvcc 链接；"cpu": CpuGenMain 生成的 .cpp 主程序
+        self.target = target
+        assert main_name.endswith('.cpp' if target == "cpu" else '.cu')
+        self.execuable = os.path.splitext(main_name)[0]
         self.inline = inline
+        self.jobs = jobs
+        self.timings = {}
+        # 每批预热 warmup 次、计时 repeats 次，直到中位数的置信区间相对半宽不超过 rel_ci 或样本数到 max_repeats
+        self.warmup = warmup
+        self.repeats = repeats
+        self.max_repeats = max(max_repeats, repeats)
+        self.rel_ci = rel_ci
+        self.measurement = None
+        # 给定时计时之后再不预热地运行一遍，把输出写到这个目录，见 stencil_outputs
+        self.output_dir = output_dir
+        # kernel 名（mlir 文件名去掉后缀）-> 并行循环的分块，没有的用流水线默认值
+        self.tile_sizes = dict(tile_sizes or {})
 
     # self.cwd = os.path.dirname(os.path.realpath(__file__))
     # BENCH_NAME = os.path.basename(self.cwd)
 
-    def compile_mlir(self, BENCH_NAME):
-        # global object_paths
-        print(f"Compiling MLIR...{BENCH_NAME}")
-
-        origin_mlir_path = os.path.join(self.cwd, BENCH_NAME + ".mlir")
-        lowered_mlir_path = os.path.join(self.cwd, BENCH_NAME + "_lowered.mlir")
-        bc_path = os.path.join(self.cwd, BENCH_NAME + ".bc")
-        assembly_path = os.path.join(self.cwd, BENCH_NAME + ".s")
-        object_path = os.path.join(self.cwd, BENCH_NAME + ".o")
-        self.clean_path += [lowered_mlir_path, bc_path, assembly_path, object_path]
-        self.object_paths.append(object_path)
-        cmd_paras = "oec-opt --canonicalize --stencil-shape-inference --stencil-storage-materialization --stencil-shape-inference --stencil-combine-to-ifelse --cse \
-            --canonicalize --convert-stencil-to-std --cse --parallel-loop-tiling=parallel-loop-tile-sizes=128,1,1 \
-            --canonicalize --test-gpu-greedy-parallel-loop-mapping --convert-parallel-loops-to-gpu --lower-affine \
-            --convert-scf-to-std --gpu-kernel-outlining --cse \
-            --canonicalize --stencil-kernel-to-cubin --cse --canonicalize --mlir-disable-threading " + origin_mlir_path
-
-        cmd1_paras = "oec-opt --canonicalize --stencil-inlining --cse --canonicalize --stencil-shape-inference --stencil-storage-materialization --stencil-shape-inference --stencil-combine-to-ifelse --cse \
-            --canonicalize --convert-stencil-to-std --cse --parallel-loop-tiling=parallel-loop-tile-sizes=128,1,1 \
-            --canonicalize --test-gpu-greedy-parallel-loop-mapping --convert-parallel-loops-to-gpu --lower-affine \
-            --convert-scf-to-std --gpu-kernel-outlining --cse \
-            --canonicalize --stencil-kernel-to-cubin --cse --canonicalize --mlir-disable-threading " + origin_mlir_path
-        with open(lowered_mlir_path, "w") as f:
-            if not self.inline:
-                ret = subprocess.call(cmd_paras.split(), cwd=self.cwd, stdout=f)
-            else:
-                ret = subprocess.call(cmd1_paras.split(), cwd=self.cwd, stdout=f)
-        if ret != 0:
-            print("Error: compile_mlir failed in lowering")
-            exit(1)
-        cmd2 = "mlir-translate --mlir-to-llvmir " + lowered_mlir_path
-        with open(bc_path, "w") as f:
-            ret = subprocess.call(cmd2.split(), cwd=self.cwd, stdout=f)
-        if ret != 0:
-            print("Error: compile_mlir failed in translation")
-            exit(1)
-        cmd3 = "llc -O3 " + bc_path + " -o " + assembly_path
-        ret = subprocess.call(cmd3.split(), cwd=self.cwd)
-        if ret != 0:
-            print("Error: compile_mlir failed in llc")
-            exit(1)
-        cmd4 = "clang -c " + assembly_path + " -fPIE -o " + object_path
-        ret = subprocess.call(cmd4.split(), cwd=self.cwd)
-        if ret != 0:
-            print("Error: compile_mlir failed in clang")
-            exit(1)
+    def compile_all(self):
+        """Compile every kernel, cache misses concurrently in a process pool."""
+        keys = {}
+        for mlir in self.mlir_list:
+            assert mlir.endswith(".mlir")
+            with open(os.path.join(self.cwd, mlir), "r") as f:
+                keys[mlir[0:-5]] = cache_key(f.read(), self.inline, self.target, self.tile_sizes.get(mlir[0:-5]))
+        misses = [name for name, key in keys.items() if not os.path.exists(cached_object(key))]
+        results = {}
+        if self.jobs > 1 and len(misses) > 1:
+            with ProcessPoolExecutor(max_workers=min(self.jobs, len(misses))) as pool:
+                futures = {name: pool.submit(call_collected, compile_object, self.cwd, name, self.inline, keys[name],
+                                                   self.target, self.tile_sizes.get(name)) for name in misses}
+                # 等所有任务结束再抛出第一个失败，避免留下写了一半的文件
+                for name, future in futures.items():
+                    try:
+                        results[name], spans = future.result()
+                        TRACER.extend(spans)
+                        self.clean_path.append(results[name])
+                    except CompileError as err:
+                        results[name] = err
+        for name, key in keys.items():
+            result = results.get(name)
+            if isinstance(result, CompileError):
+                raise result
+            if result is None:
+                result = compile_object(self.cwd, name, self.inline, key, self.target, self.tile_sizes.get(name))
+                self.clean_path.append(result)
+            # 按 mlir_list 顺序记录，保证链接顺序稳定
+            self.object_paths.append(result)
     
     def clean(self):
         for file in self.clean_path:
@@ -79,7 +244,7 @@ class Evaluate:
         log_path = os.path.join(self.cwd, f"{self.execuable}-log")
         if not os.path.exists(log_path):
             os.mkdir(log_path)
-        log_file = [self.main_name, f"demo-{self.execuable}", f"result-{self.execuable}.txt"]
+        log_file = [self.main_name, f"demo-{self.execuable}", f"result-{self.execuable}.txt", f"timing-{self.execuable}.json"]
         shutil.copy( os.path.join(self.cwd,f"result-{self.execuable}.txt"), os.path.join(self.cwd,f"result.txt"))
         for mlir in self.mlir_list + log_file:
             file = os.path.join(self.cwd,mlir)
@@ -88,24 +253,61 @@ class Evaluate:
                 os.remove(file)
 
     def link(self):
+        with span("link", main=self.main_name, target=self.target):
+            self._link()
+
+    def _link(self):
         print("Linking...")
-        cmd = f"nvcc --default-stream per-thread  -allow-unsupported-compiler -ccbin clang {self.main_name} " + " ".join(self.object_paths) + " -L/root/new-open-earth/llvm-project/install/lib -lcuda-runtime-wrappers -lcudart -lcuda -o " + f"demo-{self.execuable}"
+        if self.target == "cpu":
+            cmd = f"{CPU_LINK} {self.main_name} " + " ".join(self.object_paths) + f" -o demo-{self.execuable}"
+        else:
+            cmd = f"nvcc --default-stream per-thread  -allow-unsupported-compiler -ccbin clang {self.main_name} " + " ".join(self.object_paths) + " -L/root/new-open-earth/llvm-project/install/lib -lcuda-runtime-wrappers -lcudart -lcuda -o " + f"demo-{self.execuable}"
         ret = subprocess.call(cmd.split(), cwd=self.cwd)
         if ret != 0:
-            print("Error: link failed")
-            exit(1)
+            raise CompileError("link", self.main_name, ret)
+
+    def run(self, warmup=0, repeats=1, append=False, output_dir=""):
+        """Run the program once; returns the samples it wrote.
 
-    def run(self):
+        Outputs are written to ``output_dir``, not at all when it is empty.
+        """
         print("Running...")
         cmd = f"./demo-{self.execuable}"
-        stdout_file = open(os.path.join(self.cwd,f"result-{self.execuable}.txt"),"w")
+        samples_path = os.path.join(self.cwd, f"samples-{self.execuable}.json")
+        env = dict(os.environ, STENCIL_WARMUP=str(warmup), STENCIL_REPEATS=str(repeats), STENCIL_TIMING_FILE=samples_path,
+                   STENCIL_OUTPUT_DIR=output_dir)
+        stdout_file = open(os.path.join(self.cwd,f"result-{self.execuable}.txt"),"a" if append else "w")
         stderr_file = open(os.path.join(self.cwd,"error.txt"),"w")
-        ret = subprocess.call(cmd.split(), cwd=self.cwd, stdout=stdout_file, stderr=stderr_file)
+        with span("run", program=self.execuable, warmup=warmup, repeats=repeats):
+            ret = subprocess.call(cmd.split(), cwd=self.cwd, stdout=stdout_file, stderr=stderr_file, env=env)
         stdout_file.close()
         stderr_file.close()
         if ret != 0:
-            print("Error: run failed")
-            exit(1)
+            raise RuntimeError(f"run failed for demo-{self.execuable} (exit code {ret})")
+        with open(os.path.join(self.cwd,"error.txt"),"r") as f_e:
+            assert len(f_e.read()) == 0
+        samples = read_samples(samples_path)
+        os.remove(samples_path)
+        return samples
+
+    def measure(self):
+        """Run the program in batches until the median is known to ``rel_ci``.
+
+        Every batch is a new process warmed up ``warmup`` times, so samples
+        from different launches (and GPU clock states) are mixed. The summary
+        goes to ``timing-<name>.json``.
+        """
+        samples = []
+        while True:
+            samples += self.run(self.warmup, self.repeats, append=bool(samples))
+            measurement = Timing(samples, self.warmup)
+            if measurement.tight(self.rel_ci) or len(samples) >= self.max_repeats:
+                break
+        print(repr(measurement))
+        with open(os.path.join(self.cwd, f"timing-{self.execuable}.json"), "w") as f:
+            json.dump(measurement.to_dict(), f, indent=1)
+        self.measurement = measurement
+        return measurement
 
     def get_score(self):
         min_t = 1000000.0
@@ -129,20 +331,30 @@ class Evaluate:
         return (avg_t, max_t, min_t)
 
 
-    def evaluate(self) -> float:
+    def evaluate(self) -> Timing:
         compile_start = time.time()
-        for mlir in self.mlir_list:
-            assert mlir.endswith(".mlir")
-            self.compile_mlir(mlir[0:-5])
-        compile_end = time.time()
-        self.link()
-        link_end = time.time()
-        self.run()
+        try:
+            with span("compile_all", kernels=len(self.mlir_list)):
+                self.compile_all()
+            compile_end = time.time()
+            self.link()
+            link_end = time.time()
+            measurement = self.measure()
+            if self.output_dir:
+                output_dir = os.path.join(self.cwd, self.output_dir)
+                os.makedirs(output_dir, exist_ok=True)
+                self.run(append=True, output_dir=output_dir)
+        except Exception:
+            for file in self.clean_path:
+                if os.path.exists(file):
+                    os.remove(file)
+            raise
         run_end = time.time()
+        self.timings = {"compile": compile_end - compile_start, "link": link_end - compile_end, "run": run_end - link_end}
+        self.timings["measurement"] = {k: v for k, v in measurement.to_dict().items() if k != "samples"}
         print(f'compile_time = {compile_end - compile_start}s, link_time = {link_end - compile_end}s, run_time = {run_end - link_end}s')
-        r = self.get_score()[0]
         self.clean()
-        return r
+        return measurement
 
 
 if __name__ == '__main__':
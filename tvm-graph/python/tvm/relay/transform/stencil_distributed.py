@@ -0,0 +1,506 @@
+"""Domain-decomposed execution of stencil programs over several processes.
+
+The i/j plane of the domain is split into ``parts[0] x parts[1]`` tiles, one
+worker process each. A worker holds a window of every field: its tile widened
+by the halo the program reads the field at (``read_extents``, from the bounds
+inferred for the applies and their access extents), so one step of the program
+runs on the tile without communication, recomputing intermediate temps on the
+overlap as the fused kernels do.
+
+Iterative programs feed stored fields back as loaded ones (``feedback``, as in
+``temporal``). Between steps the fed back fields are swapped like the host
+program does, and their halos, which neighbouring tiles own, are exchanged.
+The windows live in shared memory, so a worker pulls the halo strips directly
+out of its neighbours' windows. The pull runs in a helper thread while the
+worker computes the interior of its tile, the part that reads no halo point;
+the boundary strips are computed once the pull is done. One barrier per step
+orders the writes of a step before the reads of the next.
+
+The fields live in ``.npy`` files. Every worker reads its windows out of
+them, memory-mapped, and writes the tiles of the stored and fed back fields
+back when it is done, so no process holds a whole field; the parent only
+sets up the shared windows and waits. This is a prototype at the level of
+the NumPy executor: the workers run ``execute``, not the generated kernels,
+and the windows are shared memory of one machine, not buffers of separate
+nodes exchanging halos over a network.
+
+Runs with local processes on one machine and gives the same results as the
+single-process executor bit for bit:
+
+    python -m tvm.relay.transform.stencil_distributed prog.mlir --parts 2 2 --steps 4
+"""
+import argparse
+import itertools
+import multiprocessing
+import os
+import queue
+import sys
+import tempfile
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from tvm.relay.transform.stencil_executor import allocate_fields, execute
+from tvm.relay.transform.stencil_ir import StencilProgram, access_extents, resize_mlir
+
+
+def _arg(name):
+    return "%" + name.strip().lstrip("%")
+
+
+def _intersect(a, b):
+    lb = tuple(map(max, a[0], b[0]))
+    ub = tuple(map(min, a[1], b[1]))
+    return None if any(l >= u for l, u in zip(lb, ub)) else (lb, ub)
+
+
+def _widen(box, lo, hi):
+    return tuple(l + d for l, d in zip(box[0], lo)), tuple(u + d for u, d in zip(box[1], hi))
+
+
+def _subtract(box, inner):
+    """Boxes covering ``box`` minus ``inner`` (inner inside box), split on the first two axes."""
+    if inner is None:
+        return [box]
+    (lb, ub), (ilb, iub) = box, inner
+    pieces = []
+    # i 方向两条整条带，j 方向两条夹在中间
+    if lb[0] < ilb[0]:
+        pieces.append((lb, (ilb[0],) + ub[1:]))
+    if iub[0] < ub[0]:
+        pieces.append(((iub[0],) + lb[1:], ub))
+    if lb[1] < ilb[1]:
+        pieces.append(((ilb[0], lb[1]) + lb[2:], (iub[0], ilb[1]) + ub[2:]))
+    if iub[1] < ub[1]:
+        pieces.append(((ilb[0], iub[1]) + lb[2:], (iub[0], ub[1]) + ub[2:]))
+    return pieces
+
+
+def _index(box, origin):
+    return tuple(slice(l - o, u - o) for l, u, o in zip(box[0], box[1], origin))
+
+
+def store_box(program):
+    """The box every store of ``program`` writes."""
+    boxes = {(tuple(lb), tuple(ub)) for _, _, lb, ub in program.stores}
+    if len(boxes) != 1:
+        raise ValueError(f"{program.name}: stores of different bounds {sorted(boxes)} can't be decomposed")
+    return boxes.pop()
+
+
+def read_extents(program):
+    """How far around the store box every loaded field is read.
+
+    Returns ``{arg: (lo, hi)}`` with ``lo`` the (non-positive) offsets below
+    and ``hi`` the offsets above the store box, over the inferred bounds of
+    every apply reading the field.
+    """
+    lb, ub = store_box(program)
+    bounds = program.infer_bounds()
+    extents = {}
+    for apply in program.applies:
+        if apply.tag not in bounds:
+            continue
+        apply_lb, apply_ub = bounds[apply.tag]
+        for operand, extent in zip(apply.operands, access_extents(apply.body)):
+            if operand not in program.loads or extent is None:
+                continue
+            arg = program.casts[program.loads[operand]][0]
+            lo = tuple(min(0, l + e - s) for l, e, s in zip(apply_lb, extent[0], lb))
+            hi = tuple(max(0, u + e - s) for u, e, s in zip(apply_ub, extent[1], ub))
+            if arg in extents:
+                lo = tuple(map(min, lo, extents[arg][0]))
+                hi = tuple(map(max, hi, extents[arg][1]))
+            extents[arg] = (lo, hi)
+    return extents
+
+
+class Decomposition:
+    """A split of the i/j plane of ``program``'s store box into tiles.
+
+    Attributes
+    ----------
+    tiles : list of tuple
+        ``(lb, ub)`` of every tile, row-major over ``parts``.
+    windows : dict
+        ``(tile, arg)`` to the ``(lb, ub)`` of the tile's window of the field.
+    exchanged : list of str
+        Fields whose halos are exchanged between steps: the fed back inputs.
+    """
+
+    def __init__(self, program, parts, feedback=None):
+        self.program = program
+        self.parts = tuple(parts)
+        self.domain = store_box(program)
+        rank = len(self.domain[0])
+        if rank < 2 or len(self.parts) != 2:
+            raise ValueError("the decomposition splits the first two axes of 2D or 3D programs")
+        self.feedback = {_arg(out): _arg(arg) for out, arg in (feedback or {}).items()}
+        self.cast_box = {}
+        for arg, lb, ub in program.casts.values():
+            self.cast_box[arg] = (tuple(lb), tuple(ub))
+        for out, arg in self.feedback.items():
+            if self.cast_box[out] != self.cast_box[arg]:
+                raise ValueError(f"{out} and {arg} are swapped but have different bounds")
+        self.extents = read_extents(program)
+        self.exchanged = sorted(set(self.feedback.values()))
+        self.tiles = []
+        splits = [self._split(d, n) for d, n in enumerate(self.parts)]
+        for (l0, u0), (l1, u1) in itertools.product(*splits):
+            self.tiles.append(((l0, l1) + self.domain[0][2:], (u0, u1) + self.domain[1][2:]))
+        # 交换的两个 field 窗口必须一样大，取两者读取范围的并
+        halo = {}
+        for arg in self.cast_box:
+            halo[arg] = self.extents.get(arg, ((0,) * rank, (0,) * rank))
+        for out, arg in self.feedback.items():
+            merged = (tuple(map(min, halo[out][0], halo[arg][0])), tuple(map(max, halo[out][1], halo[arg][1])))
+            halo[out] = halo[arg] = merged
+        self.halo = halo
+        self.windows = {}
+        for t, tile in enumerate(self.tiles):
+            for arg, box in self.cast_box.items():
+                self.windows[t, arg] = _intersect(_widen(tile, *halo[arg]), box)
+
+    def _split(self, axis, parts):
+        lb, ub = self.domain[0][axis], self.domain[1][axis]
+        if parts > ub - lb:
+            raise ValueError(f"can't split {ub - lb} points of axis {axis} into {parts} tiles")
+        cuts = [lb + (ub - lb) * k // parts for k in range(parts + 1)]
+        return list(zip(cuts[:-1], cuts[1:]))
+
+    def interior(self, t):
+        """The part of tile ``t`` whose computation reads no exchanged halo point."""
+        tile_lb, tile_ub = lb, ub = self.tiles[t]
+        for arg in self.exchanged:
+            lo, hi = self.extents.get(arg, ((0,) * len(lb), (0,) * len(lb)))
+            # 只在切分的 i/j 方向、且有相邻 tile 的一侧收缩
+            lb = tuple(
+                max(l, b - d) if axis < 2 and b > self.domain[0][axis] else l
+                for axis, (l, b, d) in enumerate(zip(lb, tile_lb, lo))
+            )
+            ub = tuple(
+                min(u, b - d) if axis < 2 and b < self.domain[1][axis] else u
+                for axis, (u, b, d) in enumerate(zip(ub, tile_ub, hi))
+            )
+        if any(l >= u for l, u in zip(lb, ub)):
+            return None
+        return lb, ub
+
+    def halo_regions(self, t, arg):
+        """``(source tile, box)`` pieces of the halo of tile ``t``'s window of ``arg``.
+
+        Only the points the program reads (``read_extents``) and that lie in
+        another tile are exchanged; the rest of the window is the boundary of
+        the domain, which no step writes.
+        """
+        tile = self.tiles[t]
+        lo, hi = self.extents.get(arg, ((0,) * len(tile[0]), (0,) * len(tile[0])))
+        needed = _intersect(_widen(tile, lo, hi), self.domain)
+        regions = []
+        for s, other in enumerate(self.tiles):
+            if s == t or needed is None:
+                continue
+            box = _intersect(needed, other)
+            if box is not None:
+                regions.append((s, box))
+        return regions
+
+    def local_program(self, t, box):
+        """The program of tile ``t`` storing only ``box``, reading its windows."""
+        program = self.program.with_applies(self.program.applies)
+        for name, (arg, _, _) in self.program.casts.items():
+            program.casts[name] = (arg,) + self.windows[t, arg]
+        program.stores = [(temp, field) + box for temp, field, _, _ in self.program.stores]
+        return program
+
+    def volume(self):
+        """Points exchanged per step, summed over tiles."""
+        total = 0
+        for t in range(len(self.tiles)):
+            for arg in self.exchanged:
+                for _, (lb, ub) in self.halo_regions(t, arg):
+                    total += int(np.prod([u - l for l, u in zip(lb, ub)]))
+        return total
+
+
+class _Windows:
+    """The shared memory windows of every tile, by slot.
+
+    A worker swaps fields by swapping slots; every worker does the same swaps
+    at the same steps, so ``array(t, arg)`` names the window of any tile.
+    """
+
+    def __init__(self, decomposition, dtype, names=None):
+        self.decomposition = decomposition
+        self.dtype = np.dtype(dtype)
+        self.args = sorted(decomposition.cast_box)
+        self.slot = {arg: arg for arg in self.args}
+        self.blocks = {}
+        self.arrays = {}
+        for t in range(len(decomposition.tiles)):
+            for arg in self.args:
+                lb, ub = decomposition.windows[t, arg]
+                shape = tuple(u - l for l, u in zip(lb, ub))
+                size = max(int(np.prod(shape)) * self.dtype.itemsize, 1)
+                if names is None:
+                    block = shared_memory.SharedMemory(create=True, size=size)
+                else:
+                    block = shared_memory.SharedMemory(name=names[t, arg])
+                self.blocks[t, arg] = block
+                self.arrays[t, arg] = np.ndarray(shape, dtype=self.dtype, buffer=block.buf)
+
+    def names(self):
+        return {key: block.name for key, block in self.blocks.items()}
+
+    def array(self, t, arg):
+        return self.arrays[t, self.slot[arg]]
+
+    def origin(self, t, arg):
+        return self.decomposition.windows[t, self.slot[arg]][0]
+
+    def swap(self, a, b):
+        self.slot[a], self.slot[b] = self.slot[b], self.slot[a]
+
+    def close(self, unlink=False):
+        self.arrays.clear()
+        for block in self.blocks.values():
+            block.close()
+            if unlink:
+                block.unlink()
+
+
+def _pull(decomposition, windows, t):
+    for arg in decomposition.exchanged:
+        mine, origin = windows.array(t, arg), windows.origin(t, arg)
+        for s, box in decomposition.halo_regions(t, arg):
+            mine[_index(box, origin)] = windows.array(s, arg)[_index(box, windows.origin(s, arg))]
+
+
+def _written(decomposition):
+    """Fields whose tiles a run writes back: the stored and the fed back ones."""
+    program = decomposition.program
+    stored = {program.casts[field][0] for _, field, _, _ in program.stores}
+    return sorted(stored | set(decomposition.exchanged) | set(decomposition.feedback))
+
+
+def _worker(decomposition, names, dtype, t, steps, barrier, overlap, results, paths):
+    windows = _Windows(decomposition, dtype, names)
+    tile = decomposition.tiles[t]
+    interior = decomposition.interior(t) if overlap else None
+    programs = [decomposition.local_program(t, box) for box in _subtract(tile, interior)]
+    inner = decomposition.local_program(t, interior) if interior is not None else None
+    stats = {"tile": t, "compute": 0.0, "exchange": 0.0, "wait": 0.0}
+    try:
+        # 每个进程只从文件读自己的窗口，第一步的屏障保证所有窗口都已填好
+        for arg in windows.args:
+            source = np.load(paths[arg], mmap_mode="r")
+            windows.array(t, arg)[...] = source[_index(decomposition.windows[t, arg], decomposition.cast_box[arg][0])]
+            del source
+        for step in range(steps):
+            start = time.perf_counter()
+            barrier.wait()
+            stats["wait"] += time.perf_counter() - start
+            fields = {arg: windows.array(t, arg) for arg in windows.args}
+            pull = None
+            if step > 0 and decomposition.exchanged:
+                if inner is None:
+                    start = time.perf_counter()
+                    _pull(decomposition, windows, t)
+                    stats["exchange"] += time.perf_counter() - start
+                else:
+                    # 内部区域只读本 tile 的数据，和取 halo 同时进行
+                    pull = threading.Thread(target=_pull, args=(decomposition, windows, t))
+                    pull.start()
+            start = time.perf_counter()
+            if inner is not None:
+                execute(inner, fields)
+            if pull is not None:
+                joined = time.perf_counter()
+                pull.join()
+                stats["exchange"] += time.perf_counter() - joined
+            for program in programs:
+                execute(program, fields)
+            stats["compute"] += time.perf_counter() - start
+            if step + 1 < steps:
+                for out, arg in decomposition.feedback.items():
+                    windows.swap(out, arg)
+        # tile 互不重叠，各进程把每块存储写回它初始对应的文件，交换由主进程换文件完成
+        for slot in _written(decomposition):
+            target = np.load(paths[slot], mmap_mode="r+")
+            target[_index(tile, decomposition.cast_box[slot][0])] = windows.arrays[t, slot][
+                _index(tile, decomposition.windows[t, slot][0])
+            ]
+            target.flush()
+            del target
+        results.put(stats)
+    finally:
+        windows.close()
+
+
+def run_serial(program, fields, steps=1, feedback=None):
+    """``steps`` runs of ``program`` on ``fields`` in one process, swapping fed back fields."""
+    feedback = {_arg(out): _arg(arg) for out, arg in (feedback or {}).items()}
+    for step in range(steps):
+        execute(program, fields)
+        if step + 1 < steps:
+            for out, arg in feedback.items():
+                fields[out], fields[arg] = fields[arg], fields[out]
+    return fields
+
+
+# 主进程等待结果时检查工作进程是否还活着的间隔 (s)
+POLL_INTERVAL = 0.1
+
+
+def _gather(workers, barrier, results, timeout):
+    """The stats of every worker; raises ``RuntimeError`` once one fails.
+
+    A worker that dies leaves the others blocked at the barrier and the
+    queue empty, so the queue is polled and the workers checked in between.
+    On a failure or after ``timeout`` s the barrier is aborted and the
+    remaining workers are terminated.
+    """
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    stats = []
+    try:
+        while len(stats) < len(workers):
+            try:
+                stats.append(results.get(timeout=POLL_INTERVAL))
+                continue
+            except queue.Empty:
+                pass
+            for worker in workers:
+                if worker.exitcode not in (None, 0):
+                    raise RuntimeError(f"worker {worker.name} failed with exit code {worker.exitcode}")
+            if all(worker.exitcode is not None for worker in workers) and results.empty():
+                raise RuntimeError(f"{len(workers) - len(stats)} workers exited without a result")
+            if deadline is not None and time.monotonic() > deadline:
+                raise RuntimeError(f"workers didn't finish within {timeout} s")
+        for worker in workers:
+            worker.join()
+            if worker.exitcode != 0:
+                raise RuntimeError(f"worker {worker.name} failed with exit code {worker.exitcode}")
+    except BaseException:
+        barrier.abort()
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+            worker.join()
+        raise
+    return stats
+
+
+def save_fields(fields, directory):
+    """Write every field to ``directory`` as ``<arg>.npy``; returns the paths."""
+    paths = {}
+    for arg, data in fields.items():
+        paths[arg] = os.path.join(directory, arg.lstrip("%") + ".npy")
+        np.save(paths[arg], data)
+    return paths
+
+
+def load_fields(paths):
+    return {arg: np.load(path) for arg, path in paths.items()}
+
+
+def run_distributed(program, paths, parts=(2, 2), steps=1, feedback=None, overlap=True, timeout=None):
+    """``run_serial`` on ``parts[0] * parts[1]`` worker processes.
+
+    Parameters
+    ----------
+    program : StencilProgram
+    paths : dict
+        Every argument to a ``.npy`` file of its cast shape, e.g. from
+        ``save_fields``. The workers read their windows from the files and
+        write their tiles of the outputs back, and of the fed back fields
+        like ``run_serial`` swaps them: the file of ``arg`` ends up with
+        what ``run_serial`` leaves in ``fields[arg]``.
+    parts : tuple of int
+        Tiles along the i and j axes.
+    steps : int
+        Timesteps; between two of them the ``feedback`` fields are swapped
+        and their halos exchanged.
+    overlap : bool
+        Compute the interior of a tile while its halos are pulled.
+    timeout : float
+        Seconds to wait for the workers, None for no limit. A worker that
+        fails raises ``RuntimeError`` either way.
+
+    Returns
+    -------
+    stats : list of dict
+        Per tile seconds spent computing, waiting for the exchange to finish
+        after the interior and waiting at the barrier.
+    """
+    decomposition = Decomposition(program, parts, feedback)
+    dtypes = set()
+    for arg in decomposition.cast_box:
+        header = np.load(paths[arg], mmap_mode="r")
+        dtypes.add(header.dtype)
+        del header
+    dtype = np.result_type(*dtypes)
+    windows = _Windows(decomposition, dtype)
+    context = multiprocessing.get_context()
+    try:
+        barrier = context.Barrier(len(decomposition.tiles))
+        results = context.Queue()
+        workers = [
+            context.Process(
+                target=_worker,
+                args=(decomposition, windows.names(), dtype, t, steps, barrier, overlap, results, paths),
+            )
+            for t in range(len(decomposition.tiles))
+        ]
+        for worker in workers:
+            worker.start()
+        stats = _gather(workers, barrier, results, timeout)
+        # 工作进程交换的次数相同，在主进程里重放一遍，像 run_serial 交换数组一样交换文件
+        for _ in range(steps - 1):
+            for out, arg in decomposition.feedback.items():
+                windows.swap(out, arg)
+        moves = {arg: slot for arg, slot in windows.slot.items() if slot != arg}
+        for slot in moves.values():
+            os.replace(paths[slot], paths[slot] + ".swap")
+        for arg, slot in moves.items():
+            os.replace(paths[slot] + ".swap", paths[arg])
+        return sorted(stats, key=lambda s: s["tile"])
+    finally:
+        windows.close(unlink=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a stencil program domain-decomposed and check it against one process.")
+    parser.add_argument("mlir")
+    parser.add_argument("--parts", type=int, nargs=2, default=[2, 2])
+    parser.add_argument("--steps", type=int, default=1)
+    parser.add_argument("--mesh-size", type=int, default=64)
+    parser.add_argument("--halo", type=int, default=8)
+    parser.add_argument("--no-overlap", action="store_true")
+    args = parser.parse_args()
+
+    from tvm.relay.transform.temporal import default_feedback
+
+    with open(args.mlir) as f:
+        code = resize_mlir(f.read().split("\n"), args.mesh_size, args.halo)
+    program = StencilProgram.from_mlir(code)
+    feedback = default_feedback(program) if args.steps > 1 else {}
+    expected = allocate_fields(program)
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = save_fields(expected, tmp)
+        start = time.perf_counter()
+        run_serial(program, expected, args.steps, feedback)
+        serial = time.perf_counter() - start
+        start = time.perf_counter()
+        stats = run_distributed(program, paths, args.parts, args.steps, feedback, not args.no_overlap)
+        distributed = time.perf_counter() - start
+        actual = load_fields(paths)
+    decomposition = Decomposition(program, args.parts, feedback)
+    print(f"serial {serial:.3f}s, {len(stats)} processes {distributed:.3f}s, "
+          f"{decomposition.volume()} halo points exchanged per step")
+    for stat in stats:
+        print(stat)
+    differ = [arg for arg in expected if expected[arg].tobytes() != actual[arg].tobytes()]
+    print("differ:", differ)
+    sys.exit(1 if differ else 0)
@@ -0,0 +1,240 @@
+"""NumPy reference executor for stencil programs.
+
+Every ``stencil.apply`` is evaluated as whole-array expressions: a
+``stencil.access`` is a shifted view of its input over the apply's bounds, so
+there is no per-point Python loop. The executor runs any ``StencilProgram``
+on the CPU and serves as an oracle comparing fused programs to the unfused one
+bit for bit.
+"""
+import numpy as np
+
+from tvm.relay.transform.stencil_ir import StencilApply
+
+
+DTYPES = {"f64": np.float64, "f32": np.float32, "f16": np.float16}
+
+_BINARY = {
+    "addf": np.add,
+    "subf": np.subtract,
+    "mulf": np.multiply,
+    "divf": np.divide,
+    "remf": np.fmod,
+    "maxf": np.maximum,
+    "minf": np.minimum,
+    "and": np.logical_and,
+    "or": np.logical_or,
+}
+
+_UNARY = {
+    "negf": np.negative,
+    "absf": np.abs,
+    "sqrt": np.sqrt,
+    "math.sqrt": np.sqrt,
+    "exp": np.exp,
+    "math.exp": np.exp,
+}
+
+# fpext/fptrunc：混合精度的 apply 在更宽的类型上计算
+_CASTS = ("fpext", "fptrunc")
+
+_CMPF = {
+    "oeq": np.equal,
+    "one": np.not_equal,
+    "ogt": np.greater,
+    "oge": np.greater_equal,
+    "olt": np.less,
+    "ole": np.less_equal,
+}
+
+
+class Grid:
+    """A temp or field: ``data[i - origin]`` holds the value at point ``i``."""
+
+    __slots__ = ("data", "origin")
+
+    def __init__(self, data, origin):
+        self.data = data
+        self.origin = tuple(origin)
+
+    def view(self, lb, ub):
+        index = tuple(slice(l - o, u - o) for l, u, o in zip(lb, ub, self.origin))
+        for (l, u), o, n in zip(zip(lb, ub), self.origin, self.data.shape):
+            if l - o < 0 or u - o > n:
+                raise IndexError(
+                    f"read of [{lb}, {ub}) outside of the grid at {self.origin} of shape {self.data.shape}"
+                )
+        return self.data[index]
+
+
+def evaluate_body(body, grids, lb, ub):
+    """Evaluate an apply body over ``[lb, ub)`` and return one array per result."""
+    shape = tuple(u - l for l, u in zip(lb, ub))
+    values = {}
+    with np.errstate(all="ignore"):
+        for op in body.ops:
+            if op.is_access:
+                grid = grids[op.operands[0].index]
+                value = grid.view(
+                    tuple(l + d for l, d in zip(lb, op.offset)),
+                    tuple(u + d for u, d in zip(ub, op.offset)),
+                )
+            elif op.is_constant:
+                value = DTYPES.get(op.result_type, np.float64)(float(op.attr.split(":")[0]))
+            else:
+                operands = [values[operand] for operand in op.operands]
+                if op.opcode in _BINARY:
+                    value = _BINARY[op.opcode](*operands)
+                elif op.opcode in _UNARY:
+                    value = _UNARY[op.opcode](*operands)
+                elif op.opcode == "cmpf":
+                    value = _CMPF[op.attr.split(",")[0].strip().strip('"')](*operands)
+                elif op.opcode == "select":
+                    value = np.where(*operands)
+                elif op.opcode in _CASTS:
+                    value = np.asarray(operands[0]).astype(DTYPES[op.result_type])
+                else:
+                    raise NotImplementedError(f"{op.opcode} is not supported by the executor")
+            values[op] = value
+    results = []
+    for value, elem_type in zip(body.results, body.result_types):
+        dtype = DTYPES.get(elem_type, np.float64)
+        results.append(np.broadcast_to(np.asarray(values[value], dtype=dtype), shape).copy())
+    return results
+
+
+def execute(program, fields):
+    """Run ``program`` on ``fields``.
+
+    Parameters
+    ----------
+    program : StencilProgram
+        The (possibly fused) program.
+    fields : dict
+        Maps every function argument to an array of its cast shape. Input
+        fields are read, output fields are written in place.
+
+    Returns
+    -------
+    temps : dict
+        Every temp computed by an apply as a ``Grid``.
+    """
+    grids = {}
+    for temp, cast in program.loads.items():
+        arg, lb, _ = program.casts[cast]
+        grids[temp] = Grid(fields[arg], lb)
+    bounds = program.infer_bounds()
+    for apply in program.applies:
+        if apply.tag not in bounds:
+            continue
+        lb, ub = bounds[apply.tag]
+        # 融合掉没人用的结果后，它读的 temp 仍是操作数，但已不被访问，也可能没有计算
+        operands = [grids.get(operand) for operand in apply.operands]
+        results = evaluate_body(apply.body, operands, lb, ub)
+        for name, result in zip(apply.results, results):
+            grids[name] = Grid(result, lb)
+    for temp, field, lb, ub in program.stores:
+        arg, field_lb, _ = program.casts[field]
+        Grid(fields[arg], field_lb).view(lb, ub)[...] = grids[temp].view(lb, ub)
+    return grids
+
+
+def allocate_fields(program, seed=0, dtype=np.float64):
+    """Random input fields and zeroed output fields for every argument."""
+    rng = np.random.default_rng(seed)
+    stored = {program.casts[field][0] for _, field, _, _ in program.stores}
+    fields = {}
+    for arg, lb, ub in program.casts.values():
+        shape = tuple(u - l for l, u in zip(lb, ub))
+        if arg in stored:
+            fields[arg] = np.zeros(shape, dtype=dtype)
+        else:
+            fields[arg] = rng.uniform(1.0, 2.0, shape).astype(dtype)
+    return fields
+
+
+def fuse_program(program, groups):
+    """The program with the applies of every group in ``groups`` fused.
+
+    A fused apply keeps the names of the temps it returns, so consumers and
+    stores are left untouched.
+    """
+    owner = {}
+    for group in groups:
+        for tag in group:
+            owner[tag] = frozenset(group)
+    applies = []
+    done = set()
+    for apply in program.applies:
+        group = owner.get(apply.tag, frozenset([apply.tag]))
+        if group in done:
+            continue
+        done.add(group)
+        members = [a for a in program.applies if a.tag in group]
+        body, inputs, results = program.group_body(group)
+        tag = "%" + "_".join(a.tag[1:] for a in members)
+        applies.append(StencilApply(tag, results, inputs, body))
+    return program.with_applies(_topo_sort(applies))
+
+
+def _topo_sort(applies):
+    produced = {result: apply for apply in applies for result in apply.results}
+    order, state = [], {}
+
+    def visit(apply):
+        if state.get(apply.tag) == "done":
+            return
+        if state.get(apply.tag) == "active":
+            raise ValueError(f"fusing {apply.tag} creates a cycle")
+        state[apply.tag] = "active"
+        for operand in apply.operands:
+            if operand in produced:
+                visit(produced[operand])
+        state[apply.tag] = "done"
+        order.append(apply)
+
+    for apply in applies:
+        visit(apply)
+    return order
+
+
+def compare(program, other, fields=None, seed=0):
+    """Run two programs on the same inputs and list the fields that differ.
+
+    Fields are compared bit for bit, so reordering floating point operations
+    counts as a difference.
+    """
+    if fields is None:
+        fields = allocate_fields(program, seed)
+    expected = {arg: data.copy() for arg, data in fields.items()}
+    actual = {arg: data.copy() for arg, data in fields.items()}
+    execute(program, expected)
+    execute(other, actual)
+    return [
+        arg
+        for arg in program.args
+        if arg in expected and expected[arg].tobytes() != actual[arg].tobytes()
+    ]
+
+
+def precision_error(reference, program, dtype=np.float32, fields=None, seed=0):
+    """Max error of ``program`` run on ``dtype`` fields against ``reference`` in f64.
+
+    Both run on the same random inputs, rounded to ``dtype`` for ``program``.
+    Returns ``{arg: {"max_abs": ..., "max_rel": ...}}`` for every stored field.
+    """
+    if fields is None:
+        fields = allocate_fields(reference, seed)
+    expected = {arg: data.astype(np.float64) for arg, data in fields.items()}
+    actual = {arg: data.astype(dtype) for arg, data in fields.items()}
+    execute(reference, expected)
+    execute(program, actual)
+    report = {}
+    for _, field, _, _ in reference.stores:
+        arg = reference.casts[field][0]
+        e = expected[arg]
+        diff = np.abs(actual[arg].astype(np.float64) - e)
+        scale = np.abs(e)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rel = np.where(scale > 0, diff / scale, np.where(diff > 0, np.inf, 0.0))
+        report[arg] = {"max_abs": float(np.nanmax(diff)), "max_rel": float(np.nanmax(rel))}
+    return report
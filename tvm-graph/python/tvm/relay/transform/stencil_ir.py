@@ -0,0 +1,763 @@
+"""In-memory SSA representation of ``stencil.apply`` bodies.
+
+The MLIR code generator used to fuse stencils by rewriting the text of their
+bodies token by token. This module parses every body once into operations that
+reference their operands directly, so renaming, argument rebinding and producer
+inlining become graph operations and MLIR text is only emitted at the end.
+"""
+import re
+
+
+_RESULT_RE = re.compile(r"^(%[\w.$-]+)(?::(\d+))?\s*=\s*([\w.]+)\s*(.*)$")
+_OFFSET_RE = re.compile(r"\[([-\d,\s]*)\]")
+
+
+def parse_offset(text):
+    """Parse ``[a, b, c]`` into a tuple of ints."""
+    match = _OFFSET_RE.search(text)
+    if match is None:
+        raise ValueError(f"no offset found in: {text}")
+    return tuple(int(v) for v in match.group(1).split(",") if v.strip())
+
+
+def format_offset(offset):
+    return "[" + ", ".join(str(v) for v in offset) + "]"
+
+
+def shift_offset(offset, shift):
+    if shift is None:
+        return offset
+    return tuple(a + b for a, b in zip(offset, shift))
+
+
+class Argument:
+    """Block argument of a ``stencil.apply``, i.e. one of its input temps."""
+
+    __slots__ = ("index",)
+
+    def __init__(self, index):
+        self.index = index
+
+    def __repr__(self):
+        return f"Argument({self.index})"
+
+
+class Operation:
+    """A single-result operation inside an apply body.
+
+    Parameters
+    ----------
+    opcode : str
+        The operation name, e.g. ``stencil.access``, ``constant`` or ``addf``.
+    operands : tuple
+        The ``Argument``/``Operation`` values consumed by the operation.
+    offset : tuple of int, optional
+        The access offset of ``stencil.access``.
+    attr : str
+        Non-SSA prefix of the operand list (constant literal, predicate ...).
+    type : str
+        The type text written after the colon.
+    """
+
+    __slots__ = ("opcode", "operands", "offset", "attr", "type")
+
+    def __init__(self, opcode, operands=(), offset=None, attr="", type=""):
+        self.opcode = opcode
+        self.operands = tuple(operands)
+        self.offset = offset
+        self.attr = attr
+        self.type = type
+
+    @property
+    def is_access(self):
+        return self.opcode == "stencil.access"
+
+    @property
+    def is_constant(self):
+        return self.opcode.endswith("constant")
+
+    @property
+    def result_type(self):
+        """The scalar type produced by the operation."""
+        if self.is_access:
+            return self.type.split("->")[-1].strip()
+        # fpext/fptrunc 写作 "f32 to f64"
+        return self.type.split(":")[-1].split(" to ")[-1].strip()
+
+    def __repr__(self):
+        return f"Operation({self.opcode}, offset={self.offset}, attr={self.attr!r})"
+
+
+class ApplyBody:
+    """The body of one ``stencil.apply``.
+
+    Parameters
+    ----------
+    num_args : int
+        Number of block arguments.
+    ops : list of Operation
+        Operations in a valid (topological) order.
+    results : list of Operation
+        The values passed to ``stencil.store_result``, in return order.
+    result_types : list of str, optional
+        Element type of each result, defaults to the type of the value.
+    args : list of Argument, optional
+        The block arguments referenced by ``ops``, created when omitted.
+    """
+
+    def __init__(self, num_args, ops, results, result_types=None, args=None):
+        self.args = list(args) if args is not None else [Argument(i) for i in range(num_args)]
+        self.ops = list(ops)
+        self.results = list(results)
+        if result_types is None:
+            result_types = [op.result_type for op in self.results]
+        self.result_types = list(result_types)
+        self._users = None
+
+    @property
+    def num_args(self):
+        return len(self.args)
+
+    @property
+    def users(self):
+        """Def-use index mapping every value to the operations reading it."""
+        if self._users is None:
+            users = {value: [] for value in self.args + self.ops}
+            for op in self.ops:
+                for operand in op.operands:
+                    users[operand].append(op)
+            self._users = users
+        return self._users
+
+    def accesses(self, arg_index=None):
+        """All ``stencil.access`` operations, optionally of a single argument."""
+        return [
+            op
+            for op in self.ops
+            if op.is_access and (arg_index is None or op.operands[0].index == arg_index)
+        ]
+
+    def access_offsets(self):
+        """Map each argument index to the set of offsets it is read at."""
+        offsets = {i: set() for i in range(self.num_args)}
+        for op in self.accesses():
+            offsets[op.operands[0].index].add(op.offset)
+        return offsets
+
+    @classmethod
+    def from_mlir(cls, lines, arg_names):
+        """Parse the lines of an apply body.
+
+        ``scf.if`` regions are if-converted: the operations of both regions
+        are evaluated unconditionally and every result of the ``scf.if``
+        becomes a ``select`` on its condition. Stencil bodies have no side
+        effects, so the selected values are the same, and the body stays a
+        single block that fusion can inline and shift like any other. Regions
+        may yield ``stencil.store_result`` values, as ``--stencil-combine-to-ifelse``
+        emits, and the ``scf.if`` result is then returned like one. A
+        ``stencil.store_result`` without a value leaves the point unwritten,
+        which a single select can't express, and is rejected.
+
+        Parameters
+        ----------
+        lines : list of str
+            The body lines up to and including ``stencil.return``.
+        arg_names : list of str
+            Names of the block arguments, e.g. ``["%arg14", "%arg15"]``.
+        """
+        args = [Argument(i) for i in range(len(arg_names))]
+        ops = []
+        stored = {}
+        results = []
+        result_types = []
+        lines = iter(lines)
+
+        def lookup(scope, name):
+            if name not in scope:
+                raise ValueError(f"use of undefined value {name} in stencil.apply body")
+            return scope[name]
+
+        def parse_if(scope, name, count, rest):
+            # if-conversion：两个分支的 op 都提到外层按顺序计算，结果用 select 选出
+            cond = lookup(scope, rest.split()[0])
+            types = [t.strip() for t in rest[rest.find("(") + 1:rest.rfind(")")].split(",")]
+            then_values = parse_block(dict(scope))
+            if next(lines).strip() != "} else {":
+                raise ValueError(f"scf.if {name} without an else region")
+            else_values = parse_block(dict(scope))
+            for k, (a, b) in enumerate(zip(then_values, else_values)):
+                # 分支产出 !stencil.result<T>：select 取值，结果留给 stencil.return
+                elem_type = types[k]
+                if elem_type.startswith("!stencil.result<"):
+                    elem_type = elem_type[elem_type.find("<") + 1:elem_type.rfind(">")]
+                op = Operation("select", [cond, a, b], type=elem_type)
+                ops.append(op)
+                key = f"{name}#{k}" if count else name
+                scope[key] = op
+                if elem_type != types[k]:
+                    stored[key] = (op, elem_type)
+            if next(lines).strip() != "}":
+                raise ValueError(f"scf.if {name} is not closed")
+
+        def parse_block(scope):
+            """Parse lines up to ``scf.yield``/``stencil.return``, return the yielded values."""
+            for line in lines:
+                line = line.strip()
+                if not line or line.startswith("//") or line == "}":
+                    continue
+                if line.startswith("scf.yield"):
+                    names = line[len("scf.yield"):].split(":")[0]
+                    return [lookup(scope, name) for name in names.replace(",", " ").split()]
+                if line.startswith("stencil.return"):
+                    names = line[len("stencil.return"):].split(":")[0]
+                    for name in names.replace(",", " ").split():
+                        value, elem_type = stored[name]
+                        results.append(value)
+                        result_types.append(elem_type)
+                    return None
+                match = _RESULT_RE.match(line)
+                if match is None:
+                    raise ValueError(f"cannot parse stencil.apply body line: {line}")
+                name, count, opcode, rest = match.groups()
+                if opcode == "stencil.store_result":
+                    operand = rest.split(":")[0].strip()
+                    if not operand:
+                        raise ValueError(f"{name} = stencil.store_result without a value is not supported")
+                    elem_type = rest[rest.rfind("<") + 1:rest.rfind(">")]
+                    scope[name] = lookup(scope, operand)
+                    stored[name] = (scope[name], elem_type)
+                    continue
+                if opcode == "scf.if":
+                    parse_if(scope, name, count, rest)
+                    continue
+                if opcode == "stencil.access":
+                    operand = rest.split()[0]
+                    op = Operation(
+                        opcode,
+                        [lookup(scope, operand)],
+                        offset=parse_offset(rest),
+                        type=rest.split(":", 1)[1].strip(),
+                    )
+                else:
+                    operand_text, _, type_text = rest.rpartition(":")
+                    tokens = [tok.strip() for tok in operand_text.split(",") if tok.strip()]
+                    attr = ", ".join(tok for tok in tokens if not tok.startswith("%"))
+                    operands = [lookup(scope, tok) for tok in tokens if tok.startswith("%")]
+                    op = Operation(opcode, operands, attr=attr, type=type_text.strip())
+                scope[name] = op
+                ops.append(op)
+            return None
+
+        parse_block(dict(zip(arg_names, args)))
+        return cls(len(arg_names), ops, results, result_types, args)
+
+    def to_mlir(self, args_base=0):
+        """Emit the body as MLIR lines, naming values ``%var_N``/``%cst_N``."""
+        names = {arg: f"%arg{args_base + arg.index}" for arg in self.args}
+        lines = []
+        var_idx = cst_idx = 0
+        for op in self.ops:
+            if op.is_constant:
+                cst_idx += 1
+                name = f"%cst_{cst_idx}"
+            else:
+                var_idx += 1
+                name = f"%var_{var_idx}"
+            names[op] = name
+            operands = [names[v] for v in op.operands]
+            if op.is_access:
+                lines.append(
+                    f"{name} = {op.opcode} {operands[0]} {format_offset(op.offset)} : {op.type}"
+                )
+            else:
+                operand_text = ", ".join(([op.attr] if op.attr else []) + operands)
+                lines.append(f"{name} = {op.opcode} {operand_text} : {op.type}")
+        stored = []
+        for value, elem_type in zip(self.results, self.result_types):
+            var_idx += 1
+            name = f"%var_{var_idx}"
+            lines.append(
+                f"{name} = stencil.store_result {names[value]} : ({elem_type}) -> "
+                f"!stencil.result<{elem_type}>"
+            )
+            stored.append(name)
+        ret_types = ", ".join(f"!stencil.result<{t}>" for t in self.result_types)
+        lines.append(f"stencil.return {', '.join(stored)} : {ret_types}")
+        return lines
+
+
+def fuse_applies(bodies, bindings, outputs, num_args):
+    """Fuse several apply bodies into one.
+
+    Accesses to a temp produced inside the group are replaced by the producer's
+    computation evaluated at the accessed offset, recursively. Every
+    ``(operation, shift)`` pair is cloned at most once and only values reachable
+    from ``outputs`` are emitted.
+
+    Parameters
+    ----------
+    bodies : list of ApplyBody
+        The bodies of the grouped stencils.
+    bindings : list of list
+        ``bindings[i][a]`` describes argument ``a`` of body ``i``: either
+        ``("arg", j)`` for argument ``j`` of the fused apply or
+        ``("result", k, r)`` for result ``r`` of body ``k``.
+    outputs : list of tuple
+        ``(k, r)`` pairs selecting the results of the fused apply.
+    num_args : int
+        Number of arguments of the fused apply.
+    """
+    owner = {}
+    for idx, body in enumerate(bodies):
+        for op in body.ops:
+            owner[op] = idx
+    fused = ApplyBody(num_args, [], [])
+    memo = {}
+
+    def key(op, shift):
+        return (op, None) if op.is_constant else (op, shift)
+
+    def dependencies(op, shift):
+        if op.is_access:
+            binding = bindings[owner[op]][op.operands[0].index]
+            if binding[0] == "result":
+                _, k, r = binding
+                return [(bodies[k].results[r], shift_offset(op.offset, shift))]
+            return []
+        for operand in op.operands:
+            if isinstance(operand, Argument):
+                raise ValueError(f"{op.opcode} reads a stencil.apply argument directly")
+        return [(operand, shift) for operand in op.operands]
+
+    def emit(op, shift):
+        if op.is_access:
+            binding = bindings[owner[op]][op.operands[0].index]
+            if binding[0] == "result":
+                _, k, r = binding
+                return memo[key(bodies[k].results[r], shift_offset(op.offset, shift))]
+            new_op = Operation(
+                op.opcode,
+                [fused.args[binding[1]]],
+                offset=shift_offset(op.offset, shift),
+                type=op.type,
+            )
+        else:
+            new_op = Operation(
+                op.opcode,
+                [memo[key(operand, shift)] for operand in op.operands],
+                attr=op.attr,
+                type=op.type,
+            )
+        fused.ops.append(new_op)
+        return new_op
+
+    def materialize(root, shift):
+        stack = [(root, shift)]
+        while stack:
+            op, s = stack[-1]
+            if key(op, s) in memo:
+                stack.pop()
+                continue
+            missing = [dep for dep in dependencies(op, s) if key(*dep) not in memo]
+            if missing:
+                stack.extend(missing)
+                continue
+            stack.pop()
+            memo[key(op, s)] = emit(op, s)
+        return memo[key(root, shift)]
+
+    for k, r in outputs:
+        zero = _zero_shift(bodies[k])
+        fused.results.append(materialize(bodies[k].results[r], zero))
+        fused.result_types.append(bodies[k].result_types[r])
+    return eliminate_common_subexpressions(fused)
+
+
+_COMMUTATIVE = {"addf", "mulf", "maxf", "minf", "and", "or", "addi", "muli"}
+
+
+def eliminate_common_subexpressions(body):
+    """Value numbering over ``body``: equal operations on equal values are
+    computed once and operations no result depends on are dropped.
+
+    Producer copies inlined at different offsets often share sub-expressions,
+    e.g. an access of the same input at the same resulting offset, and so do
+    stencils fused side by side; both collapse to a single value here. Operands
+    of commutative operations are compared as a set, which is exact in
+    floating point.
+    """
+    number = {arg: arg.index for arg in body.args}
+    table = {}
+    new_of = {}
+    ops = []
+    for op in body.ops:
+        operands = [new_of.get(operand, operand) for operand in op.operands]
+        numbers = [number[operand] for operand in operands]
+        if op.opcode in _COMMUTATIVE:
+            numbers.sort()
+        key = (op.opcode, tuple(numbers), op.offset, op.attr, op.type)
+        if key in table:
+            new_of[op] = table[key]
+            continue
+        new_op = op
+        if operands != list(op.operands):
+            new_op = Operation(op.opcode, operands, offset=op.offset, attr=op.attr, type=op.type)
+        new_of[op] = new_op
+        table[key] = new_op
+        number[new_op] = len(number)
+        ops.append(new_op)
+    results = [new_of.get(result, result) for result in body.results]
+
+    live = set(results)
+    for op in reversed(ops):
+        if op in live:
+            live.update(op.operands)
+    ops = [op for op in ops if op in live]
+    return ApplyBody(body.num_args, ops, results, body.result_types, body.args)
+
+
+def access_extents(body):
+    """The ``(min_offset, max_offset)`` box each argument is read at, None if unread."""
+    extents = []
+    for offsets in body.access_offsets().values():
+        if not offsets:
+            extents.append(None)
+            continue
+        rank = len(next(iter(offsets)))
+        extents.append(
+            (
+                tuple(min(o[d] for o in offsets) for d in range(rank)),
+                tuple(max(o[d] for o in offsets) for d in range(rank)),
+            )
+        )
+    return extents
+
+
+def infer_bounds(applies, stores):
+    """Compute the iteration bounds of every apply, like ``--stencil-shape-inference``.
+
+    An apply has to compute the union of the stored regions of its results
+    and of every region its consumers read, i.e. their bounds widened by the
+    consumer's access extents. An apply whose results are neither stored nor
+    read by another apply computes nothing that is used and gets no bounds.
+
+    Parameters
+    ----------
+    applies : list of tuple
+        ``(key, extents, operands)`` in program order, with ``extents`` as
+        returned by ``access_extents`` and ``operands[j]`` the key of the apply
+        producing argument ``j`` (None for loaded fields).
+    stores : list of tuple
+        ``(key, lb, ub)`` of every stored result.
+
+    Returns
+    -------
+    bounds : dict
+        Maps the key of every used apply and stored result to its ``(lb, ub)``.
+    """
+    required = {}
+
+    def require(key, lb, ub):
+        if key in required:
+            old_lb, old_ub = required[key]
+            lb = tuple(map(min, old_lb, lb))
+            ub = tuple(map(max, old_ub, ub))
+        required[key] = (lb, ub)
+
+    for key, lb, ub in stores:
+        require(key, tuple(lb), tuple(ub))
+    for key, extents, operands in reversed(applies):
+        # 结果没人用的 apply 不需要计算
+        if key not in required:
+            continue
+        lb, ub = required[key]
+        for producer, extent in zip(operands, extents):
+            if producer is None or extent is None:
+                continue
+            require(producer, shift_offset(lb, extent[0]), shift_offset(ub, extent[1]))
+    return required
+
+
+def format_bounds(lb, ub):
+    return f"({format_offset(lb)} : {format_offset(ub)})"
+
+
+def _zero_shift(body):
+    for op in body.accesses():
+        return (0,) * len(op.offset)
+    return (0, 0, 0)
+
+
+_BOUNDS_RE = re.compile(r"\(\[([-\d,\s]*)\]\s*:\s*\[([-\d,\s]*)\]\)")
+
+
+def parse_bounds(text):
+    """Parse ``([lb] : [ub])`` into two tuples of ints."""
+    match = _BOUNDS_RE.search(text)
+    if match is None:
+        raise ValueError(f"no bounds found in: {text}")
+    lb, ub = (tuple(int(v) for v in g.split(",") if v.strip()) for g in match.groups())
+    return lb, ub
+
+
+_FIELD_RE = re.compile(r"!stencil\.field<((?:\d+x)+)(\w+)>")
+_SIZED_OP_RE = re.compile(r"\bstencil\.(cast|load|store)\s")
+
+
+def resize_mlir(code, mesh_size, halo_width):
+    """The MLIR lines of ``code`` on a ``mesh_size`` cube with ``halo_width`` wide fields.
+
+    Like ``StencilProgram.resized``, the casts span the halo and the stores the
+    domain; the sized field types follow. Applies don't depend on the size.
+    """
+    extent = mesh_size + 2 * halo_width
+
+    def field(match):
+        dims = match.group(1).count("x")
+        return f"!stencil.field<{f'{extent}x' * dims}{match.group(2)}>"
+
+    resized = []
+    for line in code:
+        match = _SIZED_OP_RE.search(line)
+        if match is not None:
+            if match.group(1) != "load":
+                lb, _ = parse_bounds(line)
+                if match.group(1) == "cast":
+                    bounds = format_bounds((-halo_width,) * len(lb), (mesh_size + halo_width,) * len(lb))
+                else:
+                    bounds = format_bounds((0,) * len(lb), (mesh_size,) * len(lb))
+                line = _BOUNDS_RE.sub(bounds, line, count=1)
+            line = _FIELD_RE.sub(field, line)
+        resized.append(line)
+    return resized
+
+
+_F64_RE = re.compile(r"(?<=[x(\s<])f64\b")
+
+
+def retype_mlir(code, dtype="f32", keep_f64=()):
+    """The MLIR lines of ``code`` with fields, temps and arithmetic in ``dtype``.
+
+    Applies whose tag is in ``keep_f64`` (``True`` for all of them) keep
+    computing in f64 on the narrower temps: their accesses are extended with
+    ``fpext`` and their results truncated with ``fptrunc`` before being
+    stored, so long accumulations don't lose precision in between.
+    """
+    if dtype == "f64":
+        return list(code)
+    retyped = []
+    keep = False
+    in_apply = returned = False
+    for line in code:
+        if "stencil.apply" in line:
+            in_apply, returned = True, False
+            keep = keep_f64 is True or line.split()[0].split(":")[0] in keep_f64
+            retyped.append(_F64_RE.sub(dtype, line))
+            continue
+        if not in_apply or not keep:
+            if in_apply and "stencil.return" in line:
+                returned = True
+            elif in_apply and returned and line.strip() == "}":
+                in_apply = False
+            retyped.append(_F64_RE.sub(dtype, line))
+            continue
+        indent = line[:len(line) - len(line.lstrip())]
+        match = _RESULT_RE.match(line.strip())
+        if match is not None and match.group(3) == "stencil.access":
+            name = match.group(1)
+            retyped.append(indent + _F64_RE.sub(dtype, line.strip().replace(name, f"{name}_{dtype}", 1)))
+            retyped.append(f"{indent}{name} = fpext {name}_{dtype} : {dtype} to f64")
+        elif match is not None and match.group(3) == "stencil.store_result":
+            name, operand = match.group(1), match.group(4).split(":")[0].strip()
+            retyped.append(f"{indent}{name}_{dtype} = fptrunc {operand} : f64 to {dtype}")
+            retyped.append(f"{indent}{name} = stencil.store_result {name}_{dtype} : ({dtype}) -> !stencil.result<{dtype}>")
+        elif "stencil.return" in line:
+            returned = True
+            retyped.append(_F64_RE.sub(dtype, line))
+        else:
+            if returned and line.strip() == "}":
+                in_apply = False
+            retyped.append(line)
+    return retyped
+
+
+class StencilApply:
+    """A ``stencil.apply`` of a program.
+
+    ``tag`` is its MLIR name (``%24``), ``results`` the names of the produced
+    temps (``%24`` or ``%24#0``, ``%24#1`` ...) and ``operands`` the temps
+    bound to the block arguments.
+    """
+
+    def __init__(self, tag, results, operands, body):
+        self.tag = tag
+        self.results = results
+        self.operands = operands
+        self.body = body
+
+    def __repr__(self):
+        return f"StencilApply({self.tag}, operands={self.operands})"
+
+
+class StencilProgram:
+    """The stencil program of an MLIR file, parsed without TVM.
+
+    Attributes
+    ----------
+    name : str
+        Name of the ``stencil.program`` function.
+    args : list of str
+        Function arguments (fields).
+    casts : dict
+        Field value name to ``(arg, lb, ub)``.
+    loads : dict
+        Loaded temp name to field value name.
+    applies : list of StencilApply
+        Applies in program order.
+    stores : list of tuple
+        ``(temp, field, lb, ub)`` of every ``stencil.store``.
+    """
+
+    def __init__(self):
+        self.name = ""
+        self.args = []
+        self.casts = {}
+        self.loads = {}
+        self.applies = []
+        self.stores = []
+        self.producer = {}
+
+    @classmethod
+    def from_mlir(cls, code):
+        """Parse a program from an iterable of MLIR lines."""
+        program = cls()
+        lines = iter(code)
+        for line in lines:
+            line = line.strip()
+            if "stencil.program" in line:
+                program.name = re.search(r"@([\w.$-]+)", line).group(1)
+                program.args = re.findall(r"(%[\w.$-]+)\s*:\s*!stencil\.field", line)
+            elif "stencil.cast" in line:
+                name, _, rest = line.partition("=")
+                arg = rest.split()[1].split("(")[0]
+                program.casts[name.strip()] = (arg,) + parse_bounds(rest)
+            elif "stencil.load" in line:
+                name, _, rest = line.partition("=")
+                program.loads[name.strip()] = rest.split()[1]
+            elif "stencil.apply" in line:
+                program._parse_apply(line, lines)
+            elif "stencil.store" in line:
+                tokens = line.split()
+                field = tokens[3].split("(")[0]
+                program.stores.append((tokens[1], field) + parse_bounds(line))
+        return program
+
+    def _parse_apply(self, line, lines):
+        tag = line.split()[0]
+        if ":" in tag:
+            tag, num = tag.split(":")
+            results = [f"{tag}#{i}" for i in range(int(num))]
+        else:
+            results = [tag]
+        bindings = line[line.find("(") + 1:line.find(")")].split(", ")
+        arg_names = [binding.split()[0] for binding in bindings]
+        operands = [binding.split()[2] for binding in bindings]
+        body = []
+        for body_line in lines:
+            body.append(body_line)
+            if "stencil.return" in body_line:
+                break
+        apply = StencilApply(tag, results, operands, ApplyBody.from_mlir(body, arg_names))
+        for index, result in enumerate(results):
+            self.producer[result] = (apply, index)
+        self.applies.append(apply)
+
+    def with_applies(self, applies):
+        """A program with the same fields and stores but other applies."""
+        program = StencilProgram()
+        program.name = self.name
+        program.args = list(self.args)
+        program.casts = dict(self.casts)
+        program.loads = dict(self.loads)
+        program.stores = list(self.stores)
+        program.applies = list(applies)
+        for apply in program.applies:
+            for index, result in enumerate(apply.results):
+                program.producer[result] = (apply, index)
+        return program
+
+    def resized(self, mesh_size, halo_width):
+        """The program on a ``mesh_size`` cube with ``halo_width`` wide fields."""
+        program = self.with_applies(self.applies)
+        for name, (arg, lb, _) in self.casts.items():
+            program.casts[name] = (arg, (-halo_width,) * len(lb), (mesh_size + halo_width,) * len(lb))
+        program.stores = [
+            (temp, field, (0,) * len(lb), (mesh_size,) * len(lb))
+            for temp, field, lb, _ in self.stores
+        ]
+        return program
+
+    def apply(self, tag):
+        for apply in self.applies:
+            if apply.tag == tag:
+                return apply
+        raise KeyError(tag)
+
+    def consumers(self):
+        """Map every temp to the applies reading it."""
+        users = {}
+        for apply in self.applies:
+            for operand in apply.operands:
+                users.setdefault(operand, []).append(apply)
+        return users
+
+    def infer_bounds(self):
+        """Bounds of every apply, keyed by its tag."""
+        applies = []
+        for apply in self.applies:
+            operands = [
+                self.producer[operand][0].tag if operand in self.producer else None
+                for operand in apply.operands
+            ]
+            applies.append((apply.tag, access_extents(apply.body), operands))
+        stores = [(self.producer[temp][0].tag, lb, ub) for temp, _, lb, ub in self.stores]
+        return infer_bounds(applies, stores)
+
+    def group_body(self, tags):
+        """Fuse the applies named by ``tags`` like the code generator does.
+
+        Returns the fused body, the external temps bound to its arguments and
+        the temps it returns: results read outside the group or stored.
+        """
+        group = [apply for apply in self.applies if apply.tag in tags]
+        position = {apply.tag: k for k, apply in enumerate(group)}
+        users = self.consumers()
+        stored = {store[0] for store in self.stores}
+        inputs = []
+        bindings = []
+        for apply in group:
+            binding = []
+            for operand in apply.operands:
+                producer = self.producer.get(operand)
+                if producer is not None and producer[0].tag in position:
+                    binding.append(("result", position[producer[0].tag], producer[1]))
+                else:
+                    if operand not in inputs:
+                        inputs.append(operand)
+                    binding.append(("arg", inputs.index(operand)))
+            bindings.append(binding)
+        outputs = []
+        results = []
+        for k, apply in enumerate(group):
+            for r, result in enumerate(apply.results):
+                external = any(user.tag not in position for user in users.get(result, []))
+                if external or result in stored:
+                    outputs.append((k, r))
+                    results.append(result)
+        if not outputs:
+            outputs = [(len(group) - 1, r) for r in range(len(group[-1].results))]
+            results = list(group[-1].results)
+        if len(group) == 1:
+            body = group[0].body
+            return body, list(group[0].operands), list(group[0].results)
+        return fuse_applies([a.body for a in group], bindings, outputs, len(inputs)), inputs, results
@@ -0,0 +1,144 @@
+"""Outputs of generated stencil programs and their comparison.
+
+A host program generated with ``output_on`` writes, for every output grid,
+its interior points as ``<name>.npy`` or only their checksums as
+``<name>.checksum.json`` to ``STENCIL_OUTPUT_DIR``. ``compare_outputs``
+checks the outputs of two runs, e.g. a fused plan against the baseline,
+memory-mapping the arrays and streaming over them plane by plane, so large
+meshes are compared without loading them.
+
+    python -m tvm.relay.transform.stencil_outputs outputs-baseline outputs-step-3
+"""
+import argparse
+import json
+import math
+import os
+import sys
+
+import numpy as np
+
+
+NPY = ".npy"
+CHECKSUM = ".checksum.json"
+# 每次比较的元素数上限，内存占用与网格大小无关
+CHUNK = 1 << 22
+
+
+def list_outputs(directory):
+    """``{name: path}`` of the outputs written to ``directory``."""
+    outputs = {}
+    for file in sorted(os.listdir(directory)):
+        for ext in (NPY, CHECKSUM):
+            if file.endswith(ext):
+                outputs[file[:-len(ext)]] = os.path.join(directory, file)
+    return outputs
+
+
+def checksum(data):
+    """The checksums a host program writes for ``data``."""
+    total = sum_abs = sum_sq = max_abs = 0.0
+    nan = 0
+    rows = max(CHUNK // max(int(np.prod(data.shape[1:])), 1), 1)
+    for start in range(0, data.shape[0], rows):
+        chunk = np.asarray(data[start:start + rows], dtype=np.float64)
+        mask = np.isnan(chunk)
+        nan += int(mask.sum())
+        chunk = np.where(mask, 0.0, chunk)
+        total += float(chunk.sum())
+        sum_abs += float(np.abs(chunk).sum())
+        sum_sq += float(np.square(chunk).sum())
+        max_abs = max(max_abs, float(np.abs(chunk).max(initial=0.0)))
+    return {"shape": list(data.shape), "sum": total, "sum_abs": sum_abs, "l2": math.sqrt(sum_sq), "max_abs": max_abs, "nan": nan}
+
+
+def load_output(path):
+    """A memory-mapped array for ``.npy`` outputs, the checksum dict otherwise."""
+    if path.endswith(NPY):
+        return np.load(path, mmap_mode="r")
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def compare_arrays(expected, actual, rtol, atol):
+    """Max absolute and relative error of ``actual``, and the mismatching points."""
+    if expected.shape != actual.shape:
+        return {"ok": False, "error": f"shape {actual.shape} != {expected.shape}"}
+    max_abs = max_rel = 0.0
+    mismatches = 0
+    first = None
+    rows = max(CHUNK // max(int(np.prod(expected.shape[1:])), 1), 1)
+    for start in range(0, expected.shape[0], rows):
+        e = np.asarray(expected[start:start + rows], dtype=np.float64)
+        a = np.asarray(actual[start:start + rows], dtype=np.float64)
+        both_nan = np.isnan(e) & np.isnan(a)
+        diff = np.where(both_nan, 0.0, np.abs(a - e))
+        diff = np.where(np.isnan(diff), np.inf, diff)
+        # 期望值为 NaN 时容差也是 NaN，比较恒为假，只有一边是 NaN 的点单独算作不一致
+        bad = (diff > atol + rtol * np.abs(e)) | (np.isnan(e) != np.isnan(a))
+        if diff.size:
+            max_abs = max(max_abs, float(diff.max()))
+            with np.errstate(divide="ignore", invalid="ignore"):
+                rel = np.where(diff == 0, 0.0, diff / np.abs(e))
+            max_rel = max(max_rel, float(np.where(np.isnan(rel), np.inf, rel).max()))
+        count = int(bad.sum())
+        if count and first is None:
+            index = np.unravel_index(int(np.argmax(bad)), bad.shape)
+            first = [start + int(index[0])] + [int(i) for i in index[1:]]
+        mismatches += count
+    report = {"ok": mismatches == 0, "max_abs_err": max_abs, "max_rel_err": max_rel, "mismatches": mismatches}
+    if first is not None:
+        report["first_mismatch"] = first
+    return report
+
+
+def compare_checksums(expected, actual, rtol, atol):
+    """Compare checksums; sums are allowed the rounding of ``sum_abs``."""
+    if expected["shape"] != actual["shape"]:
+        return {"ok": False, "error": f"shape {actual['shape']} != {expected['shape']}"}
+    errors = {}
+    ok = expected["nan"] == actual["nan"]
+    for key, scale in (("sum", "sum_abs"), ("sum_abs", "sum_abs"), ("l2", "l2"), ("max_abs", "max_abs")):
+        err = abs(actual[key] - expected[key])
+        errors[key] = err
+        ok = ok and err <= atol * (1 if key == "max_abs" else math.prod(expected["shape"])) + rtol * abs(expected[scale])
+    return {"ok": ok, "errors": errors}
+
+
+def compare_outputs(expected_dir, actual_dir, rtol=1e-9, atol=0.0):
+    """Compare the outputs of two runs.
+
+    Returns ``{name: report}`` with ``report["ok"]`` telling whether the
+    output agrees within ``|actual - expected| <= atol + rtol * |expected|``
+    (NaNs agree with NaNs). A ``.npy`` output compared with a checksum is
+    reduced to its checksum first.
+    """
+    expected, actual = list_outputs(expected_dir), list_outputs(actual_dir)
+    reports = {}
+    for name in sorted(expected.keys() | actual.keys()):
+        if name not in expected or name not in actual:
+            reports[name] = {"ok": False, "error": f"missing in {expected_dir if name not in expected else actual_dir}"}
+            continue
+        e, a = load_output(expected[name]), load_output(actual[name])
+        if isinstance(e, dict) or isinstance(a, dict):
+            e = e if isinstance(e, dict) else checksum(e)
+            a = a if isinstance(a, dict) else checksum(a)
+            reports[name] = compare_checksums(e, a, rtol, atol)
+        else:
+            reports[name] = compare_arrays(e, a, rtol, atol)
+    return reports
+
+
+def mismatched(reports):
+    return [name for name, report in reports.items() if not report["ok"]]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the outputs of two stencil program runs.")
+    parser.add_argument("expected", help="directory of the reference outputs")
+    parser.add_argument("actual", help="directory of the outputs to check")
+    parser.add_argument("--rtol", type=float, default=1e-9)
+    parser.add_argument("--atol", type=float, default=0.0)
+    args = parser.parse_args()
+    reports = compare_outputs(args.expected, args.actual, args.rtol, args.atol)
+    print(json.dumps(reports, indent=1))
+    sys.exit(1 if mismatched(reports) or not reports else 0)
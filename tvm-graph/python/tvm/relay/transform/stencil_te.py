@@ -0,0 +1,169 @@
+"""TE computes of ``stencil.apply`` bodies and a CPU build path.
+
+``MLIRCodeGen.parse_apply`` registers the body of every apply in
+``stencil_register`` under the tag of its relay call, so the stencil graphs of
+the fusion search build with ``relay.build``. A compute is defined over the
+whole grid: point ``i`` evaluates the body with ``stencil.access`` at offset
+``d`` reading ``grid[i + d]``; points whose accesses leave the grid are zero,
+like the hand written hypterm computes.
+
+Fused calls become primitive functions, so every fusion group is lowered into
+a single kernel whose intermediate stages the x86 stencil schedule inlines.
+"""
+import numpy as np
+
+import tvm
+from tvm import te, relay
+from tvm.relay import ExprMutator
+from tvm.contrib import graph_executor
+from tvm.relay.op.strategy.stencil_dispatch import stencil_register
+from tvm.topi.x86.stencil import PARTITION_CONFIG
+from tvm.relay.transform.stencil_ir import access_extents
+from tvm.relay.transform.timing import Timing, REPEATS, WARMUP
+
+
+_BINARY = {
+    "addf": lambda a, b: a + b,
+    "subf": lambda a, b: a - b,
+    "mulf": lambda a, b: a * b,
+    "divf": lambda a, b: a / b,
+    "remf": tvm.tir.fmod,
+    "maxf": te.max,
+    "minf": te.min,
+    "and": tvm.tir.And,
+    "or": tvm.tir.Or,
+}
+
+_UNARY = {
+    "negf": lambda a: -a,
+    "absf": te.abs,
+    "sqrt": te.sqrt,
+    "math.sqrt": te.sqrt,
+    "exp": te.exp,
+    "math.exp": te.exp,
+}
+
+_TYPES = {"f64": "float64", "f32": "float32", "f16": "float16"}
+
+_CMPF = {
+    "oeq": tvm.tir.EQ,
+    "one": tvm.tir.NE,
+    "ogt": tvm.tir.GT,
+    "oge": tvm.tir.GE,
+    "olt": tvm.tir.LT,
+    "ole": tvm.tir.LE,
+}
+
+
+def body_expr(body, grids, index, dtype):
+    """The TE expressions of the results of ``body`` at point ``index``."""
+    values = {}
+    for op in body.ops:
+        if op.is_access:
+            grid = grids[op.operands[0].index]
+            value = grid[tuple(i + d for i, d in zip(index, op.offset))]
+        elif op.is_constant:
+            value = tvm.tir.const(float(op.attr.split(":")[0]), _TYPES.get(op.result_type, dtype))
+        else:
+            operands = [values[operand] for operand in op.operands]
+            if op.opcode in _BINARY:
+                value = _BINARY[op.opcode](*operands)
+            elif op.opcode in _UNARY:
+                value = _UNARY[op.opcode](*operands)
+            elif op.opcode == "cmpf":
+                value = _CMPF[op.attr.split(",")[0].strip().strip('"')](*operands)
+            elif op.opcode == "select":
+                value = tvm.tir.Select(*operands)
+            elif op.opcode in ("fpext", "fptrunc"):
+                value = operands[0].astype(_TYPES[op.result_type])
+            else:
+                raise NotImplementedError(f"{op.opcode} has no TE translation")
+        values[op] = value
+    return [values[value] for value in body.results]
+
+
+def body_compute(body, name="stencil"):
+    """A TOPI style compute ``f(*grids)`` evaluating ``body`` over the grid.
+
+    Returns one tensor, or a list of tensors for a multi-result body.
+    """
+    extents = [extent for extent in access_extents(body) if extent is not None]
+    lo = tuple(min(v) for v in zip(*[extent[0] for extent in extents]))
+    hi = tuple(max(v) for v in zip(*[extent[1] for extent in extents]))
+
+    def compute(*grids):
+        shape = grids[0].shape
+        dtype = grids[0].dtype
+
+        def fcompute(*index):
+            conds = []
+            for i, n, l, h in zip(index, shape, lo, hi):
+                conds += [tvm.tir.likely(i + l >= 0), tvm.tir.likely(i + h < n)]
+            results = body_expr(body, grids, index, dtype)
+            zero = tvm.tir.const(0, dtype)
+            if conds:
+                inside = te.all(*conds)
+                results = [te.if_then_else(inside, r, zero) for r in results]
+            return results if len(results) > 1 else results[0]
+
+        return te.compute(shape, fcompute, name=name)
+
+    return compute
+
+
+def register_apply(tag, body):
+    """Register the compute of ``body`` for the stencil calls tagged ``tag``."""
+    stencil_register.register_compute(tag, body_compute(body, tag))
+
+
+class MarkPrimitive(ExprMutator):
+    """Mark the functions of fused stencil calls primitive."""
+
+    def visit_call(self, call):
+        if isinstance(call.op, relay.Function) and call.op.attrs and "tag" in call.op.attrs.keys():
+            func = call.op.with_attr("Primitive", tvm.tir.IntImm("int32", 1))
+            return relay.Call(func, [self.visit(arg) for arg in call.args], call.attrs)
+        return super().visit_call(call)
+
+
+def build(mod, target="llvm", opt_level=3):
+    """``relay.build`` a stencil module, one kernel per (fused) call.
+
+    Constant loops are partitioned at the ``likely`` bounds of
+    ``body_compute``, so the interior of a kernel runs without them.
+    """
+    main = mod["main"]
+    mod = tvm.IRModule.from_expr(MarkPrimitive().visit(main))
+    mod = relay.transform.InferType()(mod)
+    with tvm.transform.PassContext(opt_level=opt_level, config=PARTITION_CONFIG):
+        return relay.build(mod, target=target)
+
+
+def random_inputs(mod, seed=0):
+    """Random values in [1, 2) for every parameter of ``main``."""
+    rng = np.random.default_rng(seed)
+    inputs = {}
+    for param in mod["main"].params:
+        ttype = param.checked_type
+        shape = [int(dim) for dim in ttype.shape]
+        inputs[param.name_hint] = rng.uniform(1.0, 2.0, shape).astype(ttype.dtype)
+    return inputs
+
+
+def benchmark(mod, target="llvm", inputs=None, repeat=REPEATS, number=5, warmup=WARMUP):
+    """Build ``mod`` for ``target`` and return its run time in ms.
+
+    The result is a ``Timing`` over the ``repeat`` means of ``number`` runs,
+    taken after ``warmup`` untimed runs.
+    """
+    lib = build(mod, target)
+    dev = tvm.device(str(target), 0)
+    module = graph_executor.GraphModule(lib["default"](dev))
+    if inputs is None:
+        inputs = random_inputs(mod)
+    module.set_input(**inputs)
+    for _ in range(warmup):
+        module.run()
+    dev.sync()
+    result = module.benchmark(dev, repeat=repeat, number=number)
+    return Timing([t * 1e3 for t in result.results], warmup)
@@ -1,4 +1,5 @@
 import copy
+import heapq
 from enum import IntEnum
 from typing import DefaultDict, List, Dict
 import tvm
@@ -7,7 +8,7 @@ from tvm.relay import ExprVisitor, Function
 from tvm.relay.expr import ExprWithOp
 from tvm.relay.expr_functor import MixedModeMutator
 from tvm.relay.op.op import OpPattern
-from tvm.relay.transform.utils import ReplaceParams, is_scalar
+from tvm.relay.transform.utils import ReplaceParams, call_args, is_scalar
 import pdb
 
 
@@ -122,7 +123,7 @@ class StreamSolver(MixedModeMutator):
         
         # pdb.set_trace()
         for node in call_list:
-            for arg in node.args:
+            for arg in call_args(node):
                 if arg in call_list:
                     # PRINTCall(arg)
                     graph[node]["input"].append(arg)
@@ -225,6 +226,117 @@ class StreamSolver(MixedModeMutator):
         return self.graph
 
 
+    def topo_order(self, graph):
+        indegree = {node: len(set(graph[node]["input"])) for node in graph}
+        order = [node for node in graph if indegree[node] == 0]
+        for node in order:
+            for succ in dict.fromkeys(graph[node]["output"]):
+                indegree[succ] -= 1
+                if indegree[succ] == 0:
+                    order.append(succ)
+        return order
+
+    def list_schedule(self, expr, cost, max_streams=4, sync_cost=0.0):
+        """HEFT-style list scheduling of the stencil calls of ``expr``.
+
+        Kernels are taken by decreasing upward rank (their cost plus the
+        longest path to an exit) and placed on the stream where they finish
+        first, paying ``sync_cost`` for every producer on another stream.
+        A stream only waits for the producers of the transitive reduction
+        that it doesn't already know to be finished, with ``wait_i`` before
+        the consumer and ``record_i`` after producer ``i``; producers never
+        block, unlike the ``sync_i`` barriers of ``solve``.
+
+        Parameters
+        ----------
+        expr : relay.Expr
+            The (fused) stencil function.
+        cost : dict or callable
+            Estimated run time of every call.
+        max_streams : int
+            Maximum number of streams.
+        sync_cost : float
+            Estimated cost of a cross-stream dependency.
+
+        Returns
+        -------
+        streamlist : list of list
+            One list of calls and ``wait_i``/``record_i`` strings per stream.
+        """
+        if not callable(cost):
+            cost = cost.__getitem__
+        graph = self.build_graph(expr)
+        self.graph = graph
+        order = self.topo_order(graph)
+        index = {node: i for i, node in enumerate(order)}
+        preds = {node: list(dict.fromkeys(graph[node]["input"])) for node in order}
+        succs = {node: list(dict.fromkeys(graph[node]["output"])) for node in order}
+        weight = {node: cost(node) for node in order}
+
+        ancestors = {}
+        for node in order:
+            ancestors[node] = set()
+            for pred in preds[node]:
+                ancestors[node] |= ancestors[pred] | {pred}
+        # 传递归约：经由其他前驱可达的边是多余的
+        reduced = {
+            node: [u for u in preds[node] if not any(u in ancestors[w] for w in preds[node] if w is not u)]
+            for node in order
+        }
+        rank = {}
+        for node in reversed(order):
+            rank[node] = weight[node] + max([rank[succ] for succ in succs[node]], default=0.0)
+
+        stream_of, finish = {}, {}
+        available = [0.0] * max_streams
+        streams = [[] for _ in range(max_streams)]
+        indegree = {node: len(preds[node]) for node in order}
+        ready = [(-rank[node], index[node]) for node in order if indegree[node] == 0]
+        heapq.heapify(ready)
+        while ready:
+            _, i = heapq.heappop(ready)
+            node = order[i]
+            best = None
+            for stream in range(max_streams):
+                start = available[stream]
+                for pred in reduced[node]:
+                    delay = 0.0 if stream_of[pred] == stream else sync_cost
+                    start = max(start, finish[pred] + delay)
+                if best is None or start + weight[node] < best[0]:
+                    best = (start + weight[node], stream)
+            finish[node], stream_of[node] = best
+            available[best[1]] = best[0]
+            streams[best[1]].append(node)
+            for succ in succs[node]:
+                indegree[succ] -= 1
+                if indegree[succ] == 0:
+                    heapq.heappush(ready, (-rank[succ], index[succ]))
+
+        # 每个 stream 记录已确定完成的 kernel，只等待其余的生产者
+        waits, recorded = {}, set()
+        for stream in streams:
+            known = set()
+            for node in stream:
+                waits[node] = []
+                for pred in reduced[node]:
+                    if pred not in known:
+                        waits[node].append(pred)
+                        recorded.add(pred)
+                        known |= ancestors[pred] | {pred}
+                known |= ancestors[node] | {node}
+        streamlist = []
+        for stream in streams:
+            if not stream:
+                continue
+            entries = []
+            for node in stream:
+                entries += [f"wait_{index[pred]}" for pred in waits[node]]
+                entries.append(node)
+                if node in recorded:
+                    entries.append(f"record_{index[node]}")
+            streamlist.append(entries)
+        return streamlist
+
     def solve(self, expr):
         graph = self.build_graph(expr)
         self.graph = graph
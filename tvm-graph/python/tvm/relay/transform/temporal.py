@@ -0,0 +1,186 @@
+"""Unrolling of iterative stencil programs over timesteps.
+
+An iterative program is run many times with some of its stored fields fed
+back as loaded fields of the next run. ``unroll_timesteps`` rewrites the MLIR
+of one run into ``steps`` chained runs: the loads of a fed back field read the
+temp stored to it by the previous step, and only the last step stores. The
+fusion search then sees the whole chain, so it can fuse (and with shape
+inference recompute on widened bounds) across timestep boundaries.
+
+The fields read by the first step have to be wide enough for the bounds of all
+steps; ``required_halo`` gives the halo the unrolled program needs.
+
+The unrolled program is not the looped one near the boundary. A later step
+reads the earlier step's temps around the store box, which the unrolled
+program recomputes from the wider inputs, while a looped run with swapped
+buffers reads whatever the fed back fields hold there, values no step writes.
+The two agree bit for bit except within ``required_halo(program) * (steps -
+1)`` points of the store box boundary, and in the halos of the fields.
+"""
+import re
+
+from tvm.relay.transform.stencil_ir import StencilProgram, access_extents
+
+
+_VALUE_RE = re.compile(r"%(\d+)\b")
+
+
+def _strip(name):
+    return name.strip().lstrip("%")
+
+
+def default_feedback(program):
+    """Pair the i-th stored field with the i-th loaded field, by argument name."""
+    loaded = []
+    for field in program.loads.values():
+        arg = program.casts[field][0]
+        if arg not in loaded:
+            loaded.append(arg)
+    stored = [program.casts[field][0] for _, field, _, _ in program.stores]
+    return {_strip(out): _strip(arg) for out, arg in zip(stored, loaded)}
+
+
+def required_halo(program):
+    """The widest halo the applies of ``program`` read its loaded fields at."""
+    bounds = program.infer_bounds()
+    mesh = tuple(max(v) for v in zip(*[ub for _, _, _, ub in program.stores]))
+    halo = 0
+    for apply in program.applies:
+        if apply.tag not in bounds:
+            continue
+        lb, ub = bounds[apply.tag]
+        for operand, extent in zip(apply.operands, access_extents(apply.body)):
+            if operand not in program.loads or extent is None:
+                continue
+            for d, n in enumerate(mesh):
+                halo = max(halo, -(lb[d] + extent[0][d]), ub[d] + extent[1][d] - n)
+    return halo
+
+
+def _split(code):
+    """Split the lines of a program into head, applies, stores and tail."""
+    head, applies, stores, tail = [], [], [], []
+    lines = iter(code)
+    for line in lines:
+        if "stencil.apply" in line:
+            block = [line]
+            for body_line in lines:
+                block.append(body_line)
+                if "stencil.return" in body_line:
+                    break
+            for body_line in lines:
+                block.append(body_line)
+                if body_line.strip() == "}":
+                    break
+            applies.append(block)
+        elif "stencil.store" in line:
+            stores.append(line)
+        elif applies or stores:
+            tail.append(line)
+        else:
+            head.append(line)
+    return head, applies, stores, tail
+
+
+def _apply_tag(block):
+    return block[0].split("=")[0].strip().split(":")[0]
+
+
+def _rename_operands(header, env):
+    """Rename the temps bound in an apply header, keeping the ``#k`` suffixes."""
+    start, end = header.find("("), header.find(")")
+    bindings = header[start + 1:end].split(", ")
+    renamed = []
+    for binding in bindings:
+        name, _, rest = binding.partition(" = ")
+        value, _, ty = rest.partition(" :")
+        base, sep, index = value.partition("#")
+        renamed.append(f"{name} = {env.get(base, base)}{sep}{index} :{ty}")
+    return header[:start + 1] + ", ".join(renamed) + header[end:]
+
+
+def unroll_timesteps(code, steps, feedback=None):
+    """The MLIR lines of ``steps`` chained runs of the program in ``code``.
+
+    Parameters
+    ----------
+    code : list of str
+        MLIR lines of a ``stencil.program``.
+    steps : int
+        Number of timesteps.
+    feedback : dict, optional
+        Stored field argument to the loaded field argument it feeds, e.g.
+        ``{"arg10": "arg0"}``. Defaults to ``default_feedback``.
+
+    Returns
+    -------
+    code : list of str
+        The unrolled program. Applies of early steps whose results the
+        later steps don't read are dropped.
+    """
+    if steps <= 1:
+        return list(code)
+    program = StencilProgram.from_mlir(code)
+    feedback = {_strip(k): _strip(v) for k, v in (feedback or default_feedback(program)).items()}
+    arg_of = {field: _strip(arg) for field, (arg, _, _) in program.casts.items()}
+    loads_of = {}
+    for temp, field in program.loads.items():
+        loads_of.setdefault(arg_of[field], []).append(temp)
+    for out, arg in feedback.items():
+        if arg not in loads_of:
+            raise ValueError(f"{arg} is not a loaded field of {program.name}")
+        if out not in {arg_of[field] for _, field, _, _ in program.stores}:
+            raise ValueError(f"{out} is not a stored field of {program.name}")
+
+    head, applies, stores, tail = _split(code)
+    next_id = max(int(v) for line in code for v in _VALUE_RE.findall(line)) + 1
+    blocks = []
+    env = {}
+
+    def renamed(temp):
+        base, sep, index = temp.partition("#")
+        return env.get(base, base) + sep + index
+
+    for step in range(steps):
+        if step > 0:
+            # 上一步存到 out 的 temp 就是这一步对应输入的 load
+            fed = {}
+            for temp, field, _, _ in program.stores:
+                if arg_of[field] in feedback:
+                    for load in loads_of[feedback[arg_of[field]]]:
+                        fed[load] = renamed(temp)
+            env = fed
+        for block in applies:
+            tag = _apply_tag(block)
+            header = block[0]
+            if step > 0:
+                new_tag = f"%{next_id}"
+                next_id += 1
+                header = _rename_operands(header, env)
+                header = header.replace(tag, new_tag, 1)
+                env[tag] = new_tag
+            blocks.append([header] + block[1:])
+
+    final_stores = []
+    for line in stores:
+        temp = line.split()[1]
+        final_stores.append(line.replace(temp, renamed(temp), 1))
+
+    # 删除后面的时间步不再使用的 apply
+    live = {line.split()[1].split("#")[0] for line in final_stores}
+    kept = []
+    for block in reversed(blocks):
+        if _apply_tag(block) not in live:
+            continue
+        kept.append(block)
+        header = block[0]
+        for binding in header[header.find("(") + 1:header.find(")")].split(", "):
+            live.add(binding.partition(" = ")[2].split()[0].split("#")[0])
+    kept.reverse()
+
+    unrolled = head + [line for block in kept for line in block] + final_stores + tail
+    halo = required_halo(StencilProgram.from_mlir(unrolled))
+    available = min(-min(lb) for _, lb, _ in program.casts.values())
+    if halo > available:
+        raise ValueError(f"{steps} timesteps of {program.name} read {halo} halo points, the fields have {available}")
+    return unrolled
@@ -0,0 +1,222 @@
+"""Per-kernel tile sizes of the oec-opt lowering.
+
+``compile_object`` tiles the parallel loops of every kernel with
+``--parallel-loop-tiling`` (128x1x1 on the GPU). ``TileTuner`` searches the
+tile sizes of each kernel of a generated program, measuring candidates with a
+pluggable runner, and keeps the best ones in a ``TuningDatabase`` under the
+hash of the kernel's MLIR. ``MLIRCodeGen`` looks every kernel up there before
+it evaluates a program, so a kernel tuned once, at this mesh size, is lowered
+with its tile sizes whenever it comes back, in this search or a later one.
+
+    python -m tvm.relay.transform.tile_tuner 128-8-prog-3 128-8-prog-3.cu stencil_1.mlir stencil_2.mlir
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+
+from tvm.relay.transform.run import DEFAULT_TILE_SIZES, CompileError, Evaluate, normalize_mlir
+from tvm.relay.transform.stencil_ir import parse_bounds
+from tvm.relay.transform.timing import faster
+
+
+TUNING_DB = os.environ.get(
+    "STENCIL_TUNING_DB", os.path.join(os.path.expanduser("~"), ".cache", "stencil-compile", "tile-sizes.json")
+)
+# GPU 每个 block 最多的线程数
+MAX_THREADS = 1024
+
+_FUNC_RE = re.compile(r"func @[\w.$-]+\(")
+
+
+def kernel_hash(code, target):
+    """Hash of a kernel's MLIR, independent of the kernel's name."""
+    h = hashlib.sha256()
+    h.update(target.encode())
+    h.update(_FUNC_RE.sub("func @kernel(", normalize_mlir(code), count=1).encode())
+    return h.hexdigest()
+
+
+def domain(code):
+    """The (i, j, k) extents a kernel stores, the largest of its stores."""
+    extents = [1, 1, 1]
+    for line in code.splitlines():
+        if "stencil.store " in line:
+            lb, ub = parse_bounds(line)
+            extents = [max(e, u - l) for e, l, u in zip(extents, lb, ub)]
+    return tuple(extents)
+
+
+def candidates(extents, target="cuda"):
+    """Tile sizes to try for a kernel storing ``extents``.
+
+    On the GPU the first tile size is the thread block width along the
+    unit-stride axis and the second stacks rows, up to ``MAX_THREADS``
+    threads; on the CPU tiles of rows and planes block the loops for cache,
+    ``None`` leaving them untiled. The pipeline default comes first.
+    """
+    i, j, k = extents
+    if target == "cpu":
+        tiles = [None]
+        for y in (4, 16, 64):
+            for z in (1, 4):
+                if y <= j and z <= k:
+                    tiles.append((i, y, z))
+        return tiles
+    tiles = [DEFAULT_TILE_SIZES]
+    for x in (32, 64, 128, 256, 512):
+        for y in (1, 2, 4, 8):
+            if x * y > MAX_THREADS or (y > 1 and y > j) or (x > 32 and x // 2 >= i):
+                continue
+            if (x, y, 1) not in tiles:
+                tiles.append((x, y, 1))
+    return tiles
+
+
+class TuningDatabase:
+    """Best tile sizes per kernel hash, kept in a JSON file."""
+
+    def __init__(self, path=TUNING_DB):
+        self.path = path
+        self.records = {}
+        if path and os.path.exists(path):
+            with open(path, "r") as f:
+                self.records = json.load(f)
+
+    def get(self, code, target):
+        """The tuned tile sizes of ``code``, ``None`` for untuned kernels.
+
+        Kernels whose best tiling is the pipeline's default return ``False``.
+        """
+        record = self.records.get(kernel_hash(code, target))
+        if record is None:
+            return None
+        return tuple(record["tile_sizes"]) if record["tile_sizes"] is not None else False
+
+    def put(self, code, target, tile_sizes, timing=None):
+        self.records[kernel_hash(code, target)] = {
+            "target": target,
+            "tile_sizes": list(tile_sizes) if tile_sizes else None,
+            "domain": list(domain(code)),
+            "time": float(timing) if timing is not None else None,
+        }
+
+    def tile_sizes(self, cwd, mlir_list, target):
+        """``Evaluate`` tile sizes of the tuned kernels among ``mlir_list``."""
+        tuned = {}
+        for mlir in mlir_list:
+            with open(os.path.join(cwd, mlir), "r") as f:
+                tile_sizes = self.get(f.read(), target)
+            if tile_sizes:
+                tuned[mlir[:-5]] = tile_sizes
+        return tuned
+
+    def save(self):
+        # 先写临时文件再改名，并发的搜索不会读到半个文件
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".json")
+        with os.fdopen(fd, "w") as f:
+            json.dump(self.records, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+
+
+class Runner:
+    """Measures a generated program with the given per-kernel tile sizes.
+
+    ``runner(cwd, main_name, mlir_list, tile_sizes)`` returns a ``Timing``
+    or raises ``CompileError``/``RuntimeError`` for a candidate that doesn't
+    build or run. This one builds and runs the program with ``Evaluate`` in a
+    scratch copy of ``cwd``, leaving the files there untouched.
+    """
+
+    target = "cuda"
+
+    def __init__(self, **evaluate_options):
+        self.evaluate_options = evaluate_options
+
+    def __call__(self, cwd, main_name, mlir_list, tile_sizes):
+        with tempfile.TemporaryDirectory(dir=cwd) as tmp:
+            for file in [main_name, "util.h"] + list(mlir_list):
+                if os.path.exists(os.path.join(cwd, file)):
+                    shutil.copy(os.path.join(cwd, file), tmp)
+            evaluate = Evaluate(tmp, main_name, list(mlir_list), target=self.target, tile_sizes=tile_sizes,
+                                **self.evaluate_options)
+            return evaluate.evaluate()
+
+
+class CudaRunner(Runner):
+    target = "cuda"
+
+
+class CpuRunner(Runner):
+    """Runs ``CpuGenMain`` programs, kernels lowered by the CPU pipeline."""
+
+    target = "cpu"
+
+
+def runner_for(target, **evaluate_options):
+    return CpuRunner(**evaluate_options) if target == "cpu" else CudaRunner(**evaluate_options)
+
+
+class TileTuner:
+    """Coordinate descent over the tile sizes of the kernels of a program.
+
+    Kernels are tuned one after another with the others at their best tile
+    sizes so far, starting from the database or the pipeline default; a
+    candidate replaces the best only if it is ``faster``, i.e. its interval
+    is below the best one. Each kernel's result goes to the database.
+    """
+
+    def __init__(self, runner, database=None, rounds=1):
+        self.runner = runner
+        self.target = getattr(runner, "target", "cuda")
+        self.database = database if database is not None else TuningDatabase()
+        self.rounds = rounds
+        self.trials = []
+
+    def tune(self, cwd, main_name, mlir_list, kernels=None):
+        """Tune ``kernels`` (default: all) of the program; returns the tile sizes and the time."""
+        codes = {}
+        for mlir in mlir_list:
+            with open(os.path.join(cwd, mlir), "r") as f:
+                codes[mlir[:-5]] = f.read()
+        best = {name: self.database.get(code, self.target) for name, code in codes.items()}
+        best = {name: tile_sizes or None for name, tile_sizes in best.items()}
+        best_time = self.runner(cwd, main_name, mlir_list, best)
+        for _ in range(self.rounds):
+            for name in kernels or codes:
+                for tile_sizes in candidates(domain(codes[name]), self.target):
+                    if tile_sizes == best[name] or (best[name] is None and tile_sizes == DEFAULT_TILE_SIZES):
+                        continue
+                    trial = dict(best, **{name: tile_sizes})
+                    try:
+                        timing = self.runner(cwd, main_name, mlir_list, trial)
+                    except (CompileError, RuntimeError) as err:
+                        print(f"tile sizes {tile_sizes} of {name} failed: {err}")
+                        continue
+                    self.trials.append((name, tile_sizes, timing))
+                    print(f"{name} {tile_sizes}: {timing!r}")
+                    if faster(timing, best_time):
+                        best, best_time = trial, timing
+                self.database.put(codes[name], self.target, best[name], best_time)
+        self.database.save()
+        return best, best_time
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tune the tile sizes of the kernels of a generated program.")
+    parser.add_argument("cwd", help="directory with the host program, util.h and the kernels")
+    parser.add_argument("main", help="host program, .cu or .cpp")
+    parser.add_argument("kernels", nargs="+", help="kernel .mlir files")
+    parser.add_argument("--target", choices=["cuda", "cpu"], default=None, help="default: from the host program's suffix")
+    parser.add_argument("--db", default=TUNING_DB)
+    parser.add_argument("--rounds", type=int, default=1)
+    args = parser.parse_args()
+    target = args.target or ("cpu" if args.main.endswith(".cpp") else "cuda")
+    tuner = TileTuner(runner_for(target), TuningDatabase(args.db), args.rounds)
+    best, timing = tuner.tune(os.path.abspath(args.cwd), args.main, args.kernels)
+    print(json.dumps({"tile_sizes": best, "time": timing.to_dict() if hasattr(timing, "to_dict") else timing}, indent=1))
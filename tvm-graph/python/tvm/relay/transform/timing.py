@@ -0,0 +1,123 @@
+"""Robust summaries of repeated kernel timings.
+
+A host program generated by ``GenMain`` runs its timed loop ``warmup`` times
+untimed and then ``repeats`` times, writing the samples (ms) as JSON to the
+file named by ``STENCIL_TIMING_FILE``. ``Evaluate`` runs it in batches until
+the confidence interval of the median is tight enough, and returns a
+``Timing``: a float equal to the median that also carries the interval, so it
+can be stored and compared like the single numbers it replaces. Two plans
+whose intervals overlap are ties (``faster``), the search keeps the one it
+had.
+"""
+import json
+import math
+import os
+from statistics import NormalDist
+
+
+# 可用环境变量覆盖：预热次数、每批次数、最多次数、目标相对置信区间半宽
+WARMUP = int(os.environ.get("STENCIL_WARMUP", 2))
+REPEATS = int(os.environ.get("STENCIL_REPEATS", 10))
+MAX_REPEATS = int(os.environ.get("STENCIL_MAX_REPEATS", 50))
+REL_CI = float(os.environ.get("STENCIL_REL_CI", 0.02))
+CONFIDENCE = 0.95
+
+
+def median(samples):
+    ordered = sorted(samples)
+    n = len(ordered)
+    if n % 2:
+        return ordered[n // 2]
+    return (ordered[n // 2 - 1] + ordered[n // 2]) / 2
+
+
+def median_interval(samples, confidence=CONFIDENCE):
+    """Distribution-free confidence interval of the median.
+
+    The bounds are the order statistics at ranks ``n/2 -+ z*sqrt(n)/2``
+    (normal approximation of the binomial), so outliers from a preempted or
+    throttled run don't move it. Fewer than 6 samples give ``(min, max)``.
+    """
+    ordered = sorted(samples)
+    n = len(ordered)
+    if n < 6:
+        return ordered[0], ordered[-1]
+    half = NormalDist().inv_cdf((1 + confidence) / 2) * math.sqrt(n) / 2
+    low = max(int(math.floor(n / 2 - half)), 1)
+    high = min(int(math.ceil(n / 2 + half)) + 1, n)
+    return ordered[low - 1], ordered[high - 1]
+
+
+class Timing(float):
+    """The median of ``samples`` (ms), with its confidence interval."""
+
+    def __new__(cls, samples, warmup=0, confidence=CONFIDENCE):
+        if not samples:
+            raise ValueError("no timing samples")
+        timing = super().__new__(cls, median(samples))
+        timing.samples = list(samples)
+        timing.warmup = warmup
+        timing.confidence = confidence
+        timing.low, timing.high = median_interval(samples, confidence)
+        return timing
+
+    @property
+    def median(self):
+        return float(self)
+
+    @property
+    def rel_ci(self):
+        """Half width of the interval relative to the median."""
+        if self.median == 0:
+            return 0.0
+        return (self.high - self.low) / 2 / self.median
+
+    def tight(self, rel_ci=REL_CI):
+        return self.rel_ci <= rel_ci
+
+    def to_dict(self):
+        return {
+            "median": self.median,
+            "low": self.low,
+            "high": self.high,
+            "confidence": self.confidence,
+            "rel_ci": self.rel_ci,
+            "warmup": self.warmup,
+            "repeats": len(self.samples),
+            "min": min(self.samples),
+            "max": max(self.samples),
+            "mean": sum(self.samples) / len(self.samples),
+            "samples": self.samples,
+        }
+
+    def __reduce__(self):
+        return (Timing, (self.samples, self.warmup, self.confidence))
+
+    def __str__(self):
+        # performance.txt 等文本里仍写成普通的数
+        return float.__repr__(self)
+
+    def __repr__(self):
+        return f"Timing({self.median:.6g} ms, {self.confidence:.0%} CI [{self.low:.6g}, {self.high:.6g}], n={len(self.samples)})"
+
+
+def faster(a, b):
+    """Whether ``a`` is measurably faster than ``b``.
+
+    Timings are compared by their intervals: overlapping ones are within noise
+    and neither is faster. Plain numbers (predictions, the llvm backend's
+    means) compare as numbers.
+    """
+    if b is None:
+        return a is not None
+    if a is None:
+        return False
+    if isinstance(a, Timing) and isinstance(b, Timing):
+        return a.high < b.low
+    return a < b
+
+
+def read_samples(path):
+    """The samples of a ``STENCIL_TIMING_FILE`` written by the host program."""
+    with open(path, "r") as f:
+        return json.load(f)["samples"]
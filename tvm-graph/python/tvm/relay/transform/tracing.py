@@ -0,0 +1,186 @@
+"""Nested phase spans of the stencil search pipeline.
+
+``with span("phase", **attrs):`` records the wall time of a block, nested in
+the spans open around it on the same thread; ``traced`` does the same for a
+function. The phases of the pipeline are parse (``from_mlir``), scoring,
+``fusion_call2call``, ``InferType``, shape inference, ``print_code``, stream
+solve, host codegen, the compiler subprocesses of every kernel, link and run.
+``TRACER`` keeps the spans of the process: ``write_chrome_trace`` exports them
+in the Chrome trace event format (chrome://tracing, Perfetto) and ``summary``
+aggregates them per phase, with the time spent in a phase itself apart from
+the phases nested in it.
+
+Recording is off unless ``STENCIL_TRACE`` is set or a driver sets
+``TRACER.enabled``; spans are then no-ops. ``STENCIL_TRACE=trace.json``
+writes the trace, ``trace-summary.json`` and a printed summary when the
+process exits.
+"""
+import atexit
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+
+
+class Tracer:
+    """The spans recorded in this process, as dicts.
+
+    A span has ``name``, ``start`` (s since the epoch), ``dur`` and
+    ``self`` (s, ``dur`` minus its children), ``attrs``, ``depth``, ``pid``
+    and ``tid``.
+    """
+
+    def __init__(self, enabled=False):
+        self.spans = []
+        self.enabled = enabled
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # 用 perf_counter 计时，换算成墙上时间，不同进程的 span 才能放在一条时间轴上
+        self._wall = time.time()
+        self._perf = time.perf_counter()
+
+    def _stack(self):
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextlib.contextmanager
+    def span(self, name, **attrs):
+        """Record the block as a span ``name``; yields its (mutable) ``attrs``."""
+        if not self.enabled:
+            yield attrs
+            return
+        stack = self._stack()
+        record = {"name": name, "attrs": attrs, "depth": len(stack), "children": 0.0}
+        stack.append(record)
+        start = time.perf_counter()
+        try:
+            yield attrs
+        finally:
+            dur = time.perf_counter() - start
+            stack.pop()
+            if stack:
+                stack[-1]["children"] += dur
+            record["start"] = self._wall + (start - self._perf)
+            record["dur"] = dur
+            record["self"] = dur - record.pop("children")
+            record["pid"] = os.getpid()
+            record["tid"] = threading.get_ident()
+            with self._lock:
+                self.spans.append(record)
+
+    def traced(self, name=None):
+        """Decorator recording every call of a function as a span."""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(name or func.__name__):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    @contextlib.contextmanager
+    def collect(self):
+        """Record into a new list, e.g. in a worker process; yields the list.
+
+        It records even when disabled: a worker doesn't know whether its
+        parent traces, and ``extend`` drops the spans if it doesn't.
+        """
+        spans, saved, enabled = [], self.spans, self.enabled
+        stack, self._local.stack = self._stack(), []
+        self.spans, self.enabled = spans, True
+        try:
+            yield spans
+        finally:
+            self.spans, self.enabled = saved, enabled
+            self._local.stack = stack
+
+    def extend(self, spans):
+        """Add spans recorded elsewhere, e.g. returned by a worker."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.spans.extend(spans)
+
+    def clear(self):
+        with self._lock:
+            self.spans = []
+
+    def chrome_trace(self):
+        events = []
+        for record in sorted(self.spans, key=lambda record: record["start"]):
+            events.append({
+                "name": record["name"],
+                "cat": "stencil",
+                "ph": "X",
+                "ts": record["start"] * 1e6,
+                "dur": record["dur"] * 1e6,
+                "pid": record["pid"],
+                "tid": record["tid"],
+                "args": {key: _jsonable(value) for key, value in record["attrs"].items()},
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write_chrome_trace(self, path):
+        with open(path, "w") as f:
+            json.dump(self.chrome_trace(), f)
+
+    def summary(self):
+        """``{phase: {"count", "total", "self", "mean", "max"}}`` (s), by total time.
+
+        ``total`` of a phase nested in itself counts the inner spans again;
+        ``self`` never counts a second twice.
+        """
+        phases = {}
+        for record in self.spans:
+            phase = phases.setdefault(record["name"], {"count": 0, "total": 0.0, "self": 0.0, "max": 0.0})
+            phase["count"] += 1
+            phase["total"] += record["dur"]
+            phase["self"] += record["self"]
+            phase["max"] = max(phase["max"], record["dur"])
+        for phase in phases.values():
+            phase["mean"] = phase["total"] / phase["count"]
+        return dict(sorted(phases.items(), key=lambda item: -item[1]["total"]))
+
+    def format_summary(self):
+        lines = [f"{'phase':<24}{'count':>8}{'total (s)':>12}{'self (s)':>12}{'mean (s)':>12}{'max (s)':>12}"]
+        for name, phase in self.summary().items():
+            lines.append(f"{name:<24}{phase['count']:>8}{phase['total']:>12.3f}{phase['self']:>12.3f}"
+                         f"{phase['mean']:>12.4f}{phase['max']:>12.3f}")
+        return "\n".join(lines)
+
+    def write(self, path):
+        """Write the Chrome trace to ``path`` and the summary next to it."""
+        self.write_chrome_trace(path)
+        with open(os.path.splitext(path)[0] + "-summary.json", "w") as f:
+            json.dump(self.summary(), f, indent=1)
+
+
+def _jsonable(value):
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return str(value)
+
+
+def call_collected(func, *args, **kwargs):
+    """``(func(*args, **kwargs), spans)``; for ``ProcessPoolExecutor.submit``."""
+    with TRACER.collect() as spans:
+        result = func(*args, **kwargs)
+    return result, spans
+
+
+TRACE_PATH = os.environ.get("STENCIL_TRACE")
+TRACER = Tracer(enabled=bool(TRACE_PATH))
+span = TRACER.span
+traced = TRACER.traced
+
+if TRACE_PATH:
+    def _write_at_exit(pid=os.getpid()):
+        # fork 出的编译进程退出时不写
+        if os.getpid() == pid:
+            TRACER.write(TRACE_PATH)
+            print(TRACER.format_summary())
+
+    atexit.register(_write_at_exit)
@@ -1,7 +1,19 @@
 from typing import Dict
+import tvm
 from tvm import relay
 from tvm.relay.expr_functor import ExprMutator, ExprVisitor
 
+def call_args(call):
+    """The grid arguments of a stencil call.
+
+    ``stencil.apply`` takes its grids as one tuple, the fixed arity stencil
+    ops and fused calls take them directly.
+    """
+    if isinstance(call.op, tvm.ir.Op) and call.op.name == "stencil.apply":
+        return list(call.args[0].fields)
+    return list(call.args)
+
+
 class ReplaceParams(ExprMutator):
     def __init__(self, replace_map):
         super().__init__()
@@ -46,7 +58,7 @@ class BuildGraph(ExprVisitor):
         self.call_list.append(call)
         # 访问 call 的父节点，而不是访问 op 里面的东西
         # return super().visit_call(call)
-        for a in call.args:
+        for a in call_args(call):
             self.visit(a)
 
     def topo_sort(self, graph):
@@ -64,7 +76,7 @@ class BuildGraph(ExprVisitor):
         depend_graph = {}
         for call in self.call_list:
             depend_graph[call] = set()
-            for a in call.args:
+            for a in call_args(call):
                 if isinstance(a, relay.Call):
                     depend_graph[call].add(a)
                 elif isinstance(a, relay.TupleGetItem):
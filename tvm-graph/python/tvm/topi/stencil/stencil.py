@@ -1,5 +1,6 @@
 import tvm
 from tvm import te
+from .hypterm import interior
 
 def star2d2r(data, weight, placeholder_arg):
     x, y = data.shape
@@ -16,7 +17,7 @@ def star2d2r(data, weight, placeholder_arg):
         data.shape,
         lambda i, j:
             te.if_then_else(
-                te.all(i > 1, i < x - 2, j > 1, j < x - 2),
+                interior((i, j), (x, y), 2),
                 out[i - 2, j - 2],
                 tvm.tir.const(0, data.dtype)
             ),
@@ -36,7 +37,7 @@ def star1d4r_regular(data, weight):
         data.shape,
         lambda i:
             te.if_then_else(
-                te.all(i > 3, i < L - 4),
+                interior((i,), (L,), 4),
                 out[i - 4],
                 tvm.tir.const(0, data.dtype)
             ),
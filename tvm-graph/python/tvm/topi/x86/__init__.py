@@ -42,3 +42,10 @@ from .conv2d_alter_op import *
 from .dense_alter_op import *
 from .scatter import *
 from .group_conv2d import *
+from .stencil import (
+    PARTITION_CONFIG,
+    schedule_stencil,
+    schedule_stencil_grid,
+    schedule_stencil_star2d2r,
+    schedule_stencil_star1d4r,
+)
@@ -0,0 +1,121 @@
+"""x86 schedule of stencil computes."""
+import tvm
+from tvm import te
+from .utils import get_simd_32bit_lanes
+
+
+# 每个核的 L2 大小，按它选 j 方向的块高
+L2_BYTES = 256 * 1024
+# 块在 k 方向流动时留在 L2 中的平面数：±4 的 8 阶 stencil 读 9 个平面
+REACH_PLANES = 9
+# LoopPartition 默认不切常量范围的循环，而 stencil 网格的形状都是常量
+PARTITION_CONFIG = {"tir.LoopPartition": {"partition_const_loop": True}}
+
+
+def vector_lanes(dtype):
+    """SIMD lanes of ``dtype`` on the current target."""
+    return max(1, get_simd_32bit_lanes() * 32 // tvm.DataType(dtype).bits)
+
+
+def block_rows(shape, dtype, l2_bytes=L2_BYTES):
+    """Rows of a j block whose ``REACH_PLANES`` slabs fit in ``l2_bytes``."""
+    row = int(shape[-1]) * tvm.DataType(dtype).bits // 8
+    return max(1, min(int(shape[-2]), l2_bytes // (REACH_PLANES * row)))
+
+
+def partition(s, op, *axes):
+    """Let ``LoopPartition`` split ``axes`` at the ``likely`` boundary conditions.
+
+    The boundary tests of the stencil computes are marked ``likely``, so the
+    interior loops come out without them and only the halo keeps the select.
+    The loops of a stencil grid have constant extents, which ``LoopPartition``
+    only splits when built with ``PassContext(config=PARTITION_CONFIG)``.
+    """
+    for axis in axes:
+        s[op].pragma(axis, "loop_partition_hint", True)
+
+
+def schedule_stencil_grid(s, op, tile=(8, 32)):
+    """Block, parallelize and vectorize the grid of ``op``.
+
+    A 3D grid ``(k, j, i)`` is cut into blocks of ``j`` rows sized for L2
+    (``block_rows``); the blocks run in parallel, each streaming over ``k``
+    so the planes its stencil reads stay in cache. The unit-stride axis is
+    vectorized and ``k``, ``j`` and ``i`` are partitioned into interior and
+    boundary loops. Lower ranks tile the two innermost axes by ``tile``.
+    Reduction stages keep their reduction outside the vectorized axis.
+    """
+    axes = list(s[op].op.axis)
+    lanes = vector_lanes(op.output(0).dtype)
+    reduce_axes = list(s[op].op.reduce_axis)
+    if len(axes) >= 3 and int(op.output(0).shape[-1]) >= lanes:
+        k, j, i = axes[-3:]
+        jo, ji = s[op].split(j, factor=block_rows(op.output(0).shape, op.output(0).dtype))
+        io, ii = s[op].split(i, factor=lanes)
+        s[op].reorder(*axes[:-3], jo, k, ji, io, *reduce_axes, ii)
+        s[op].parallel(s[op].fuse(*axes[:-3], jo))
+        partition(s, op, k, ji, io)
+        s[op].vectorize(ii)
+    elif len(axes) >= 2:
+        yo, xo, yi, xi = s[op].tile(axes[-2], axes[-1], tile[0], tile[1])
+        xio, xii = s[op].split(xi, factor=min(lanes, tile[1]))
+        s[op].reorder(*axes[:-2], yo, xo, yi, xio, *reduce_axes, xii)
+        s[op].parallel(s[op].fuse(*axes[:-2], yo, xo))
+        partition(s, op, yi, xio)
+        s[op].vectorize(xii)
+    elif len(axes) == 1:
+        xo, xi = s[op].split(axes[0], factor=tile[-1])
+        xio, xii = s[op].split(xi, factor=min(lanes, tile[-1]))
+        s[op].reorder(xo, xio, *reduce_axes, xii)
+        s[op].parallel(xo)
+        partition(s, op, xio)
+        s[op].vectorize(xii)
+    return s
+
+
+def schedule_stencil(outs, tile=(8, 32)):
+    """x86 schedule of a (fused) stencil kernel.
+
+    Stages between the inputs and the outputs are inlined, i.e. recomputed by
+    their consumers like ``--stencil-inlining`` does, so accumulations such as
+    ``flux_0 + update`` of the hypterm computes run as one pass without an
+    ``update`` grid. Multi-output and reduction stages can't be inlined and
+    are computed at root instead. Every materialized stage is scheduled by
+    ``schedule_stencil_grid``.
+
+    Parameters
+    ----------
+    outs : Array of Tensor
+        The outputs of the kernel.
+    tile : tuple of int
+        Tile size of the two innermost axes of grids below 3D.
+    """
+    outs = [outs] if isinstance(outs, te.tensor.Tensor) else outs
+    s = te.create_schedule([x.op for x in outs])
+    output_ops = [x.op for x in outs]
+    visited = []
+
+    def traverse(op):
+        if op in visited or not isinstance(op, te.ComputeOp):
+            return
+        visited.append(op)
+        if op in output_ops or op.num_outputs > 1 or op.reduce_axis:
+            schedule_stencil_grid(s, op, tile)
+        else:
+            s[op].compute_inline()
+        for tensor in op.input_tensors:
+            traverse(tensor.op)
+
+    for op in output_ops:
+        traverse(op)
+    return s
+
+
+def schedule_stencil_star2d2r(outs):
+    """x86 schedule of ``topi.stencil.star2d2r``."""
+    return schedule_stencil(outs)
+
+
+def schedule_stencil_star1d4r(outs):
+    """x86 schedule of ``topi.stencil.star1d4r_regular``."""
+    return schedule_stencil(outs, tile=(1, 64))
@@ -396,5 +396,60 @@ Expr MakeGrid2MOStencil(Expr grid1, Expr grid2, tvm::String tag, int output_num)
 
 TVM_REGISTER_GLOBAL("relay.op._make.grid2mostencil").set_body_typed(MakeGrid2MOStencil);
 
+
+// N grid M output stencil
+TVM_REGISTER_NODE_TYPE(StencilApplyAttrs);
+bool StencilApplyRel(const Array<Type>& types, int num_inputs, const Attrs& attrs, const TypeReporter& reporter) {
+  // types: [(grid1, grid2, ...), output]
+  const auto* param = attrs.as<StencilApplyAttrs>();
+  ICHECK(param != nullptr);
+  ICHECK_EQ(types.size(), 2) << "Expects two types, for the grid tuple and output";
+  const auto* grids = types[0].as<TupleTypeNode>();
+  if (grids == nullptr) {
+    ICHECK(types[0].as<IncompleteTypeNode>()) << "StencilApply: expect input type to be TupleType but get " << types[0];
+    return false;
+  }
+  ICHECK_GT(grids->fields.size(), 0) << "StencilApply: expect at least one grid";
+  ICHECK_GT(param->output_num, 0) << "StencilApply: expect at least one output grid";
+  for (const Type& field : grids->fields) {
+    if (field.as<TensorTypeNode>() == nullptr) {
+      ICHECK(field.as<IncompleteTypeNode>()) << "StencilApply: expect grid type to be TensorType but get " << field;
+      return false;
+    }
+  }
+
+  const auto *data = grids->fields[0].as<TensorTypeNode>();
+  std::vector<IndexExpr> out_shape(data->shape.begin(), data->shape.end());
+  if (param->output_num == 1) {
+    reporter->Assign(types[1], TensorType(Array<IndexExpr>(out_shape), data->dtype));
+    return true;
+  }
+  std::vector<Type> out_tensor_list;
+  for (int i = 0; i < param->output_num; i++) {
+    out_tensor_list.push_back(TensorType(Array<IndexExpr>(out_shape), data->dtype));
+  }
+  reporter->Assign(types[1], TupleType(Array<Type>(out_tensor_list)));
+  return true;
+}
+
+RELAY_REGISTER_OP("stencil.apply")
+    .describe(R"doc(Process stencil compute of any number of input and output grids)doc" TVM_ADD_FILELINE)
+    .set_num_inputs(1)
+    .add_argument("grids", "Tuple", "The tuple of input grids")
+    .set_support_level(3)
+    .add_type_rel("StencilApply", StencilApplyRel)
+    .set_attr<TOpPattern>("TOpPattern", kOutEWiseFusable);
+
+
+Expr MakeStencilApply(Expr grids, tvm::String tag, int output_num) {
+    auto attrs = make_object<StencilApplyAttrs>();
+    attrs->tag = std::move(tag);
+    attrs->output_num = output_num;
+    static const Op& op = Op::Get("stencil.apply");
+    return Call(op, {grids}, Attrs(attrs), {});
+}
+
+TVM_REGISTER_GLOBAL("relay.op._make.stencil_apply").set_body_typed(MakeStencilApply);
+
 }  // namespace relay
 }  // namespace tvm
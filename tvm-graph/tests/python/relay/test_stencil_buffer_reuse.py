@@ -0,0 +1,118 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+"""Ordering of the kernels of a stream list, buffer sharing by lifetimes and grid placement."""
+import pytest
+
+from tvm.relay.transform.maingen import CpuGenMain, Kernel, happens_before, plan_buffers
+
+
+def kernels(**variables):
+    return [Kernel(name, list(names)) for name, names in variables.items()]
+
+
+def test_happens_before_one_stream():
+    before = happens_before([["k1", "k2", "k3"]])
+    assert before == {"k1": set(), "k2": {"k1"}, "k3": {"k1", "k2"}}
+
+
+def test_happens_before_concurrent_streams():
+    before = happens_before([["k1", "k2"], ["k3"]])
+    assert before["k2"] == {"k1"}
+    assert before["k3"] == set()
+
+
+def test_happens_before_sync():
+    before = happens_before([["k1", "sync_1", "k3"], ["k2", "sync_1", "k4"]])
+    assert before["k3"] == {"k1", "k2"}
+    assert before["k4"] == {"k1", "k2"}
+    assert "k2" not in before["k1"] and "k1" not in before["k2"]
+
+
+def test_happens_before_record_wait():
+    before = happens_before([["k1", "record_1", "k3"], ["k2", "wait_1", "k4"]])
+    assert before["k4"] == {"k1", "k2"}
+    # 记录之后的 k3 和等待方并发
+    assert before["k3"] == {"k1"}
+    assert "k3" not in before["k4"] and "k4" not in before["k3"]
+
+
+def test_reuse_after_last_access():
+    stream_list = [["k1", "k2", "k3"]]
+    buffers = plan_buffers(stream_list, kernels(k1=["t1"], k2=["t1", "t2"], k3=["t2", "t3"]), ["t1", "t2", "t3"])
+    assert buffers == {"t1": "t1", "t2": "t2", "t3": "t1"}
+
+
+def test_overlapping_lifetimes_one_stream():
+    stream_list = [["k1", "k2", "k3"]]
+    buffers = plan_buffers(stream_list, kernels(k1=["t1"], k2=["t2"], k3=["t1"]), ["t1", "t2"])
+    assert buffers["t2"] == "t2"
+
+
+def test_concurrent_streams_never_share():
+    # t1 在 k1 之后就不再使用，但 k3 在另一个流上可能与 k1 同时运行
+    stream_list = [["k1", "k2"], ["k3"]]
+    buffers = plan_buffers(stream_list, kernels(k1=["t1"], k2=["t2"], k3=["t3"]), ["t1", "t2", "t3"])
+    assert buffers["t3"] == "t3"
+    assert buffers["t2"] == "t1"
+
+
+def test_share_across_record_wait():
+    stream_list = [["k1", "record_1"], ["wait_1", "k2"]]
+    buffers = plan_buffers(stream_list, kernels(k1=["t1"], k2=["t2"]), ["t1", "t2"])
+    assert buffers == {"t1": "t1", "t2": "t1"}
+
+
+def test_access_after_record_must_not_share():
+    # k3 在 record_1 之后仍读 t1，与等待 event 的 k2 并发
+    stream_list = [["k1", "record_1", "k3"], ["wait_1", "k2"]]
+    buffers = plan_buffers(stream_list, kernels(k1=["t1"], k2=["t2"], k3=["t1"]), ["t1", "t2"])
+    assert buffers == {"t1": "t1", "t2": "t2"}
+
+
+def test_share_across_sync():
+    stream_list = [["k1", "sync_1", "k3"], ["k2", "sync_1"]]
+    buffers = plan_buffers(stream_list, kernels(k1=["t1"], k2=["t2"], k3=["t3"]), ["t1", "t2", "t3"])
+    assert buffers["t1"] != buffers["t2"]
+    assert buffers["t3"] in (buffers["t1"], buffers["t2"])
+
+
+def test_first_touch_worker():
+    stream_list = [["k1", "record_1", "wait_2", "k3"], ["k2", "record_2", "wait_1", "k4"]]
+    variables = {
+        "all_variables": dict.fromkeys(["a", "t1", "t2", "out", "unused"], 3),
+        "in_variables": {"a"},
+        "mid_variables": {"t1", "t2"},
+        "out_variables": {"out"},
+        "useless_variables": {"unused"},
+    }
+    gen = CpuGenMain(16, 4, variables, kernels(k1=["a", "t1"], k2=["t2"], k3=["t1", "t2", "out"], k4=["t1"]),
+                     stream_list, output_on=False)
+    assert gen.kernel_workers() == {"k1": 0, "k3": 0, "k2": 1, "k4": 1}
+    # 每个网格在最先访问它的 kernel 所在的 worker 上初始化
+    assert {var: gen.first_worker(var) for var in ["a", "t1", "t2", "out", "unused"]} == {
+        "a": 0, "t1": 0, "t2": 1, "out": 0, "unused": 0,
+    }
+    code = []
+    gen.code = code
+    gen.gen_mem2d()
+    gen.gen_task_graph()
+    assert "  firstTouch(pool, p->t2, 1);" in code
+    assert "\n  graph.worker[3] = 1;" in "\n".join(code)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
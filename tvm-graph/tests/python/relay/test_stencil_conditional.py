@@ -0,0 +1,118 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+"""Conditional (``scf.if``) apply bodies are if-converted and fuse like any other."""
+import pytest
+
+from tvm.relay.transform.stencil_executor import compare, fuse_program
+from tvm.relay.transform.stencil_ir import ApplyBody, StencilProgram
+
+
+FIELD = "!stencil.field<?x?x?xf64>"
+TEMP = "!stencil.temp<?x?x?xf64>"
+RESULT = "!stencil.result<f64>"
+
+# scf.if 产出 f64，在分支外 store_result
+YIELD_VALUE = """\
+      %a = stencil.access %arg6 [1, 0, 0] : ({temp}) -> f64
+      %b = stencil.access %arg7 [0, 0, 0] : ({temp}) -> f64
+      %c = cmpf "ogt", %a, %b : f64
+      %r = scf.if %c -> (f64) {{
+        %d = subf %a, %b : f64
+        scf.yield %d : f64
+      }} else {{
+        %e = mulf %a, %b : f64
+        scf.yield %e : f64
+      }}
+      %s = stencil.store_result %r : (f64) -> {result}
+      stencil.return %s : {result}"""
+
+# --stencil-combine-to-ifelse 的形式：分支各自 store_result 并产出 !stencil.result
+YIELD_RESULT = """\
+      %a = stencil.access %arg6 [1, 0, 0] : ({temp}) -> f64
+      %b = stencil.access %arg7 [0, 0, 0] : ({temp}) -> f64
+      %c = cmpf "ogt", %a, %b : f64
+      %r = scf.if %c -> ({result}) {{
+        %d = subf %a, %b : f64
+        %s = stencil.store_result %d : (f64) -> {result}
+        scf.yield %s : {result}
+      }} else {{
+        %e = mulf %a, %b : f64
+        %t = stencil.store_result %e : (f64) -> {result}
+        scf.yield %t : {result}
+      }}
+      stencil.return %r : {result}"""
+
+PROGRAM = """\
+module  {{
+  func @conditional(%arg0: {field}, %arg1: {field}, %arg2: {field}) attributes {{stencil.program}} {{
+    %0 = stencil.cast %arg0([-2, -2, -2] : [10, 10, 10]) : ({field}) -> !stencil.field<12x12x12xf64>
+    %1 = stencil.cast %arg1([-2, -2, -2] : [10, 10, 10]) : ({field}) -> !stencil.field<12x12x12xf64>
+    %2 = stencil.cast %arg2([-2, -2, -2] : [10, 10, 10]) : ({field}) -> !stencil.field<12x12x12xf64>
+    %3 = stencil.load %0 : (!stencil.field<12x12x12xf64>) -> {temp}
+    %5 = stencil.load %1 : (!stencil.field<12x12x12xf64>) -> {temp}
+    %4 = stencil.apply (%arg6 = %3 : {temp}, %arg7 = %5 : {temp}) -> {temp} {{
+{body}
+    }}
+    %6 = stencil.apply (%arg8 = %4 : {temp}, %arg9 = %3 : {temp}) -> {temp} {{
+      %f = stencil.access %arg8 [-1, 0, 0] : ({temp}) -> f64
+      %g = stencil.access %arg8 [1, 0, 0] : ({temp}) -> f64
+      %h = stencil.access %arg9 [0, 1, 0] : ({temp}) -> f64
+      %i = addf %f, %g : f64
+      %j = mulf %i, %h : f64
+      %k = stencil.store_result %j : (f64) -> {result}
+      stencil.return %k : {result}
+    }}
+    stencil.store %6 to %2([0, 0, 0] : [8, 8, 8]) : {temp} to !stencil.field<12x12x12xf64>
+    return
+  }}
+}}"""
+
+
+def program(body):
+    body = body.format(temp=TEMP, result=RESULT)
+    return StencilProgram.from_mlir(PROGRAM.format(field=FIELD, temp=TEMP, result=RESULT, body=body).split("\n"))
+
+
+@pytest.mark.parametrize("body", [YIELD_VALUE, YIELD_RESULT])
+def test_parse_conditional(body):
+    lines = body.format(temp=TEMP, result=RESULT).split("\n")
+    apply = ApplyBody.from_mlir(lines, ["%arg6", "%arg7"])
+    assert [op.opcode for op in apply.results] == ["select"]
+    assert apply.result_types == ["f64"]
+    assert apply.access_offsets() == {0: {(1, 0, 0)}, 1: {(0, 0, 0)}}
+
+
+def test_result_forms_agree():
+    assert compare(program(YIELD_VALUE), program(YIELD_RESULT)) == []
+
+
+@pytest.mark.parametrize("body", [YIELD_VALUE, YIELD_RESULT])
+def test_fuse_conditional_producer(body):
+    unfused = program(body)
+    fused = fuse_program(unfused, [["%4", "%6"]])
+    assert len(fused.applies) == 1
+    assert compare(unfused, fused) == []
+
+
+def test_store_result_without_value():
+    lines = YIELD_RESULT.replace("%t = stencil.store_result %e : (f64)", "%t = stencil.store_result : ()")
+    with pytest.raises(ValueError, match="without a value"):
+        ApplyBody.from_mlir(lines.format(temp=TEMP, result=RESULT).split("\n"), ["%arg6", "%arg7"])
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
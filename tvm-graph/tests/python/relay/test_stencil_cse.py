@@ -0,0 +1,144 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+"""Common subexpressions of fused bodies and the recompute budget of fusion."""
+import os
+
+import numpy as np
+import pytest
+
+from tvm.relay.transform import stencil_ir
+from tvm.relay.transform.cost_model import RecomputeBudget
+from tvm.relay.transform.stencil_executor import Grid, compare, evaluate_body, fuse_program
+from tvm.relay.transform.stencil_ir import (
+    ApplyBody,
+    StencilProgram,
+    eliminate_common_subexpressions,
+    fuse_applies,
+    resize_mlir,
+)
+
+
+TEST_CASE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "..", "test_cases", "s10-i9-o4-e26.mlir"
+)
+TEMP = "(!stencil.temp<?x?x?xf64>) -> f64"
+
+# p = a[0] + a[1]
+PRODUCER = f"""\
+%0 = stencil.access %arg0 [0, 0, 0] : {TEMP}
+%1 = stencil.access %arg0 [1, 0, 0] : {TEMP}
+%2 = addf %0, %1 : f64
+%3 = stencil.store_result %2 : (f64) -> !stencil.result<f64>
+stencil.return %3 : !stencil.result<f64>"""
+
+# p[-1] + p[0] + p[1]，第二个加法的操作数顺序反过来
+CONSUMER = f"""\
+%0 = stencil.access %arg0 [-1, 0, 0] : {TEMP}
+%1 = stencil.access %arg0 [0, 0, 0] : {TEMP}
+%2 = stencil.access %arg0 [1, 0, 0] : {TEMP}
+%3 = addf %0, %1 : f64
+%4 = addf %2, %3 : f64
+%5 = stencil.store_result %4 : (f64) -> !stencil.result<f64>
+stencil.return %5 : !stencil.result<f64>"""
+
+
+def fuse_chain():
+    bodies = [ApplyBody.from_mlir(code.split("\n"), ["%arg0"]) for code in (PRODUCER, CONSUMER)]
+    return fuse_applies(bodies, [[("arg", 0)], [("result", 0, 0)]], [(1, 0)], 1)
+
+
+def run(body, data, n=8):
+    return evaluate_body(body, [Grid(data, (-2, 0, 0))], (0, 0, 0), (n, 1, 1))[0]
+
+
+def test_inlined_producer_shrinks(monkeypatch):
+    fused = fuse_chain()
+    with monkeypatch.context() as m:
+        m.setattr(stencil_ir, "eliminate_common_subexpressions", lambda body: body)
+        raw = fuse_chain()
+    # 三份 a[i] + a[i+1] 共用 a[0] 与 a[1]
+    assert len(raw.accesses()) == 6
+    assert sorted(op.offset for op in fused.accesses()) == [(-1, 0, 0), (0, 0, 0), (1, 0, 0), (2, 0, 0)]
+    assert len(fused.ops) < len(raw.ops)
+    assert len(eliminate_common_subexpressions(raw).ops) == len(fused.ops)
+    data = np.random.default_rng(0).uniform(1.0, 2.0, (12, 1, 1))
+    assert run(fused, data).tobytes() == run(raw, data).tobytes()
+
+
+def test_commutative_operands():
+    body = ApplyBody.from_mlir(
+        f"""\
+%0 = stencil.access %arg0 [0, 0, 0] : {TEMP}
+%1 = stencil.access %arg0 [1, 0, 0] : {TEMP}
+%2 = mulf %0, %1 : f64
+%3 = mulf %1, %0 : f64
+%4 = subf %2, %3 : f64
+%5 = subf %3, %2 : f64
+%6 = addf %4, %5 : f64
+%7 = stencil.store_result %6 : (f64) -> !stencil.result<f64>
+stencil.return %7 : !stencil.result<f64>""".split("\n"),
+        ["%arg0"],
+    )
+    opcodes = [op.opcode for op in eliminate_common_subexpressions(body).ops]
+    # 两个乘法合并成一个，之后两个减法都是 x - x，也只算一次
+    assert opcodes.count("mulf") == 1
+    assert opcodes.count("subf") == 1
+
+
+@pytest.mark.skipif(not os.path.exists(TEST_CASE), reason="test_cases not found")
+def test_fused_program_with_and_without_cse(monkeypatch):
+    with open(TEST_CASE) as f:
+        program = StencilProgram.from_mlir(resize_mlir(f.read().split("\n"), 12, 8))
+    groups = [[apply.tag for apply in program.applies]]
+    fused = fuse_program(program, groups)
+    with monkeypatch.context() as m:
+        m.setattr(stencil_ir, "eliminate_common_subexpressions", lambda body: body)
+        raw = fuse_program(program, groups)
+    assert len(fused.applies[0].body.ops) < len(raw.applies[0].body.ops)
+    assert compare(raw, fused) == []
+    assert compare(program, fused) == []
+
+
+def recompute_pair(program):
+    """A producer and a consumer reading it at more than one offset."""
+    for consumer in program.applies:
+        for operand, offsets in zip(consumer.operands, consumer.body.access_offsets().values()):
+            if operand in program.producer and len(offsets) > 1:
+                producer = program.producer[operand][0]
+                return frozenset([producer.tag[1:]]), frozenset([consumer.tag[1:]])
+    raise AssertionError("no producer read at several offsets")
+
+
+@pytest.mark.skipif(not os.path.exists(TEST_CASE), reason="test_cases not found")
+def test_recompute_budget():
+    with open(TEST_CASE) as f:
+        program = StencilProgram.from_mlir(resize_mlir(f.read().split("\n"), 12, 8))
+    a, b = recompute_pair(program)
+    unlimited = RecomputeBudget(program, 12)
+    assert unlimited(a, b)
+    fused = unlimited.kernel(a | b)
+    added = fused.flops - unlimited.kernel(a).flops - unlimited.kernel(b).flops
+    assert added > 0
+    assert RecomputeBudget(program, 12, max_flops=added)(a, b)
+    assert not RecomputeBudget(program, 12, max_flops=added - 1)(a, b)
+    instructions = fused.flops + fused.accesses
+    assert RecomputeBudget(program, 12, max_instructions=instructions)(a, b)
+    assert not RecomputeBudget(program, 12, max_instructions=instructions - 1)(a, b)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,100 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+"""Domain decomposition and halo exchange of stencil programs over processes."""
+import itertools
+import os
+
+import numpy as np
+import pytest
+
+from tvm.relay.transform.stencil_distributed import (
+    Decomposition,
+    load_fields,
+    run_distributed,
+    run_serial,
+    save_fields,
+)
+from tvm.relay.transform.stencil_executor import allocate_fields
+from tvm.relay.transform.stencil_ir import StencilProgram, resize_mlir
+from tvm.relay.transform.temporal import default_feedback
+
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "..")
+PROGRAMS = [
+    os.path.join(ROOT, "test_cases", "s10-i9-o4-e26.mlir"),
+    # 有没人用的 apply
+    os.path.join(ROOT, "test_cases", "s14-i11-o4-e38.mlir"),
+    os.path.join(ROOT, "realworld_stencil", "hori.mlir"),
+]
+PROGRAMS = [path for path in PROGRAMS if os.path.exists(path)]
+
+
+def load(path, mesh_size=16, halo_width=8):
+    with open(path) as f:
+        return StencilProgram.from_mlir(resize_mlir(f.read().split("\n"), mesh_size, halo_width))
+
+
+def points(box):
+    return set(itertools.product(*[range(l, u) for l, u in zip(*box)]))
+
+
+@pytest.mark.parametrize("path", PROGRAMS)
+@pytest.mark.parametrize("parts", [(2, 2), (3, 1)])
+def test_tiles_and_windows(path, parts):
+    program = load(path, mesh_size=8)
+    decomposition = Decomposition(program, parts, default_feedback(program))
+    covered = [points(tile) for tile in decomposition.tiles]
+    assert sum(len(p) for p in covered) == len(points(decomposition.domain))
+    assert set().union(*covered) == points(decomposition.domain)
+    for t, tile in enumerate(decomposition.tiles):
+        for arg, (lo, hi) in decomposition.extents.items():
+            window = points(decomposition.windows[t, arg])
+            read = {tuple(p + d for p, d in zip(point, offset)) for point in points(tile)
+                    for offset in (lo, hi)}
+            assert read & points(decomposition.cast_box[arg]) <= window
+
+
+@pytest.mark.parametrize("path", PROGRAMS)
+def test_halo_regions(path):
+    program = load(path, mesh_size=8)
+    decomposition = Decomposition(program, (2, 2), default_feedback(program))
+    for t, tile in enumerate(decomposition.tiles):
+        for arg in decomposition.exchanged:
+            regions = decomposition.halo_regions(t, arg)
+            for s, box in regions:
+                assert s != t
+                assert points(box) <= points(decomposition.tiles[s])
+                assert points(box) <= points(decomposition.windows[t, arg])
+
+
+@pytest.mark.parametrize("path", PROGRAMS)
+@pytest.mark.parametrize("parts,steps,overlap", [((2, 2), 1, True), ((2, 3), 3, True), ((3, 1), 2, False)])
+def test_matches_serial(path, parts, steps, overlap, tmp_path):
+    program = load(path)
+    feedback = default_feedback(program) if steps > 1 else {}
+    expected = allocate_fields(program)
+    paths = save_fields(expected, str(tmp_path))
+    run_serial(program, expected, steps, feedback)
+    stats = run_distributed(program, paths, parts, steps, feedback, overlap, timeout=300)
+    assert sorted(stat["tile"] for stat in stats) == list(range(parts[0] * parts[1]))
+    actual = load_fields(paths)
+    assert [arg for arg in expected if expected[arg].tobytes() != actual[arg].tobytes()] == []
+    assert sorted(os.listdir(tmp_path)) == sorted(os.path.basename(p) for p in paths.values())
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
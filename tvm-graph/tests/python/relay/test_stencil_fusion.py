@@ -0,0 +1,76 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+"""Fused stencil programs compute the same fields as the unfused ones."""
+import glob
+import os
+
+import pytest
+
+from tvm.relay.transform.stencil_executor import compare, fuse_program
+from tvm.relay.transform.stencil_ir import StencilProgram, resize_mlir
+
+
+TEST_CASES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "..", "test_cases")
+PROGRAMS = sorted(os.path.basename(path) for path in glob.glob(os.path.join(TEST_CASES, "*.mlir")))
+# %35 的结果既不存储也不被读取，%31 只被 %35 读取
+DEAD_APPLY = "s14-i11-o4-e38.mlir"
+
+
+def load(name, mesh_size=12, halo_width=8):
+    with open(os.path.join(TEST_CASES, name)) as f:
+        return StencilProgram.from_mlir(resize_mlir(f.read().split("\n"), mesh_size, halo_width))
+
+
+def plans(program):
+    """Fusion plans of ``program``: everything, and windows of consecutive applies.
+
+    A window of applies in program order can't depend on itself through an
+    apply outside of it, so every plan is free of cycles.
+    """
+    tags = [apply.tag for apply in program.applies]
+    return {
+        "all": [tags],
+        "pairs": [tags[i : i + 2] for i in range(1, len(tags), 2)],
+        "triples": [tags[i : i + 3] for i in range(0, len(tags), 3)],
+    }
+
+
+@pytest.mark.skipif(not PROGRAMS, reason="test_cases not found")
+@pytest.mark.parametrize("name", PROGRAMS)
+@pytest.mark.parametrize("plan", ["all", "pairs", "triples"])
+def test_fused_matches_unfused(name, plan):
+    program = load(name)
+    groups = plans(program)[plan]
+    fused = fuse_program(program, groups)
+    assert len(fused.applies) == len(groups) + len(program.applies) - sum(len(group) for group in groups)
+    assert compare(program, fused) == []
+
+
+@pytest.mark.skipif(DEAD_APPLY not in PROGRAMS, reason="test_cases not found")
+def test_dead_apply():
+    program = load(DEAD_APPLY)
+    bounds = program.infer_bounds()
+    dead = [apply.tag for apply in program.applies if apply.tag not in bounds]
+    assert dead == ["%31", "%35"]
+    fused = fuse_program(program, plans(program)["all"])
+    assert compare(program, fused) == []
+    # 单独融合没人用的 apply 也不改变结果
+    assert compare(program, fuse_program(program, [["%34", "%35"]])) == []
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,133 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+"""Comparison of the outputs written by generated stencil programs."""
+import json
+
+import numpy as np
+import pytest
+
+from tvm.relay.transform import stencil_outputs
+from tvm.relay.transform.stencil_outputs import checksum, compare_outputs, mismatched
+
+
+@pytest.fixture
+def dirs(tmp_path, monkeypatch):
+    # 小的块大小，比较跨越多个块
+    monkeypatch.setattr(stencil_outputs, "CHUNK", 64)
+    expected, actual = tmp_path / "expected", tmp_path / "actual"
+    expected.mkdir()
+    actual.mkdir()
+    return expected, actual
+
+
+def grid(seed=0, shape=(6, 5, 4)):
+    return np.random.default_rng(seed).uniform(1.0, 2.0, shape)
+
+
+def write(directory, name, data):
+    np.save(directory / f"{name}.npy", data)
+
+
+def write_checksum(directory, name, data):
+    with open(directory / f"{name}.checksum.json", "w") as f:
+        json.dump(checksum(data), f)
+
+
+def test_equal(dirs):
+    data = grid()
+    for directory in dirs:
+        write(directory, "out_0", data)
+        write(directory, "out_1", 2 * data)
+    reports = compare_outputs(*dirs)
+    assert sorted(reports) == ["out_0", "out_1"]
+    assert mismatched(reports) == []
+    assert reports["out_0"]["max_abs_err"] == 0.0 and reports["out_0"]["mismatches"] == 0
+
+
+def test_perturbed_point(dirs):
+    data = grid()
+    perturbed = data.copy()
+    perturbed[4, 2, 3] += 1e-6
+    perturbed[5, 0, 0] += 1e-3
+    write(dirs[0], "out", data)
+    write(dirs[1], "out", perturbed)
+    report = compare_outputs(*dirs)["out"]
+    assert not report["ok"]
+    assert report["mismatches"] == 2
+    assert report["first_mismatch"] == [4, 2, 3]
+    assert report["max_abs_err"] == pytest.approx(1e-3)
+    # 在容差内则通过
+    assert compare_outputs(*dirs, rtol=0.0, atol=2e-3)["out"]["ok"]
+
+
+def test_nan(dirs):
+    data = grid()
+    data[1, 1, 1] = np.nan
+    write(dirs[0], "out", data)
+    write(dirs[1], "out", data)
+    assert compare_outputs(*dirs)["out"]["ok"]
+    other = data.copy()
+    other[1, 1, 1] = 1.0
+    other[2, 2, 2] = np.nan
+    write(dirs[1], "out", other)
+    report = compare_outputs(*dirs)["out"]
+    assert not report["ok"]
+    assert report["mismatches"] == 2
+    assert report["first_mismatch"] == [1, 1, 1]
+
+
+def test_shape_mismatch(dirs):
+    write(dirs[0], "out", grid())
+    write(dirs[1], "out", grid(shape=(6, 5, 3)))
+    report = compare_outputs(*dirs)["out"]
+    assert not report["ok"] and "shape" in report["error"]
+
+
+def test_missing_file(dirs):
+    write(dirs[0], "out_0", grid())
+    write(dirs[0], "out_1", grid())
+    write(dirs[1], "out_0", grid())
+    write(dirs[1], "out_2", grid())
+    reports = compare_outputs(*dirs)
+    assert mismatched(reports) == ["out_1", "out_2"]
+    assert str(dirs[1]) in reports["out_1"]["error"]
+    assert str(dirs[0]) in reports["out_2"]["error"]
+
+
+def test_npy_against_checksum(dirs):
+    data = grid()
+    write_checksum(dirs[0], "out", data)
+    write(dirs[1], "out", data)
+    assert compare_outputs(*dirs)["out"]["ok"]
+    assert compare_outputs(*reversed(dirs))["out"]["ok"]
+    write(dirs[1], "out", data + 1e-3)
+    report = compare_outputs(*dirs)["out"]
+    assert not report["ok"]
+    assert report["errors"]["sum"] > 0
+
+
+def test_checksum_nan_count(dirs):
+    data = grid()
+    other = data.copy()
+    other[0, 0, 0] = np.nan
+    write_checksum(dirs[0], "out", data)
+    write_checksum(dirs[1], "out", other)
+    assert not compare_outputs(*dirs)["out"]["ok"]
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,124 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+"""List scheduling of stencil kernels onto streams with record/wait events."""
+import itertools
+import random
+
+import pytest
+
+stream_solve = pytest.importorskip("tvm.relay.transform.streamSolve")
+
+
+def make_graph(edges, nodes=()):
+    graph = {node: {"input": [], "output": []} for node in nodes}
+    for u, v in edges:
+        graph.setdefault(u, {"input": [], "output": []})
+        graph.setdefault(v, {"input": [], "output": []})
+        graph[v]["input"].append(u)
+        graph[u]["output"].append(v)
+    return graph
+
+
+def schedule(monkeypatch, graph, cost, max_streams, sync_cost=0.0):
+    solver = stream_solve.StreamSolver()
+    # 节点直接用字符串，跳过从 relay 表达式建图
+    monkeypatch.setattr(solver, "build_graph", lambda expr: graph)
+    return solver.list_schedule(None, cost, max_streams, sync_cost)
+
+
+def check_events(graph, streamlist):
+    """Every dependency is ordered on one stream or through a record/wait pair."""
+    position, recorded = {}, {}
+    for s, entries in enumerate(streamlist):
+        for i, entry in enumerate(entries):
+            if isinstance(entry, str) and entry.startswith("record_"):
+                recorded[entry[len("record_"):]] = (s, i)
+            elif not (isinstance(entry, str) and entry.startswith("wait_")):
+                position[entry] = (s, i)
+    assert sorted(position) == sorted(graph)
+    order = {node: i for i, node in enumerate(stream_solve.StreamSolver.topo_order(None, graph))}
+    name = {str(i): node for node, i in order.items()}
+    # 每个 wait 都有对应的 record，且 record 紧跟在生产者之后
+    for s, entries in enumerate(streamlist):
+        for entry in entries:
+            if isinstance(entry, str) and entry.startswith("wait_"):
+                event = entry[len("wait_"):]
+                assert event in recorded
+                assert recorded[event] == (position[name[event]][0], position[name[event]][1] + 1)
+
+    def finished(node):
+        """Kernels known to be done when ``node`` starts on its stream."""
+        s, i = position[node]
+        done = set()
+        for entry in streamlist[s][:i]:
+            if isinstance(entry, str) and entry.startswith("wait_"):
+                done.add(name[entry[len("wait_"):]])
+            elif not isinstance(entry, str) or not entry.startswith("record_"):
+                done.add(entry)
+        closure = set()
+        while done:
+            kernel = done.pop()
+            if kernel not in closure:
+                closure.add(kernel)
+                done |= set(graph[kernel]["input"])
+        return closure
+
+    for v in graph:
+        for u in graph[v]["input"]:
+            assert u in finished(v), (u, v)
+
+
+def test_diamond(monkeypatch):
+    # a -> d 经由 b 可达，传递归约后不产生事件
+    graph = make_graph([("a", "b"), ("a", "c"), ("b", "d"), ("c", "d"), ("a", "d")])
+    cost = {"a": 1.0, "b": 4.0, "c": 4.0, "d": 1.0}
+    streamlist = schedule(monkeypatch, graph, cost, max_streams=2)
+    assert streamlist == [["a", "record_0", "b", "wait_2", "d"], ["wait_0", "c", "record_2"]]
+    check_events(graph, streamlist)
+
+
+def test_sync_cost_keeps_chain_on_one_stream(monkeypatch):
+    graph = make_graph([("a", "b"), ("a", "c"), ("b", "d"), ("c", "d")])
+    cost = {"a": 1.0, "b": 1.0, "c": 1.0, "d": 1.0}
+    assert schedule(monkeypatch, graph, cost, max_streams=2, sync_cost=5.0) == [["a", "b", "c", "d"]]
+    # 不同步时 b、c 并行
+    streamlist = schedule(monkeypatch, graph, cost, max_streams=2)
+    assert len(streamlist) == 2
+    check_events(graph, streamlist)
+
+
+def test_independent_kernels(monkeypatch):
+    graph = make_graph([], nodes="abc")
+    streamlist = schedule(monkeypatch, graph, dict.fromkeys("abc", 1.0), max_streams=4)
+    assert sorted(map(tuple, streamlist)) == [("a",), ("b",), ("c",)]
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("max_streams", [1, 2, 3])
+def test_random_dag_events(monkeypatch, seed, max_streams):
+    rng = random.Random(seed)
+    nodes = [f"k{i}" for i in range(12)]
+    edges = [(u, v) for u, v in itertools.combinations(nodes, 2) if rng.random() < 0.3]
+    graph = make_graph(edges, nodes)
+    cost = {node: rng.uniform(1.0, 5.0) for node in nodes}
+    streamlist = schedule(monkeypatch, graph, cost, max_streams, sync_cost=rng.uniform(0.0, 2.0))
+    assert len(streamlist) <= max_streams
+    check_events(graph, streamlist)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,74 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+"""The TE computes of apply bodies agree with the NumPy executor on llvm."""
+import os
+
+import numpy as np
+import pytest
+
+# 没有 libtvm 时整个文件跳过
+te = pytest.importorskip("tvm.te")
+
+import tvm
+import tvm.testing
+from tvm import topi
+from tvm.relay.transform.stencil_executor import Grid, evaluate_body
+from tvm.relay.transform.stencil_ir import StencilProgram, access_extents
+from tvm.relay.transform.stencil_te import body_compute
+
+
+TEST_CASE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "..", "test_cases", "s10-i9-o4-e26.mlir"
+)
+
+
+def applies():
+    with open(TEST_CASE) as f:
+        return StencilProgram.from_mlir(f.read().split("\n")).applies
+
+
+@tvm.testing.requires_llvm
+@pytest.mark.skipif(not os.path.exists(TEST_CASE), reason="test_cases not found")
+@pytest.mark.parametrize("index", range(len(applies()) if os.path.exists(TEST_CASE) else 0))
+def test_body_compute_matches_executor(index, n=12):
+    body = applies()[index].body
+    shape = (n, n, n)
+    placeholders = [te.placeholder(shape, "float64", name=f"grid_{a}") for a in range(body.num_args)]
+    outputs = body_compute(body)(*placeholders)
+    outputs = outputs if isinstance(outputs, list) else [outputs]
+    with tvm.target.Target("llvm"):
+        s = topi.x86.schedule_stencil(outputs)
+    with tvm.transform.PassContext(opt_level=3, config=topi.x86.PARTITION_CONFIG):
+        func = tvm.build(s, placeholders + outputs, "llvm")
+
+    rng = np.random.default_rng(index)
+    arrays = [rng.uniform(1.0, 2.0, shape) for _ in placeholders]
+    results = [tvm.nd.empty(shape, "float64") for _ in outputs]
+    func(*[tvm.nd.array(a) for a in arrays], *results)
+
+    # 所有访问都落在网格内的点
+    extents = [extent for extent in access_extents(body) if extent is not None]
+    lb = tuple(-min(v) for v in zip(*[extent[0] for extent in extents]))
+    ub = tuple(n - max(v) for v in zip(*[extent[1] for extent in extents]))
+    expected = evaluate_body(body, [Grid(a, (0, 0, 0)) for a in arrays], lb, ub)
+    inside = tuple(slice(l, u) for l, u in zip(lb, ub))
+    for result, values in zip(results, expected):
+        tvm.testing.assert_allclose(result.numpy()[inside], values, rtol=1e-12)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,66 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+"""Unrolled timesteps against looped runs with swapped buffers."""
+import os
+
+import pytest
+
+from tvm.relay.transform.stencil_distributed import run_serial
+from tvm.relay.transform.stencil_executor import allocate_fields, execute
+from tvm.relay.transform.stencil_ir import StencilProgram, resize_mlir
+from tvm.relay.transform.temporal import default_feedback, required_halo, unroll_timesteps
+
+
+FASTWAVES = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "..", "realworld_stencil", "fastwaves.mlir"
+)
+
+
+def load_code(mesh_size, halo_width):
+    with open(FASTWAVES) as f:
+        return resize_mlir(f.read().split("\n"), mesh_size, halo_width)
+
+
+@pytest.mark.skipif(not os.path.exists(FASTWAVES), reason="realworld_stencil not found")
+@pytest.mark.parametrize("steps", [2, 3])
+def test_unrolled_matches_looped_inside_ring(steps, n=16):
+    code = load_code(n, 8)
+    program = StencilProgram.from_mlir(code)
+    feedback = default_feedback(program)
+    unrolled = StencilProgram.from_mlir(unroll_timesteps(code, steps, feedback))
+    looped = allocate_fields(program)
+    fields = {arg: data.copy() for arg, data in looped.items()}
+    run_serial(program, looped, steps, feedback)
+    execute(unrolled, fields)
+
+    # 离存储区域边界 ring 个点以内，展开的程序读的是重算的 halo，循环读的是 field 中的边界值
+    ring = required_halo(program) * (steps - 1)
+    for _, field, lb, ub in program.stores:
+        arg, origin, _ = program.casts[field]
+        inside = tuple(slice(l + ring - o, u - ring - o) for l, u, o in zip(lb, ub, origin))
+        assert looped[arg][inside].tobytes() == fields[arg][inside].tobytes(), arg
+
+
+@pytest.mark.skipif(not os.path.exists(FASTWAVES), reason="realworld_stencil not found")
+def test_halo_too_small():
+    code = load_code(16, 2)
+    with pytest.raises(ValueError, match="halo points"):
+        unroll_timesteps(code, 3)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
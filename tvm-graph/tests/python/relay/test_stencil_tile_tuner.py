@@ -0,0 +1,104 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+"""Tile size search of kernels and the tuning database."""
+import pytest
+
+from tvm.relay.transform.run import CompileError
+from tvm.relay.transform.tile_tuner import TileTuner, TuningDatabase, kernel_hash
+from tvm.relay.transform.timing import Timing
+
+
+KERNEL = """\
+func @{name}(%arg0: !stencil.field<?x?x?xf64>, %arg1: !stencil.field<?x?x?xf64>) attributes {{stencil.program}} {{
+  stencil.store %1 to %2([0, 0, 0] : [{n}, {n}, {n}]) : !stencil.temp<?x?x?xf64> to !stencil.field<{m}x{m}x{m}xf64>
+  return
+}}"""
+FAST = (64, 2, 1)
+BROKEN = (32, 1, 1)
+
+
+class FakeRunner:
+    """Adds up per-kernel times; ``k1`` is faster with ``FAST``, ``k2`` the same with any tiling."""
+
+    target = "cuda"
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, cwd, main_name, mlir_list, tile_sizes):
+        self.calls.append(dict(tile_sizes))
+        if BROKEN in tile_sizes.values():
+            raise CompileError("oec-opt", "k1", 1)
+        time = 5.0 if tile_sizes["k1"] == FAST else 10.0
+        time += 10.0
+        # 样本全相同，区间退化为一个点
+        return Timing([time] * 3)
+
+
+@pytest.fixture
+def program(tmp_path):
+    codes = {}
+    for name, n in (("k1", 64), ("k2", 32)):
+        codes[name] = KERNEL.format(name=name, n=n, m=n + 8)
+        (tmp_path / f"{name}.mlir").write_text(codes[name])
+    return str(tmp_path), ["k1.mlir", "k2.mlir"], codes
+
+
+def test_tune(tmp_path, program):
+    cwd, mlir_list, codes = program
+    path = str(tmp_path / "db" / "tile-sizes.json")
+    runner = FakeRunner()
+    best, timing = TileTuner(runner, TuningDatabase(path)).tune(cwd, "main.cu", mlir_list)
+    assert best == {"k1": FAST, "k2": None}
+    assert float(timing) == 15.0
+    # 编译失败的候选被试过并跳过
+    assert any(trial["k1"] == BROKEN for trial in runner.calls)
+
+    database = TuningDatabase(path)
+    record = database.records[kernel_hash(codes["k1"], "cuda")]
+    assert record["tile_sizes"] == list(FAST) and record["time"] == 15.0
+    # 默认分块最快时存为 None，读出为 False，与未调优的 None 区分
+    assert database.records[kernel_hash(codes["k2"], "cuda")]["tile_sizes"] is None
+    assert database.get(codes["k2"], "cuda") is False
+    assert database.get(codes["k1"], "cuda") == FAST
+    assert database.get(codes["k1"], "cpu") is None
+    assert database.tile_sizes(cwd, mlir_list, "cuda") == {"k1": FAST}
+
+
+def test_kernel_hash_ignores_name(program):
+    _, _, codes = program
+    renamed = codes["k1"].replace("func @k1(", "func @stencil_7(")
+    assert kernel_hash(renamed, "cuda") == kernel_hash(codes["k1"], "cuda")
+    assert kernel_hash(codes["k1"], "cuda") != kernel_hash(codes["k2"], "cuda")
+
+
+def test_tuned_kernels_start_from_database(tmp_path, program):
+    cwd, mlir_list, _ = program
+    path = str(tmp_path / "tile-sizes.json")
+    first = FakeRunner()
+    TileTuner(first, TuningDatabase(path)).tune(cwd, "main.cu", mlir_list)
+    assert first.calls[0] == {"k1": None, "k2": None}
+
+    second = FakeRunner()
+    best, _ = TileTuner(second, TuningDatabase(path)).tune(cwd, "main.cu", mlir_list, kernels=["k2"])
+    assert second.calls[0] == {"k1": FAST, "k2": None}
+    assert all(trial["k1"] == FAST for trial in second.calls)
+    assert best == {"k1": FAST, "k2": None}
+
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,83 @@
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+"""The x86 stencil schedule peels the boundary off the interior loops."""
+import numpy as np
+
+import tvm
+import tvm.testing
+from tvm import te, topi
+
+
+def innermost_loops(stmt):
+    """``(loop, has_if_then_else)`` of every loop without a nested loop."""
+    if_then_else = tvm.ir.Op.get("tir.if_then_else")
+
+    def collect(node):
+        loops, calls = [], []
+
+        def visit(n):
+            if isinstance(n, tvm.tir.For):
+                loops.append(n)
+            elif isinstance(n, tvm.tir.Call) and n.op.same_as(if_then_else):
+                calls.append(n)
+
+        tvm.tir.stmt_functor.post_order_visit(node, visit)
+        return loops, calls
+
+    result = []
+    for loop in collect(stmt)[0]:
+        nested, calls = collect(loop.body)
+        if not nested:
+            result.append((loop, bool(calls)))
+    return result
+
+
+def hypterm_stage(shape=(16, 16, 48), dtype="float64"):
+    cons = te.placeholder(shape, dtype, name="cons_1")
+    return cons, topi.stencil.hypterm_1_flux_0(cons)
+
+
+def test_interior_without_condition():
+    cons, flux = hypterm_stage()
+    with tvm.target.Target("llvm"):
+        s = topi.x86.schedule_stencil([flux])
+    with tvm.transform.PassContext(opt_level=3, config=topi.x86.PARTITION_CONFIG):
+        mod = tvm.lower(s, [cons, flux])
+    loops = innermost_loops(mod["main"].body)
+    assert loops
+    assert any(not conditional for _, conditional in loops)
+
+
+@tvm.testing.requires_llvm
+def test_partitioned_matches_default():
+    cons, flux = hypterm_stage()
+    data = np.random.default_rng(0).uniform(1.0, 2.0, cons.shape).astype(cons.dtype)
+    results = []
+    for schedule in (topi.generic.default_stencil_schedule, topi.x86.schedule_stencil):
+        with tvm.target.Target("llvm"):
+            s = schedule([flux])
+        with tvm.transform.PassContext(opt_level=3, config=topi.x86.PARTITION_CONFIG):
+            func = tvm.build(s, [cons, flux], "llvm")
+        out = tvm.nd.empty(flux.shape, flux.dtype)
+        func(tvm.nd.array(data), out)
+        results.append(out.numpy())
+    tvm.testing.assert_allclose(results[1], results[0], rtol=1e-12)
+
+
+if __name__ == "__main__":
+    test_interior_without_condition()
+    test_partitioned_matches_default()